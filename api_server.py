@@ -0,0 +1,382 @@
+"""HTTP/JSON prediction API alongside the Streamlit UI.
+
+Endpoints:
+    GET  /health          readiness of the model ({"state": "loading" | "ready" | "failed"})
+    GET  /stats           micro-batch sizes and prediction cache counters
+    GET  /metrics         stage latency histograms and counters in Prometheus text format
+    POST /predict         {"N": 90, "P": 42, "K": 43, "temperature": 20.9, "humidity": 82.0,
+                           "ph": 6.5, "rainfall": 202.9}
+    POST /predict/batch   {"rows": [{...}, ...]} or {"instances": [[N, P, K, temperature, humidity, ph, rainfall], ...]}
+
+Inputs are checked against the slider bounds: out-of-range values are clamped
+and listed under "clamped", rows with non-finite values are rejected (a 400 for
+/predict, a per-row "error" entry in a batch).
+
+The model is reloaded in place when its files change or on SIGHUP.
+
+Both predict endpoints accept ``?top_k=3``. Inference runs on a bounded thread
+pool; when too many requests are queued the server answers 503 instead of
+building an unbounded backlog. Concurrent single predictions with the default
+top_k are coalesced into micro-batches (see micro_batcher.py).
+
+Usage:
+    python api_server.py --port 8080 --processes 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web
+
+import metrics
+from crop_catalogue import get_catalogue
+from crop_model import FEATURES, crop_dict
+from drift import DriftMonitor, load_reference
+from micro_batcher import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, MicroBatcher
+from model_loader import WATCH_SECONDS, ModelLoader
+from prediction_cache import create_prediction_cache, on_grid, ranking_entry
+from validation import row_issues, validate
+
+DEFAULT_TOP_K = 3
+MAX_TOP_K = len(crop_dict)
+MAX_BATCH_ROWS = 10_000
+DEFAULT_POOL_SIZE = min(8, os.cpu_count() or 1)
+# Requests allowed to wait for a pool worker before new ones are turned away
+DEFAULT_MAX_PENDING = 256
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _features_from_mapping(row):
+    if not isinstance(row, dict):
+        raise ApiError(400, "Each row must be a JSON object of feature values")
+    missing = [name for name in FEATURES if name not in row]
+    if missing:
+        raise ApiError(400, f"Missing features: {', '.join(missing)}")
+    try:
+        return [float(row[name]) for name in FEATURES]
+    except (TypeError, ValueError):
+        raise ApiError(400, "Feature values must be numbers")
+
+
+def parse_batch(payload):
+    """Feature block for a batch payload given as named rows or positional instances"""
+    if not isinstance(payload, dict):
+        raise ApiError(400, "Request body must be a JSON object")
+    if "rows" in payload:
+        rows = [_features_from_mapping(row) for row in payload["rows"]]
+    elif "instances" in payload:
+        rows = payload["instances"]
+    else:
+        raise ApiError(400, "Batch requests need a 'rows' or 'instances' list")
+    if not isinstance(rows, list) or not rows:
+        raise ApiError(400, "Batch must contain at least one row")
+    if len(rows) > MAX_BATCH_ROWS:
+        raise ApiError(413, f"Batches are limited to {MAX_BATCH_ROWS} rows")
+    try:
+        X = np.asarray(rows, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ApiError(400, "Feature values must be numbers")
+    if X.ndim != 2 or X.shape[1] != len(FEATURES):
+        raise ApiError(400, f"Each instance needs {len(FEATURES)} values in the order {', '.join(FEATURES)}")
+    return X
+
+
+def ranking_payload(labels, proba):
+    """JSON body for one row's ranked labels and probabilities"""
+    ranking = []
+    for label, probability in zip(labels, proba):
+        name = crop_dict.get(int(label), "Unknown")
+        ranking.append({"label": int(label), "crop": name, "probability": round(float(probability), 4)})
+    best = ranking[0]
+    return {"crop": best["crop"], "label": best["label"], "top_k": ranking}
+
+
+def entry_payload(entry):
+    """ranking_payload of a cached [[label, probability], ...] ranking"""
+    labels, proba = zip(*entry)
+    return ranking_payload(labels, proba)
+
+
+def with_info(result, catalogue):
+    """Copy of a (possibly cached and shared) payload with the crop's current catalogue entry"""
+    return {**result, "info": catalogue.info(result["crop"])}
+
+
+class PredictionService:
+    """Shared artifacts plus the bounded pool that runs inference off the event loop"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_pending=DEFAULT_MAX_PENDING,
+                 max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.loader = ModelLoader().start().watch(WATCH_SECONDS)
+        self.loader.add_listener(lambda loader: self.cache.set_version(loader.version))
+        self.pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api-predict")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.cache = create_prediction_cache(DEFAULT_TOP_K)
+        # Single default top-k predictions from concurrent requests share one model call
+        self.batcher = MicroBatcher(self._batch_top_k, max_batch=max_batch,
+                                    max_wait_ms=max_wait_ms, max_queue=max_pending)
+        metrics.register_collector(self.cache.metric_samples)
+        metrics.register_collector(self.batcher.metric_samples)
+        self._drift = None
+
+    def bundle(self):
+        """The live model bundle; read it once per request and use its engine and version together"""
+        if not self.loader.ready:
+            if self.loader.state == "failed":
+                raise ApiError(503, self.loader.error)
+            raise ApiError(503, "Model is still loading")
+        return self.loader.bundle
+
+    def _batch_top_k(self, X):
+        # Each row carries the version that computed it, so a batch that straddles a reload is cached correctly
+        bundle = self.loader.bundle
+        labels, proba = bundle.engine.top_k(X, DEFAULT_TOP_K)
+        return labels, proba, [bundle.version] * len(X)
+
+    @property
+    def drift(self):
+        """Drift monitor of incoming inputs, set up once the model (and so the scaler) has loaded"""
+        if self._drift is None:
+            self._drift = DriftMonitor(load_reference(self.bundle().scaler)).start()
+            metrics.register_collector(self._drift.metric_samples)
+        return self._drift
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise ApiError(503, "Server is overloaded, retry later")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def predict_one(self, features, k):
+        labels, proba = self.bundle().engine.top_k(features, k)
+        return ranking_payload(labels[0], proba[0])
+
+    async def predict_default(self, features):
+        """Default top-k prediction for one row: served from the cache or coalesced into a micro-batch"""
+        missing = object()
+        version = self.bundle().version
+        # Off the slider grid a cached entry would be another input's answer
+        cached = on_grid(features)
+        if not cached:
+            result = missing
+        elif self.cache.remote is None:
+            result = self.cache.get(features, missing, version)
+        else:
+            # This process's entries on the event loop, the shared server on the pool
+            result = self.cache.local_get(features, missing, version)
+            if result is missing:
+                result = await self.run(self.cache.remote_get, features, missing, version)
+        if result is not missing:
+            return entry_payload(result)
+        try:
+            future = self.batcher.submit(features)
+        except queue.Full:
+            raise ApiError(503, "Server is overloaded, retry later")
+        labels, proba, version = await asyncio.wrap_future(future)
+        if cached:
+            self.cache.put(features, ranking_entry(labels, proba), version)
+        return ranking_payload(labels, proba)
+
+    def predict_batch(self, X, k):
+        checked = validate(X)
+        bundle = self.bundle()
+        valid = np.flatnonzero(checked.valid)
+        rows = [tuple(values) for values in checked.X[valid].tolist()]
+        # Only rows on the slider grid are cached; see on_grid
+        cacheable = {i: values for i, values in zip(valid.tolist(), rows) if k == DEFAULT_TOP_K and on_grid(values)}
+        payloads = {}
+        if cacheable:
+            # Rows any replica has predicted before come from the cache in one lookup
+            for i, entry in zip(cacheable, self.cache.get_many(list(cacheable.values()), None, bundle.version)):
+                if entry is not None:
+                    payloads[i] = entry_payload(entry)
+        todo = [(i, values) for i, values in zip(valid.tolist(), rows) if i not in payloads]
+        if todo:
+            labels, proba = bundle.engine.top_k(checked.X[[i for i, _ in todo]], k)
+            payloads.update((i, ranking_payload(row_labels, row_proba))
+                            for (i, _), row_labels, row_proba in zip(todo, labels, proba))
+            stored = [(values, ranking_entry(row_labels, row_proba))
+                      for (i, values), row_labels, row_proba in zip(todo, labels, proba) if i in cacheable]
+            if stored:
+                self.cache.put_many(*zip(*stored), bundle.version)
+        catalogue = get_catalogue()
+        results = []
+        for i in range(len(X)):
+            if checked.invalid[i]:
+                results.append({"error": "; ".join(row_issues(X[i]))})
+                continue
+            result = with_info(payloads[i], catalogue)
+            if checked.clamped[i]:
+                result["clamped"] = row_issues(X[i])
+            results.append(result)
+        return results
+
+    def close(self):
+        self.batcher.close()
+        self.pool.shutdown(wait=False)
+
+
+def _top_k(request):
+    try:
+        k = int(request.query.get("top_k", DEFAULT_TOP_K))
+    except ValueError:
+        raise ApiError(400, "top_k must be an integer")
+    if not 1 <= k <= MAX_TOP_K:
+        raise ApiError(400, f"top_k must be between 1 and {MAX_TOP_K}")
+    return k
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ApiError(400, "Request body must be valid JSON")
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except ApiError as e:
+        return web.json_response({"error": e.message}, status=e.status)
+
+
+routes = web.RouteTableDef()
+
+
+@routes.get("/health")
+async def health(request):
+    loader = request.app["service"].loader
+    status = 200 if loader.ready else 503
+    return web.json_response(
+        {"state": loader.state, "error": loader.error, "version": loader.version, "reload_error": loader.reload_error},
+        status=status,
+    )
+
+
+@routes.get("/stats")
+async def stats(request):
+    service = request.app["service"]
+    return web.json_response({"micro_batches": service.batcher.stats(), "cache": service.cache.stats()})
+
+
+@routes.get("/drift")
+async def drift(request):
+    return web.json_response(request.app["service"].drift.report())
+
+
+@routes.get("/metrics")
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+@routes.post("/predict")
+async def predict(request):
+    service = request.app["service"]
+    k = _top_k(request)
+    raw = _features_from_mapping(await _json_body(request))
+    checked = validate(raw)
+    if checked.invalid[0]:
+        raise ApiError(400, "; ".join(row_issues(raw)))
+    features = tuple(checked.X[0].tolist())
+    service.drift.observe(raw)
+    with metrics.timed("crop_api_predict_seconds", endpoint="predict"):
+        if k == DEFAULT_TOP_K:
+            result = await service.predict_default(features)
+        else:
+            result = await service.run(service.predict_one, features, k)
+    metrics.inc("crop_predictions_total", crop=result["crop"])
+    # Catalogue entries are added per response, so an edited catalogue shows up without a cache flush
+    result = with_info(result, get_catalogue())
+    if checked.clamped[0]:
+        result["clamped"] = row_issues(raw)
+    return web.json_response(result)
+
+
+@routes.post("/predict/batch")
+async def predict_batch(request):
+    service = request.app["service"]
+    k = _top_k(request)
+    X = parse_batch(await _json_body(request))
+    service.drift.observe_many(X)
+    with metrics.timed("crop_api_predict_seconds", endpoint="batch"):
+        results = await service.run(service.predict_batch, X, k)
+    for result in results:
+        if "crop" in result:
+            metrics.inc("crop_predictions_total", crop=result["crop"])
+    return web.json_response({"predictions": results, "count": len(results)})
+
+
+def create_app(pool_size=DEFAULT_POOL_SIZE, max_pending=DEFAULT_MAX_PENDING,
+               max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    app = web.Application(middlewares=[error_middleware], client_max_size=16 * 1024 * 1024)
+    app["service"] = PredictionService(pool_size, max_pending, max_batch, max_wait_ms)
+    app.add_routes(routes)
+
+    async def reload_on_sighup(app):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, app["service"].loader.reload)
+
+    app.on_startup.append(reload_on_sighup)
+    async def close_service(app):
+        app["service"].close()
+
+    app.on_cleanup.append(close_service)
+    return app
+
+
+def serve(host, port, pool_size, max_pending, max_batch, max_wait_ms, reuse_port=False):
+    web.run_app(create_app(pool_size, max_pending, max_batch, max_wait_ms), host=host, port=port, reuse_port=reuse_port, access_log=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crop recommendation HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--processes", type=int, default=1, help="server processes sharing the port (SO_REUSEPORT)")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="inference threads per process")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING, help="queued requests before 503")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="rows per coalesced micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help="how long a micro-batch waits for more rows")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        serve(args.host, args.port, args.pool_size, args.max_pending, args.max_batch, args.max_wait_ms)
+        return
+    workers = [
+        multiprocessing.Process(
+            target=serve,
+            args=(args.host, args.port, args.pool_size, args.max_pending, args.max_batch, args.max_wait_ms, True),
+            daemon=True,
+        )
+        for _ in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+    # Pass a reload request on to every server process
+    signal.signal(signal.SIGHUP, lambda signum, frame: [os.kill(worker.pid, signal.SIGHUP) for worker in workers])
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
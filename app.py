@@ -1,11 +1,29 @@
 import streamlit as st
 import numpy as np
-import joblib
 import os
+import threading
+import time
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cache_backend
+import metrics
+import prediction_log
+from crop_catalogue import get_catalogue
+from crop_model import FEATURE_BOUNDS, FEATURES, crop_dict
+from drift import DRIFT_THRESHOLD, DriftMonitor, load_reference
+from figures import (FEATURE_LABELS, build_sensitivity_figures, create_parameter_gauge, create_radar_chart,
+                     sensitivity_from_json, sensitivity_to_json, style_figure)
+from jobs import BATCH, FINISHED, QUEUED, RASTER, RASTER_DIR, SWEEP, JobStore, JobWorker, raster_input
+from lookup_table import TABLE_DIR, DecisionTable
+from micro_batcher import MicroBatcher
+from model_loader import FAILED, LOADING, WATCH_SECONDS, ModelLoader
+from prediction_cache import get_prediction_cache, quantize, ranking_entry
+from process_pool import ProcessInferencePool
+from similar_farms import SimilarFarmsIndex
+from validation import POLICIES
 
 # Enhanced page configuration
 st.set_page_config(
@@ -15,588 +33,575 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Enhanced CSS with premium styling
-st.markdown(r"""
-<style>
-    @import url("https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap");
-    
-    /* Root variables for consistent theming */
-    :root {
-        --primary-gradient: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        --secondary-gradient: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        --success-gradient: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-        --warning-gradient: linear-gradient(135deg, #43e97b 0%, #38f9d7 100%);
-        --dark-bg: linear-gradient(135deg, #0c0c0c 0%, #1a1a2e 50%, #16213e 100%);
-        --card-bg: rgba(255, 255, 255, 0.08);
-        --border-color: rgba(255, 255, 255, 0.15);
-        --text-primary: #ffffff;
-        --text-secondary: #b8c2cc;
-        --accent-blue: #64b5f6;
-        --accent-green: #81c784;
-        --accent-purple: #ba68c8;
-        --accent-orange: #ffb74d;
-        --shadow-primary: 0 8px 32px rgba(0, 0, 0, 0.3);
-        --shadow-hover: 0 12px 40px rgba(0, 0, 0, 0.4);
-    }
-    
-    /* Global styles */
-    * {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
-    }
-    
-    /* Main container */
-    .main {
-        background: var(--dark-bg);
-        min-height: 100vh;
-        padding: 0;
-    }
-    
-    .block-container {
-        padding: 2rem 1rem;
-        max-width: 1400px;
-    }
-    
-    /* Enhanced animations */
-    @keyframes pulse-glow {
-        0% {
-            box-shadow: 0 0 20px rgba(102, 126, 234, 0.4);
-            transform: scale(1);
-        }
-        50% {
-            box-shadow: 0 0 30px rgba(102, 126, 234, 0.6);
-            transform: scale(1.02);
-        }
-        100% {
-            box-shadow: 0 0 20px rgba(102, 126, 234, 0.4);
-            transform: scale(1);
-        }
-    }
-    
-    @keyframes slide-in {
-        from {
-            opacity: 0;
-            transform: translateY(30px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    @keyframes gradient-shift {
-        0% { background-position: 0% 50%; }
-        50% { background-position: 100% 50%; }
-        100% { background-position: 0% 50%; }
-    }
-    
-    /* Header styling */
-    .main-header {
-        text-align: center;
-        padding: 3rem 0 2rem 0;
-        background: var(--primary-gradient);
-        background-size: 400% 400%;
-        animation: gradient-shift 8s ease infinite;
-        margin: -2rem -1rem 2rem -1rem;
-        border-radius: 0 0 30px 30px;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .main-header::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        right: 0;
-        bottom: 0;
-        background: url('data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><defs><pattern id="grain" width="100" height="100" patternUnits="userSpaceOnUse"><circle cx="50" cy="50" r="1" fill="rgba(255,255,255,0.1)"/></pattern></defs><rect width="100" height="100" fill="url(%23grain)"/></svg>');
-        opacity: 0.3;
-    }
-    
-    .main-header h1 {
-        color: var(--text-primary);
-        font-size: 3.5rem;
-        font-weight: 800;
-        margin: 0;
-        text-shadow: 2px 2px 20px rgba(0, 0, 0, 0.5);
-        position: relative;
-        z-index: 1;
-    }
-    
-    .main-header p {
-        color: rgba(255, 255, 255, 0.9);
-        font-size: 1.3rem;
-        font-weight: 400;
-        margin-top: 0.5rem;
-        position: relative;
-        z-index: 1;
-    }
-    
-    /* Enhanced card styling */
-    .premium-card {
-        background: var(--card-bg);
-        backdrop-filter: blur(20px);
-        border: 1px solid var(--border-color);
-        border-radius: 20px;
-        padding: 2rem;
-        margin-bottom: 1.5rem;
-        box-shadow: var(--shadow-primary);
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        animation: slide-in 0.6s ease-out;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .premium-card::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 2px;
-        background: var(--primary-gradient);
-        border-radius: 20px 20px 0 0;
-    }
-    
-    .premium-card:hover {
-        transform: translateY(-8px);
-        box-shadow: var(--shadow-hover);
-        border-color: rgba(255, 255, 255, 0.25);
-    }
-    
-    /* Feature grid */
-    .feature-grid {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-        gap: 1.5rem;
-        margin: 2rem 0;
-    }
-    
-    .feature-item {
-        text-align: center;
-        padding: 2rem 1rem;
-        background: var(--card-bg);
-        border-radius: 16px;
-        border: 1px solid var(--border-color);
-        transition: all 0.3s ease;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .feature-item::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: -100%;
-        width: 100%;
-        height: 100%;
-        background: linear-gradient(90deg, transparent, rgba(255, 255, 255, 0.1), transparent);
-        transition: left 0.5s;
-    }
-    
-    .feature-item:hover::before {
-        left: 100%;
-    }
-    
-    .feature-item:hover {
-        transform: translateY(-5px);
-        border-color: var(--accent-blue);
-        box-shadow: 0 10px 30px rgba(100, 181, 246, 0.2);
-    }
-    
-    .feature-icon {
-        font-size: 3rem;
-        margin-bottom: 1rem;
-        display: block;
-    }
-    
-    /* Enhanced button styling */
-    .stButton > button {
-        width: 100%;
-        background: var(--primary-gradient) !important;
-        color: var(--text-primary) !important;
-        border: none !important;
-        border-radius: 16px !important;
-        padding: 1rem 2rem !important;
-        font-size: 1.1rem !important;
-        font-weight: 600 !important;
-        text-transform: uppercase !important;
-        letter-spacing: 1px !important;
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        position: relative !important;
-        overflow: hidden !important;
-        box-shadow: var(--shadow-primary) !important;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-3px) !important;
-        box-shadow: var(--shadow-hover) !important;
-        background: var(--secondary-gradient) !important;
-    }
-    
-    .stButton > button:active {
-        transform: translateY(-1px) !important;
-    }
-    
-    /* Enhanced slider styling */
-    .stSlider {
-        padding: 1.5rem 0;
-    }
-    
-    .stSlider > div > div > div > div {
-        background: var(--primary-gradient) !important;
-        border-radius: 10px !important;
-    }
-    
-    .stSlider > div > div > div > div > div {
-        background: var(--text-primary) !important;
-        border-radius: 50% !important;
-        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.3) !important;
-        border: 3px solid var(--accent-blue) !important;
-    }
-    
-    /* Enhanced input styling */
-    .stNumberInput > div > div > input {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--border-color) !important;
-        border-radius: 12px !important;
-        color: var(--text-primary) !important;
-        padding: 0.75rem !important;
-        transition: all 0.3s ease !important;
-    }
-    
-    .stNumberInput > div > div > input:focus {
-        border-color: var(--accent-blue) !important;
-        box-shadow: 0 0 20px rgba(100, 181, 246, 0.3) !important;
-    }
-    
-    /* Tab styling */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 12px;
-        background: var(--card-bg);
-        padding: 8px;
-        border-radius: 16px;
-        border: 1px solid var(--border-color);
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        background: transparent !important;
-        border-radius: 12px !important;
-        color: var(--text-secondary) !important;
-        padding: 12px 24px !important;
-        font-weight: 500 !important;
-        transition: all 0.3s ease !important;
-        border: 1px solid transparent !important;
-    }
-    
-    .stTabs [data-baseweb="tab"]:hover {
-        background: rgba(255, 255, 255, 0.05) !important;
-        color: var(--text-primary) !important;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background: var(--primary-gradient) !important;
-        color: var(--text-primary) !important;
-        border: 1px solid var(--accent-blue) !important;
-        box-shadow: 0 4px 16px rgba(100, 181, 246, 0.3) !important;
-    }
-    
-    /* Result card styling */
-    .result-card {
-        background: var(--success-gradient);
-        border-radius: 24px;
-        padding: 3rem 2rem;
-        text-align: center;
-        box-shadow: var(--shadow-primary);
-        animation: pulse-glow 3s ease-in-out infinite;
-        margin: 2rem 0;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .result-card::before {
-        content: '';
-        position: absolute;
-        top: -50%;
-        left: -50%;
-        width: 200%;
-        height: 200%;
-        background: linear-gradient(45deg, transparent, rgba(255, 255, 255, 0.1), transparent);
-        animation: gradient-shift 4s ease infinite;
-    }
-    
-    .result-card h1 {
-        font-size: 4rem !important;
-        font-weight: 800 !important;
-        color: var(--text-primary) !important;
-        margin: 0 !important;
-        text-shadow: 2px 2px 20px rgba(0, 0, 0, 0.3) !important;
-        position: relative;
-        z-index: 1;
-    }
-    
-    .result-card h2 {
-        font-size: 1.5rem !important;
-        color: rgba(255, 255, 255, 0.9) !important;
-        margin-bottom: 1rem !important;
-        position: relative;
-        z-index: 1;
-    }
-    
-    /* Detail cards */
-    .detail-grid {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-        gap: 1.5rem;
-        margin-top: 2rem;
-    }
-    
-    .detail-item {
-        background: var(--card-bg);
-        border-radius: 16px;
-        padding: 2rem 1.5rem;
-        text-align: center;
-        border: 1px solid var(--border-color);
-        transition: all 0.3s ease;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .detail-item:nth-child(1) { border-top: 3px solid var(--accent-green); }
-    .detail-item:nth-child(2) { border-top: 3px solid var(--accent-blue); }
-    .detail-item:nth-child(3) { border-top: 3px solid var(--accent-purple); }
-    .detail-item:nth-child(4) { border-top: 3px solid var(--accent-orange); }
-    
-    .detail-item:hover {
-        transform: translateY(-8px);
-        box-shadow: var(--shadow-hover);
-    }
-    
-    .detail-item h4 {
-        font-size: 1.2rem;
-        margin-bottom: 0.5rem;
-        font-weight: 600;
-    }
-    
-    .detail-item p {
-        font-size: 1.1rem;
-        color: var(--text-secondary);
-        margin: 0;
-    }
-    
-    /* Section headers */
-    .section-header {
-        color: var(--text-primary) !important;
-        font-size: 2rem !important;
-        font-weight: 700 !important;
-        margin-bottom: 1rem !important;
-        text-align: center;
-        position: relative;
-    }
-    
-    .section-header::after {
-        content: '';
-        position: absolute;
-        bottom: -8px;
-        left: 50%;
-        transform: translateX(-50%);
-        width: 60px;
-        height: 3px;
-        background: var(--primary-gradient);
-        border-radius: 2px;
-    }
-    
-    /* Parameter cards */
-    .param-section {
-        background: var(--card-bg);
-        border-radius: 20px;
-        padding: 2rem;
-        border: 1px solid var(--border-color);
-        margin-bottom: 1.5rem;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .param-section::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 3px;
-        background: var(--primary-gradient);
-    }
-    
-    /* Chart container */
-    .chart-container {
-        background: var(--card-bg);
-        border-radius: 20px;
-        padding: 2rem;
-        border: 1px solid var(--border-color);
-        box-shadow: var(--shadow-primary);
-        margin: 2rem 0;
-    }
-    
-    /* Footer styling */
-    .footer {
-        background: var(--card-bg);
-        border-radius: 20px;
-        padding: 2rem;
-        text-align: center;
-        margin-top: 3rem;
-        border: 1px solid var(--border-color);
-        box-shadow: var(--shadow-primary);
-    }
-    
-    .footer a {
-        color: var(--accent-blue);
-        text-decoration: none;
-        font-weight: 500;
-        transition: all 0.3s ease;
-    }
-    
-    .footer a:hover {
-        color: var(--text-primary);
-        text-shadow: 0 0 10px var(--accent-blue);
-    }
-    
-    /* Loading spinner */
-    .stSpinner {
-        border-color: var(--accent-blue) !important;
-    }
-    
-    /* Alert styling */
-    .stAlert {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--border-color) !important;
-        border-radius: 16px !important;
-        backdrop-filter: blur(20px) !important;
-    }
-    
-    /* Responsive design */
-    @media (max-width: 768px) {
-        .main-header h1 {
-            font-size: 2.5rem;
-        }
-        
-        .feature-grid {
-            grid-template-columns: 1fr;
-        }
-        
-        .detail-grid {
-            grid-template-columns: 1fr;
-        }
-        
-        .block-container {
-            padding: 1rem 0.5rem;
-        }
-    }
-    
-    /* Hide Streamlit elements */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    
-    /* Custom scrollbar */
-    ::-webkit-scrollbar {
-        width: 8px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: rgba(255, 255, 255, 0.1);
-        border-radius: 4px;
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: var(--primary-gradient);
-        border-radius: 4px;
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: var(--secondary-gradient);
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Load the model and scaler
+# Enhanced CSS with premium styling, served once as a static asset from static/style.css
+STYLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "style.css")
+# Inline the stylesheet instead, for deployments without static file serving
+INLINE_CSS = os.environ.get("CROP_INLINE_CSS") == "1"
+# Show bytes rendered and rerun time in the sidebar
+RENDER_REPORT = os.environ.get("CROP_RENDER_REPORT") == "1"
+
+@st.cache_data
+def load_stylesheet():
+    with open(STYLE_PATH, encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
+
+def render_html(markup):
+    """Render trusted HTML and count it towards this rerun's payload"""
+    stats = st.session_state.get("render_stats")
+    size = len(markup.encode("utf-8"))
+    if stats is not None:
+        stats["bytes"] += size
+        stats["blocks"] += 1
+    metrics.inc("crop_html_bytes_total", size)
+    with metrics.timed("crop_html_render_seconds"):
+        st.markdown(markup, unsafe_allow_html=True)
+
+def render_styles():
+    if INLINE_CSS:
+        render_html(load_stylesheet())
+    else:
+        # A one-line import; the browser fetches and caches the stylesheet once
+        render_html('<style>@import url("app/static/style.css");</style>')
+
+def start_render_report():
+    st.session_state["render_stats"] = {"bytes": 0, "blocks": 0, "start": time.perf_counter()}
+
+def show_render_report():
+    stats = st.session_state.get("render_stats")
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - stats["start"]
+    metrics.observe("crop_rerun_seconds", elapsed)
+    if RENDER_REPORT:
+        elapsed_ms = elapsed * 1000
+        st.sidebar.caption(f"📦 {stats['bytes']:,} bytes of HTML in {stats['blocks']} blocks • rerun {elapsed_ms:.0f} ms")
+
+# Load the model and scaler in the background so the page renders while it warms up
+@st.cache_resource
+def get_model_loader():
+    loader = ModelLoader().start().watch(WATCH_SECONDS)
+    # Results of the previous model must not be served after a hot reload
+    loader.add_listener(lambda loader: get_prediction_cache(TOP_K).set_version(loader.version))
+    return loader
+
+def wait_for_model():
+    """Show the warm-up state while the model loads and return the model bundle once ready"""
+    loader = get_model_loader()
+    if loader.state == LOADING:
+        with st.spinner("🤖 Model warming up..."):
+            loader.wait()
+    if loader.state == FAILED:
+        st.error(f"Unable to load the model. {loader.error}")
+        return None
+    return loader.bundle
+
+get_model_loader()
+
 @st.cache_resource
-def load_model():
+def load_decision_table(model_version):
+    """Load the precomputed decision table if one was built for this model version (cached per version)"""
+    if not os.path.exists(os.path.join(TABLE_DIR, "meta.json")):
+        return None
     try:
-        model = joblib.load('crop_recommendation_model.pkl')
-        scaler = joblib.load('scaler.pkl')
-        return model, scaler
-    except FileNotFoundError:
-        st.error("Model files not found. Please ensure 'crop_recommendation_model.pkl' and 'scaler.pkl' are in the app directory.")
+        table = DecisionTable.load(TABLE_DIR)
+    except ValueError:
+        return None
+    # A table built for another model would answer with that model's crops
+    return None if table.is_stale(model_version) else table
+
+# Only show the spinner when inference overruns this budget (milliseconds)
+LATENCY_BUDGET_MS = float(os.environ.get("CROP_LATENCY_BUDGET_MS", "150"))
+
+@st.cache_resource
+def get_prediction_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="predict")
+
+def run_with_latency_budget(fn, *args, message="Working...", budget_ms=None):
+    """Run fn and only show a spinner if it takes longer than the latency budget"""
+    if budget_ms is None:
+        budget_ms = LATENCY_BUDGET_MS
+    future = get_prediction_executor().submit(fn, *args)
+    done, _ = wait([future], timeout=budget_ms / 1000.0)
+    if not done:
+        with st.spinner(message):
+            return future.result()
+    return future.result()
+
+# Number of ranked crops shown with each recommendation
+TOP_K = int(os.environ.get("CROP_TOP_K", "3"))
+
+# Concurrent sessions' predictions are coalesced into one batched model call
+MICROBATCH_WAIT_MS = float(os.environ.get("CROP_MICROBATCH_WAIT_MS", "2"))
+MICROBATCH_MAX = int(os.environ.get("CROP_MICROBATCH_MAX", "64"))
+
+@st.cache_resource
+def get_batcher():
+    loader = get_model_loader()
+
+    def top_k(X):
+        # Each row carries the version that computed it, so a batch that straddles a reload can be told apart
+        bundle = loader.bundle
+        labels, proba = bundle.engine.top_k(X, TOP_K)
+        return labels, proba, [bundle.version] * len(X)
+
+    return MicroBatcher(top_k, max_batch=MICROBATCH_MAX, max_wait_ms=MICROBATCH_WAIT_MS)
+
+# Worker processes for inference so concurrent sessions are not serialized on the GIL (0 = in-process)
+INFERENCE_PROCESSES = int(os.environ.get("CROP_INFERENCE_PROCESSES", "0"))
+
+@st.cache_resource
+def get_inference_pool():
+    """(pool, error): the worker pool, or None and why it could not start (predictions then run in-process)"""
+    if INFERENCE_PROCESSES <= 0:
+        return None, None
+    loader = get_model_loader()
+    if not loader.wait():
         return None, None
+    pool = ProcessInferencePool(INFERENCE_PROCESSES, loader.model_path, loader.scaler_path, loader.mmap_mode)
+    try:
+        pool.start()
+    except RuntimeError as e:
+        pool.close()
+        return None, str(e)
+    # The model version the workers serve; None while they reload or after a failed reload
+    pool.version = loader.version
+
+    def reload_pool(loader):
+        pool.version = None
+        pool.reload()
+        pool.version = loader.version
+
+    loader.add_listener(reload_pool)
+    return pool, None
+
+# Resolved here because predictions run on executor threads outside the script context
+batcher = get_batcher()
+inference_pool, inference_pool_error = get_inference_pool()
+
+# Background job workers running in this process (0 = leave jobs to `python jobs.py worker`)
+JOB_WORKERS = int(os.environ.get("CROP_JOB_WORKERS", "1"))
+
+@st.cache_resource
+def get_job_store():
+    return JobStore()
+
+@st.cache_resource
+def start_job_workers():
+    store, loader = get_job_store(), get_model_loader()
+    return [JobWorker(store, loader).start() for _ in range(JOB_WORKERS)]
+
+start_job_workers()
+
+# Past inputs and their crops, searched for the "similar fields" panel
+@st.cache_resource
+def get_similar_index():
+    loader = get_model_loader()
+    if not loader.wait():
+        return None
+    try:
+        return SimilarFarmsIndex(scaler=loader.scaler).autoflush()
+    except OSError:
+        # Read-only install: the app works without the panel
+        return None
+
+# Every recommendation is logged for the Analytics Dashboard
+@st.cache_resource
+def get_prediction_log():
+    return prediction_log.PredictionLog().start()
+
+# Running input statistics compared against the training data
+@st.cache_resource
+def get_drift_monitor():
+    loader = get_model_loader()
+    if not loader.wait():
+        return None
+    monitor = DriftMonitor(load_reference(loader.scaler)).start()
+    metrics.register_collector(monitor.metric_samples)
+    return monitor
+
+CROP_CODES = {name: code for code, name in crop_dict.items()}
+
+def record_prediction(features, crop, probability, version):
+    """Log one prediction, feed the drift monitor and add it to the similar-fields index (all buffered)"""
+    code = CROP_CODES.get(crop, 0)
+    monitor = get_drift_monitor()
+    if monitor is not None:
+        monitor.observe(features)
+    get_prediction_log().record(features, code, probability, "ui", version)
+    index = get_similar_index()
+    if index is not None and code:
+        index.add([features], code)
+
+# Serve /metrics (Prometheus text) and /metrics.json from this process on this port; unset = off
+METRICS_PORT = os.environ.get("CROP_METRICS_PORT")
+
+@st.cache_resource
+def start_metrics():
+    cache = get_prediction_cache(TOP_K)
+    metrics.register_collector(cache.metric_samples)
+    metrics.register_collector(batcher.metric_samples)
+    metrics.register_collector(get_job_store().metric_samples)
+    metrics.register_collector(get_prediction_log().metric_samples)
+    if METRICS_PORT:
+        return metrics.start_http_server(int(METRICS_PORT))
+    return None
+
+start_metrics()
+
+def rank_labels(bundle, features):
+    """Top-k labels and probabilities, and whether they are the decision table's approximation
+
+    The table snaps inputs to its nearest grid node and only runs the model in
+    boundary cells, so elsewhere its ranking is the node's, not the inputs'.
+    """
+    # The workers only answer for the model this request started with
+    pool = inference_pool if inference_pool is not None and inference_pool.version == bundle.version else None
+    # Loaded for the request's model, so it is only looked up once that model is ready, and again after a reload
+    decision_table = load_decision_table(bundle.version)
+    if decision_table is not None and TOP_K <= decision_table.k:
+        with metrics.timed("crop_predict_seconds", path="table"):
+            try:
+                labels, proba = decision_table.top_k(features, TOP_K, pool or bundle.engine)
+            except RuntimeError:
+                metrics.inc("crop_pool_fallbacks_total")
+                labels, proba = decision_table.top_k(features, TOP_K, bundle.engine)
+            _, boundary = decision_table.lookup(features)
+        return labels[0], proba[0], not boundary[0]
+    if pool is not None:
+        with metrics.timed("crop_predict_seconds", path="processes"):
+            try:
+                labels, proba = pool.top_k(features, TOP_K)
+                return labels[0], proba[0], False
+            except RuntimeError:
+                # A worker died or could not load the current model
+                metrics.inc("crop_pool_fallbacks_total")
+    # Includes the wait for other sessions' rows to join the micro-batch
+    with metrics.timed("crop_predict_seconds", path="batcher"):
+        labels, proba, version = batcher.predict(features)
+    if version != bundle.version:
+        # The batch ran on a model swapped in after this request started: answer with the request's own
+        labels, proba = bundle.engine.top_k(features, TOP_K)
+        return labels[0], proba[0], False
+    return labels, proba, False
+
+def recommend_crops(bundle, N, P, K, temperature, humidity, ph, rainfall):
+    """Ranked (crop name, probability) pairs for a single set of soil and climate readings, and whether approximate"""
+    values = (N, P, K, temperature, humidity, ph, rainfall)
+    cache = get_prediction_cache(TOP_K)
+    entry = cache.get(values, None, bundle.version)
+    approximate = False
+    if entry is None:
+        labels, proba, approximate = rank_labels(bundle, values)
+        entry = ranking_entry(labels, proba)
+        # The API and other replicas serve cached entries as the model's answer, so table approximations stay out
+        if not approximate:
+            cache.put(values, entry, bundle.version)
+    ranking = tuple((crop_dict.get(label, "Unknown"), probability) for label, probability in entry)
+    metrics.inc("crop_predictions_total", crop=ranking[0][0])
+    return ranking, approximate
+
+def fit_note(catalogue, crop, temperature_ok, ph_ok):
+    """Short note on whether the current temperature and pH suit a crop"""
+    if crop not in catalogue:
+        return "no catalogue entry"
+    if temperature_ok and ph_ok:
+        return "temperature and pH in range"
+    outside = [name for name, ok in (("temperature", temperature_ok), ("pH", ph_ok)) if not ok]
+    return f"{' and '.join(outside)} outside its range"
+
+@st.cache_data(max_entries=4)
+def build_encyclopedia_html(_catalogue, version):
+    """HTML for every Crop Encyclopedia card, laid out as one CSS grid (rebuilt when the catalogue file changes)"""
+    cards = []
+    for crop, info in _catalogue.items():
+        cards.append(f"""<div class="premium-card" style="min-height: 300px;">
+<div style="text-align: center; margin-bottom: 1rem;">
+<span style="font-size: 4rem;">{info["icon"]}</span>
+<h3 style="color: #ffffff; margin: 0.5rem 0;">{crop}</h3>
+</div>
+<div style="space-y: 0.5rem;">
+<p><strong style="color: #81c784;">Season:</strong> <span style="color: #b8c2cc;">{info["season"]}</span></p>
+<p><strong style="color: #64b5f6;">Water Needs:</strong> <span style="color: #b8c2cc;">{info["water_req"]}</span></p>
+<p><strong style="color: #ba68c8;">Temperature:</strong> <span style="color: #b8c2cc;">{info["temp_range"]}</span></p>
+<p><strong style="color: #ffb74d;">pH Range:</strong> <span style="color: #b8c2cc;">{info["ph_range"]}</span></p>
+</div>
+</div>""")
+    return '<div class="crop-grid">\n' + "\n".join(cards) + "\n</div>"
+
+# Figures are built once per process and patched in place on later reruns. Plotly
+# figures are mutable, so each one is guarded by a lock while it is patched and sent.
+@st.cache_resource
+def gauge_figure(min_val, max_val, title):
+    return create_parameter_gauge(min_val, min_val, max_val, title), threading.Lock()
+
+@st.cache_resource
+def radar_figure():
+    return create_radar_chart([0] * 7), threading.Lock()
+
+def render_gauge(value, min_val, max_val, title):
+    fig, lock = gauge_figure(min_val, max_val, title)
+    with lock, metrics.timed("crop_figure_render_seconds", chart="gauge"):
+        if fig.data[0].value != value:
+            fig.data[0].value = value
+        st.plotly_chart(fig, use_container_width=True)
+
+def render_radar(values):
+    fig, lock = radar_figure()
+    with lock, metrics.timed("crop_figure_render_seconds", chart="radar"):
+        if list(fig.data[0].r) != list(values):
+            fig.data[0].r = values
+        st.plotly_chart(fig, use_container_width=True)
+
+def lazy_tabs(labels):
+    """Tabs that rerun the script on switch, so inactive tabs can skip rendering"""
+    try:
+        return st.tabs(labels, on_change="rerun")
+    except TypeError:
+        # Older Streamlit without lazy tabs: every tab renders on each rerun
+        return st.tabs(labels)
+
+def tab_is_open(tab):
+    return getattr(tab, "open", None) is not False
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def sensitivity_figures(_engine, features, pair, model_version):
+    """Sensitivity figures cached per input state, so toggling the panel is free
 
-model, scaler = load_model()
-
-# Enhanced crop dictionary and information
-crop_dict = {
-    1: 'Rice', 2: 'Maize', 3: 'Jute', 4: 'Cotton', 5: 'Coconut',
-    6: 'Papaya', 7: 'Orange', 8: 'Apple', 9: 'Muskmelon', 10: 'Watermelon',
-    11: 'Grapes', 12: 'Mango', 13: 'Banana', 14: 'Pomegranate', 15: 'Lentil',
-    16: 'Blackgram', 17: 'Mungbean', 18: 'Mothbeans', 19: 'Pigeonpeas',
-    20: 'Kidneybeans', 21: 'Chickpea', 22: 'Coffee'
-}
-
-crop_info = {
-    'Rice': {'season': 'Kharif (Jun-Oct)', 'water_req': 'High (1200-1800mm)', 'temp_range': '20-35°C', 'ph_range': '5.5-7.0', 'icon': '🌾'},
-    'Maize': {'season': 'Kharif/Rabi', 'water_req': 'Medium (600-1000mm)', 'temp_range': '20-30°C', 'ph_range': '6.0-7.5', 'icon': '🌽'},
-    'Cotton': {'season': 'Kharif (Apr-Oct)', 'water_req': 'Medium (700-1200mm)', 'temp_range': '20-30°C', 'ph_range': '5.8-8.0', 'icon': '🌸'},
-    'Apple': {'season': 'Spring (Mar-May)', 'water_req': 'Medium (800-1200mm)', 'temp_range': '21-24°C', 'ph_range': '6.0-7.0', 'icon': '🍎'},
-    'Mango': {'season': 'Summer (Mar-Jun)', 'water_req': 'Medium (750-1200mm)', 'temp_range': '24-27°C', 'ph_range': '5.5-7.5', 'icon': '🥭'},
-    'Coffee': {'season': 'Year-round', 'water_req': 'High (1500-2000mm)', 'temp_range': '15-28°C', 'ph_range': '6.0-6.5', 'icon': '☕'},
-    'Banana': {'season': 'Year-round', 'water_req': 'High (1200-2000mm)', 'temp_range': '26-30°C', 'ph_range': '6.0-7.5', 'icon': '🍌'},
-    'Grapes': {'season': 'Winter (Nov-Feb)', 'water_req': 'Medium (600-800mm)', 'temp_range': '15-25°C', 'ph_range': '6.0-7.0', 'icon': '🍇'},
-    'Orange': {'season': 'Winter (Oct-Feb)', 'water_req': 'Medium (800-1200mm)', 'temp_range': '13-26°C', 'ph_range': '6.0-7.5', 'icon': '🍊'},
-    'Coconut': {'season': 'Year-round', 'water_req': 'High (1200-2000mm)', 'temp_range': '27-30°C', 'ph_range': '5.2-8.0', 'icon': '🥥'},
-}
-
-def create_parameter_gauge(value, min_val, max_val, title, optimal_range=None):
-    """Create a beautiful gauge chart for parameters"""
-    fig = go.Figure(go.Indicator(
-        mode = "gauge+number+delta",
-        value = value,
-        domain = {'x': [0, 1], 'y': [0, 1]},
-        title = {'text': title, 'font': {'size': 16, 'color': '#ffffff'}},
-        delta = {'reference': (min_val + max_val) / 2},
-        gauge = {
-            'axis': {'range': [min_val, max_val], 'tickcolor': '#ffffff'},
-            'bar': {'color': "#667eea"},
-            'steps': [
-                {'range': [min_val, max_val * 0.3], 'color': "rgba(255, 182, 193, 0.3)"},
-                {'range': [max_val * 0.3, max_val * 0.7], 'color': "rgba(255, 255, 0, 0.3)"},
-                {'range': [max_val * 0.7, max_val], 'color': "rgba(144, 238, 144, 0.3)"}
-            ],
-            'threshold': {
-                'line': {'color': "red", 'width': 4},
-                'thickness': 0.75,
-                'value': max_val * 0.9
-            }
-        }
-    ))
-    
-    fig.update_layout(
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        font={'color': '#ffffff', 'family': 'Inter'},
-        height=200
-    )
-    
-    return fig
+    _engine must be the engine of model_version (it is not part of the cache key).
+    With a shared cache server, a state any replica has swept is fetched instead of recomputed.
+    """
+    backend = cache_backend.get_backend()
+    if backend is None:
+        return build_sensitivity_figures(_engine, features, pair)
+    key = cache_backend.encode_key(cache_backend.SENSITIVITY, model_version, quantize(features),
+                                   bytes(FEATURES.index(name) for name in pair))
+    cached = backend.get(key)
+    if cached is not None:
+        try:
+            return sensitivity_from_json(cached)
+        except (KeyError, TypeError, ValueError):
+            pass  # Written by an incompatible version: rebuild it
+    figures = build_sensitivity_figures(_engine, features, pair)
+    backend.put(key, sensitivity_to_json(figures))
+    return figures
+
+def render_sensitivity_panel(bundle, features):
+    """What-if panel: where the recommendation changes as each parameter moves"""
+    col_x, col_y = st.columns(2)
+    with col_x:
+        x_name = st.selectbox("Map across", FEATURES, index=FEATURES.index("N"), format_func=FEATURE_LABELS.get)
+    with col_y:
+        others = [name for name in FEATURES if name != x_name]
+        y_name = st.selectbox("and", others, index=others.index("rainfall") if "rainfall" in others else 0,
+                              format_func=FEATURE_LABELS.get)
+    baseline, strips, heatmap, changes = sensitivity_figures(bundle.engine, tuple(features), (x_name, y_name),
+                                                             bundle.version)
+
+    items = []
+    for name in FEATURES:
+        below, above = changes[name]
+        parts = []
+        if below:
+            parts.append(f"↓ {below[1]} at {below[0]:g}")
+        if above:
+            parts.append(f"↑ {above[1]} at {above[0]:g}")
+        items.append(f"""
+                                <div class="detail-item">
+                                    <h4>{FEATURE_LABELS[name]}</h4>
+                                    <p>{" · ".join(parts) if parts else f"{baseline} across the whole range"}</p>
+                                </div>""")
+    render_html(f"""
+                        <div class="premium-card">
+                            <h3 class="section-header">🔬 What changes {baseline}?</h3>
+                            <div class="detail-grid">{"".join(items)}
+                            </div>
+                        </div>
+                        """)
+    st.plotly_chart(strips, use_container_width=True)
+    st.plotly_chart(heatmap, use_container_width=True)
+
+# Summaries are rewritten on every log flush, so a few seconds of staleness is fine
+@st.cache_data(ttl=5, show_spinner=False)
+def prediction_log_summary():
+    return prediction_log.aggregate()
+
+def render_prediction_log_panel():
+    """Crop mix and input distributions over the prediction log, from its segment summaries"""
+    summary = prediction_log_summary()
+    if not summary["rows"]:
+        st.caption("No predictions logged yet.")
+        return
+    since = time.strftime("%Y-%m-%d %H:%M", time.localtime(summary["start"]))
+    st.caption(f"{summary['rows']:,} predictions logged since {since}")
+    crops = summary["crops"]
+    fig = px.bar(x=list(crops), y=list(crops.values()), labels={"x": "Crop", "y": "Predictions"},
+                 color_discrete_sequence=["#667eea"])
+    st.plotly_chart(style_figure(fig, "Recommended Crop Mix", 360), use_container_width=True)
+
+    name = st.selectbox("Input distribution", FEATURES, format_func=FEATURE_LABELS.get, key="log_feature")
+    feature = summary["features"][name]
+    edges = np.array(feature["edges"])
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=feature["counts"], width=np.diff(edges),
+                           marker_color="#64b5f6"))
+    fig.update_xaxes(title=FEATURE_LABELS[name])
+    fig.update_yaxes(title="Predictions")
+    title = f"{FEATURE_LABELS[name]}: mean {feature['mean']:.2f}, std {feature['std']:.2f}"
+    st.plotly_chart(style_figure(fig, title, 320), use_container_width=True)
+
+def render_drift_panel():
+    """Drift score of every input against the training data, for the recent window of predictions"""
+    monitor = get_drift_monitor()
+    report = monitor.report() if monitor is not None else None
+    if report is not None and report["reference"] is None:
+        st.caption("No drift reference: the model's scaler has no training statistics. "
+                   "Build one with `python drift.py reference training.csv`.")
+        return
+    if not report or not report["observations"]:
+        st.caption("No inputs observed since the app started.")
+        return
+    window = report["window"]
+    scores = [window[name]["score"] for name in FEATURES]
+    colors = ["#e57373" if window[name]["drifted"] else "#81c784" for name in FEATURES]
+    fig = go.Figure(go.Bar(x=scores, y=[FEATURE_LABELS[name] for name in FEATURES], orientation="h",
+                           marker_color=colors))
+    fig.add_vline(x=DRIFT_THRESHOLD, line_dash="dash", line_color="#ffb74d")
+    fig.update_xaxes(title="Drift score (1 = alert)")
+    st.plotly_chart(style_figure(fig, "Input Drift vs Training Data", 320), use_container_width=True)
+    st.caption(f"{window[FEATURES[0]]['count']:,} recent inputs of {report['observations']:,} since startup, "
+               f"compared with {report['reference']}")
+    drifted = [FEATURE_LABELS[name] for name in FEATURES if window[name]["drifted"]]
+    if drifted:
+        st.warning(f"Inputs have drifted away from the training data: {', '.join(drifted)}")
+
+def render_similar_fields(features, k=5):
+    """Past fields closest to the current inputs, with the crop recommended there"""
+    index = get_similar_index()
+    if index is None or not len(index):
+        st.caption("No past fields recorded yet.")
+        return
+    nearest = index.nearest(features, k)
+    nearest[FEATURES] = nearest[FEATURES].round(2)
+    nearest["when"] = pd.to_datetime(nearest["time"], unit="s").dt.strftime("%Y-%m-%d %H:%M")
+    table = nearest[["crop", *FEATURES, "distance", "when"]].rename(columns=FEATURE_LABELS)
+    st.dataframe(table, hide_index=True, use_container_width=True,
+                 column_config={"distance": st.column_config.NumberColumn(format="%.3f")})
+
+def auto_refresh(seconds):
+    """Rerun the decorated block on its own every few seconds, where Streamlit supports fragments"""
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment is None:
+        return lambda fn: fn
+    return fragment(run_every=seconds)
+
+# Larger results (district maps) are pointed to on disk instead of being read into memory for a download button
+JOB_DOWNLOAD_MAX_BYTES = int(os.environ.get("CROP_JOB_DOWNLOAD_MAX_BYTES", 32 * 1024 * 1024))
+
+# Small result files stay in memory for the download buttons; a few are enough
+@st.cache_resource(max_entries=4)
+def job_result_bytes(path, mtime_ns):
+    with open(path, "rb") as f:
+        return f.read()
+
+def render_job_result(job, path):
+    """Download button for a small result file, its location on disk for a large one"""
+    stat = os.stat(path)
+    if stat.st_size > JOB_DOWNLOAD_MAX_BYTES:
+        st.caption(f"📁 {stat.st_size / 2**20:,.0f} MB result saved to `{path}`")
+        return
+    name = os.path.basename(path)
+    st.download_button(f"⬇️ {name}", job_result_bytes(path, stat.st_mtime_ns), file_name=f"{job['id']}-{name}",
+                       key=f"job_dl_{job['id']}_{name}")
+
+def submit_job_forms(features):
+    """Forms that queue background jobs for the current inputs"""
+    store = get_job_store()
+    with st.form("batch_job", clear_on_submit=True):
+        upload = st.file_uploader("Soil survey (CSV or Parquet)", type=["csv", "parquet"])
+        col_k, col_policy = st.columns(2)
+        with col_k:
+            top_k = st.number_input("Ranked crops per row", min_value=1, max_value=len(crop_dict), value=1)
+        with col_policy:
+            policy = st.selectbox("Out-of-range values", POLICIES)
+        if st.form_submit_button("📤 Queue batch prediction") and upload is not None:
+            job_id = store.submit(BATCH, {"top_k": int(top_k), "out_of_range": policy},
+                                  upload=(upload.name, upload.getvalue()))
+            st.success(f"Queued job {job_id}")
+
+    with st.expander("🔬 Dense what-if grid around the current inputs"):
+        col_x, col_y, col_points = st.columns(3)
+        with col_x:
+            x_name = st.selectbox("First parameter", FEATURES, format_func=FEATURE_LABELS.get, key="job_sweep_x")
+        with col_y:
+            others = [name for name in FEATURES if name != x_name]
+            y_name = st.selectbox("Second parameter", others, index=len(others) - 1,
+                                  format_func=FEATURE_LABELS.get, key="job_sweep_y")
+        with col_points:
+            points = st.number_input("Points per parameter", min_value=10, max_value=5000, value=500, step=50)
+        if st.button("📤 Queue grid sweep"):
+            job_id = store.submit(SWEEP, {"base": [float(value) for value in features],
+                                          "pair": [x_name, y_name], "points": int(points)})
+            st.success(f"Queued job {job_id}")
+
+    with st.expander("🗺️ Suitability map from feature layers on the server"):
+        layers = st.text_input("Layer stack (.npy) or directory of per-feature layers",
+                               help=f"Relative to {RASTER_DIR}; layers elsewhere on the server cannot be used")
+        confidence = st.checkbox("Also write a confidence raster")
+        if st.button("📤 Queue map") and layers:
+            try:
+                job_id = store.submit(RASTER, {"input": raster_input(layers), "confidence": confidence})
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f"Queued job {job_id}")
+
+@auto_refresh(2)
+def render_job_list():
+    """Progress of recent jobs, polled from the job database"""
+    store = get_job_store()
+    jobs = store.list(limit=20)
+    if not jobs:
+        st.caption("No jobs yet.")
+        return
+    for job in jobs:
+        title = f"**{job['kind']}** `{job['id']}` — {job['state']}"
+        if job["model_version"]:
+            title += f" • model {job['model_version']}"
+        st.markdown(title)
+        if job["state"] not in FINISHED and job["total"]:
+            st.progress(min(job["done"] / job["total"], 1.0), text=f"{job['done']:,} / {job['total']:,}")
+        if job["error"]:
+            st.error(job["error"])
+        col_download, col_action = st.columns([3, 1])
+        result = job["result"]
+        paths = [result[key] for key in ("path", "confidence_path") if key in result] if result else []
+        with col_download:
+            for path in paths:
+                if os.path.exists(path):
+                    render_job_result(job, path)
+        with col_action:
+            if job["state"] in FINISHED:
+                if st.button("🗑️ Remove", key=f"job_rm_{job['id']}"):
+                    store.delete(job["id"])
+                    st.rerun()
+            elif st.button("✋ Cancel", key=f"job_cancel_{job['id']}"):
+                store.cancel(job["id"])
+    if not JOB_WORKERS and any(job["state"] == QUEUED for job in jobs):
+        st.caption("Jobs run once a worker is started with `python jobs.py worker`.")
 
 def main():
+    start_render_report()
+    render_styles()
+
     # Enhanced Header
-    st.markdown(r"""
+    render_html(r"""
     <div class="main-header">
         <h1>🌾 Smart Crop AI</h1>
         <p>Intelligent Precision Agriculture • AI-Powered Crop Recommendations</p>
     </div>
-    """, unsafe_allow_html=True)
+    """)
 
     # Enhanced Introduction
-    st.markdown(r"""
+    render_html(r"""
 <div class="premium-card">
 <h2 class="section-header">🚀 Next-Generation Farming Intelligence</h2>
 <p style="color: #b8c2cc; font-size: 1.2rem; text-align: center; margin-bottom: 2rem;">
@@ -627,113 +632,119 @@ Our AI analyzes soil composition, environmental factors, and climatic conditions
 </div>
 </div>
 </div>
-""", unsafe_allow_html=True)
+""")
 
-    if model is None or scaler is None:
-        st.error("Unable to load the model. Please check if the model files exist.")
+    bundle = wait_for_model()
+    if bundle is None:
         return
+    if inference_pool_error:
+        st.warning(f"Inference worker processes could not start, predicting in this process instead. "
+                   f"{inference_pool_error}")
 
     # Enhanced Tabs
-    tab1, tab2, tab3 = st.tabs(["🎯 Crop Prediction", "📊 Analytics Dashboard", "📖 Crop Encyclopedia"])
+    tab1, tab2, tab3, tab4 = lazy_tabs(["🎯 Crop Prediction", "📊 Analytics Dashboard", "📖 Crop Encyclopedia",
+                                        "🗂️ Background Jobs"])
 
     with tab1:
         col1, col2 = st.columns([1, 1], gap="large")
 
         with col1:
-            st.markdown(r"""
+            render_html(r"""
             <div class="param-section">
                 <h2 class="section-header">🌱 Soil Parameters</h2>
                 <p style="color: #b8c2cc; text-align: center; margin-bottom: 2rem;">
                     Configure your soil nutritional composition
                 </p>
             </div>
-            """, unsafe_allow_html=True)
+            """)
             
             N = st.slider(
                 "🧪 Nitrogen (N) Content", 
-                min_value=0, max_value=140, value=50,
+                min_value=FEATURE_BOUNDS["N"][0], max_value=FEATURE_BOUNDS["N"][1], value=50,
                 help="Nitrogen content in soil (mg/kg) - Essential for leaf growth and chlorophyll production"
             )
             
             P = st.slider(
                 "⚡ Phosphorus (P) Content", 
-                min_value=0, max_value=145, value=50,
+                min_value=FEATURE_BOUNDS["P"][0], max_value=FEATURE_BOUNDS["P"][1], value=50,
                 help="Phosphorus content in soil (mg/kg) - Crucial for root development and flowering"
             )
             
             K = st.slider(
                 "💪 Potassium (K) Content", 
-                min_value=0, max_value=205, value=50,
+                min_value=FEATURE_BOUNDS["K"][0], max_value=FEATURE_BOUNDS["K"][1], value=50,
                 help="Potassium content in soil (mg/kg) - Important for plant immunity and fruit quality"
             )
             
             ph = st.slider(
                 "⚖️ Soil pH Level", 
-                min_value=0.0, max_value=14.0, value=7.0, step=0.1,
+                min_value=FEATURE_BOUNDS["ph"][0], max_value=FEATURE_BOUNDS["ph"][1], value=7.0, step=0.1,
                 help="pH level of the soil - Affects nutrient availability to plants"
             )
 
         with col2:
-            st.markdown(r"""
+            render_html(r"""
             <div class="param-section">
                 <h2 class="section-header">🌡️ Environmental Conditions</h2>
                 <p style="color: #b8c2cc; text-align: center; margin-bottom: 2rem;">
                     Set your local climate parameters
                 </p>
             </div>
-            """, unsafe_allow_html=True)
+            """)
             
             temperature = st.slider(
                 "🌡️ Average Temperature", 
-                min_value=0.0, max_value=50.0, value=25.0,
+                min_value=FEATURE_BOUNDS["temperature"][0], max_value=FEATURE_BOUNDS["temperature"][1], value=25.0,
                 help="Average temperature in Celsius - Critical for crop growth and development"
             )
             
             humidity = st.slider(
                 "💧 Relative Humidity", 
-                min_value=0.0, max_value=100.0, value=50.0,
+                min_value=FEATURE_BOUNDS["humidity"][0], max_value=FEATURE_BOUNDS["humidity"][1], value=50.0,
                 help="Relative humidity percentage - Affects disease susceptibility and water needs"
             )
             
             rainfall = st.slider(
                 "🌧️ Annual Rainfall", 
-                min_value=0.0, max_value=300.0, value=100.0,
+                min_value=FEATURE_BOUNDS["rainfall"][0], max_value=FEATURE_BOUNDS["rainfall"][1], value=100.0,
                 help="Annual rainfall in millimeters - Determines irrigation requirements"
             )
 
         # Enhanced Prediction Section
-        st.markdown("<br>", unsafe_allow_html=True)
+        render_html("<br>")
         
         col_btn1, col_btn2, col_btn3 = st.columns([1, 2, 1])
         with col_btn2:
             if st.button("🔮 Generate AI Recommendation"):
                 try:
-                    with st.spinner('🤖 AI is analyzing your agricultural conditions...'):
-                        # Simulate some processing time for better UX
-                        import time
-                        time.sleep(1)
-                        
-                        features = np.array([[N, P, K, temperature, humidity, ph, rainfall]])
-                        transformed_features = scaler.transform(features)
-                        prediction = model.predict(transformed_features)
-                        predicted_crop = crop_dict.get(prediction[0], "Unknown")
+                    ranking, approximate = run_with_latency_budget(
+                        recommend_crops, bundle, N, P, K, temperature, humidity, ph, rainfall,
+                        message='🤖 AI is analyzing your agricultural conditions...'
+                    )
+                    predicted_crop = ranking[0][0]
+                    record_prediction([N, P, K, temperature, humidity, ph, rainfall], predicted_crop, ranking[0][1], bundle.version)
 
                     # Enhanced Results Display
-                    if predicted_crop in crop_info:
-                        info = crop_info[predicted_crop]
-                        
-                        st.markdown(f"""
+                    catalogue = get_catalogue()
+                    info = catalogue.info(predicted_crop)
+                    render_html(f"""
                         <div class="result-card">
                             <h2>🎉 Optimal Crop Recommendation</h2>
-                            <h1>{info["icon"]} {predicted_crop}</h1>
+                            <h1>{info["icon"] if info else "🌱"} {predicted_crop}</h1>
                             <p style="font-size: 1.2rem; margin: 0; position: relative; z-index: 1;">
                                 Perfect match for your farming conditions!
                             </p>
                         </div>
-                        """, unsafe_allow_html=True)
+                        """)
 
+                    # Whether the current temperature and pH sit inside each ranked crop's range, in one comparison
+                    temperature_ok, ph_ok = catalogue.fits(catalogue.label_array([crop for crop, _ in ranking]), temperature, ph)
+
+                    if info is None:
+                        st.info(f"No growing information for {predicted_crop} in the crop catalogue yet.")
+                    else:
                         # Enhanced crop details
-                        st.markdown(f"""
+                        render_html(f"""
                         <div class="premium-card">
                             <h3 class="section-header">📋 Detailed Crop Information</h3>
                             <div class="detail-grid">
@@ -747,136 +758,107 @@ Our AI analyzes soil composition, environmental factors, and climatic conditions
                                 </div>
                                 <div class="detail-item">
                                     <h4 style="color: #ba68c8;">🌡️ Temperature Range</h4>
-                                    <p>{info["temp_range"]}</p>
+                                    <p>{info["temp_range"]} {"✅" if temperature_ok[0] else f"⚠️ {temperature:g}°C now"}</p>
                                 </div>
                                 <div class="detail-item">
                                     <h4 style="color: #ffb74d;">⚖️ pH Range</h4>
-                                    <p>{info["ph_range"]}</p>
+                                    <p>{info["ph_range"]} {"✅" if ph_ok[0] else f"⚠️ pH {ph:g} now"}</p>
                                 </div>
                             </div>
                         </div>
-                        """, unsafe_allow_html=True)
+                        """)
+
+                    # Ranked alternatives from the same inference pass
+                    medals = ["🥇", "🥈", "🥉"]
+                    ranked_items = "".join(
+                        f"""
+                                <div class="detail-item">
+                                    <h4>{medals[i] if i < len(medals) else f"#{i + 1}"} {crop}</h4>
+                                    <p>{probability:.0%} confidence · {fit_note(catalogue, crop, temperature_ok[i], ph_ok[i])}</p>
+                                </div>"""
+                        for i, (crop, probability) in enumerate(ranking)
+                    )
+                    render_html(f"""
+                        <div class="premium-card">
+                            <h3 class="section-header">🏆 Top {len(ranking)} Crop Matches</h3>
+                            <div class="detail-grid">{ranked_items}
+                            </div>
+                        </div>
+                        """)
+                    if approximate:
+                        st.caption("Approximate: answered from the precomputed decision table, which gives the "
+                                   "ranking of the nearest grid point rather than of these exact inputs.")
 
                 except Exception as e:
                     st.error(f"⚠️ An error occurred during prediction: {str(e)}")
 
-    with tab2:
-        st.markdown(r"""
-        <div class="premium-card">
-            <h2 class="section-header">📊 Real-time Parameter Analysis</h2>
-        </div>
-        """, unsafe_allow_html=True)
+        # Every one- and two-parameter perturbation in one batched prediction
+        if st.toggle("🔬 What-if sensitivity", key="sensitivity_panel"):
+            render_sensitivity_panel(bundle, [N, P, K, temperature, humidity, ph, rainfall])
 
-        # Enhanced visualization with gauges
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-            fig1 = create_parameter_gauge(N, 0, 140, "Nitrogen (N)")
-            st.plotly_chart(fig1, use_container_width=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-            fig2 = create_parameter_gauge(P, 0, 145, "Phosphorus (P)")
-            st.plotly_chart(fig2, use_container_width=True)
-            st.markdown('</div>', unsafe_allow_html=True)
+        if st.toggle("🧑‍🌾 Similar past fields", key="similar_fields"):
+            render_similar_fields([N, P, K, temperature, humidity, ph, rainfall])
 
-        with col2:
-            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-            fig3 = create_parameter_gauge(K, 0, 205, "Potassium (K)")
-            st.plotly_chart(fig3, use_container_width=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-            fig4 = create_parameter_gauge(ph, 0, 14, "pH Level")
-            st.plotly_chart(fig4, use_container_width=True)
-            st.markdown('</div>', unsafe_allow_html=True)
+    # The Analytics and Encyclopedia tabs only render while they are the active tab
+    if tab_is_open(tab2):
+        with tab2:
+            render_html(r"""
+            <div class="premium-card">
+                <h2 class="section-header">📊 Real-time Parameter Analysis</h2>
+            </div>
+            """)
 
-        # Enhanced parameter comparison chart
-        st.markdown('<div class="chart-container">', unsafe_allow_html=True)
-        
-        # Create comprehensive analysis chart
-        categories = ['Nitrogen', 'Phosphorus', 'Potassium', 'Temperature', 'Humidity', 'pH', 'Rainfall']
-        values = [N, P, K, temperature, humidity, ph*10, rainfall/3]  # Normalized for better visualization
-        
-        fig = go.Figure()
-        
-        fig.add_trace(go.Scatterpolar(
-            r=values,
-            theta=categories,
-            fill='toself',
-            fillcolor='rgba(102, 126, 234, 0.3)',
-            line=dict(color='rgba(102, 126, 234, 1)', width=3),
-            name='Current Values'
-        ))
-        
-        fig.update_layout(
-            polar=dict(
-                radialaxis=dict(
-                    visible=True,
-                    range=[0, 100],
-                    gridcolor='rgba(255, 255, 255, 0.2)',
-                    tickcolor='#ffffff'
-                ),
-                angularaxis=dict(
-                    gridcolor='rgba(255, 255, 255, 0.2)',
-                    tickcolor='#ffffff'
-                )
-            ),
-            showlegend=True,
-            title={
-                'text': "🎯 Agricultural Parameters Radar Analysis",
-                'x': 0.5,
-                'font': {'size': 20, 'color': '#ffffff'}
-            },
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font={'color': '#ffffff', 'family': 'Inter'},
-            height=500
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-
-    with tab3:
-        st.markdown(r"""
-        <div class="premium-card">
-            <h2 class="section-header">📖 Comprehensive Crop Encyclopedia</h2>
-            <p style="color: #b8c2cc; text-align: center; font-size: 1.1rem;">
-                Explore detailed information about different crops and their requirements
-            </p>
-        </div>
-        """, unsafe_allow_html=True)
+            # Enhanced visualization with gauges, patched in place rather than rebuilt
+            col1, col2 = st.columns(2)
 
-        # Create crop cards
-        crops_per_row = 3
-        crop_list = list(crop_info.keys())
-        
-        for i in range(0, len(crop_list), crops_per_row):
-            cols = st.columns(crops_per_row)
-            for j, col in enumerate(cols):
-                if i + j < len(crop_list):
-                    crop = crop_list[i + j]
-                    info = crop_info[crop]
-                    
-                    with col:
-                        st.markdown(f"""
-                        <div class="premium-card" style="min-height: 300px;">
-                            <div style="text-align: center; margin-bottom: 1rem;">
-                                <span style="font-size: 4rem;">{info["icon"]}</span>
-                                <h3 style="color: #ffffff; margin: 0.5rem 0;">{crop}</h3>
-                            </div>
-                            <div style="space-y: 0.5rem;">
-                                <p><strong style="color: #81c784;">Season:</strong> <span style="color: #b8c2cc;">{info["season"]}</span></p>
-                                <p><strong style="color: #64b5f6;">Water Needs:</strong> <span style="color: #b8c2cc;">{info["water_req"]}</span></p>
-                                <p><strong style="color: #ba68c8;">Temperature:</strong> <span style="color: #b8c2cc;">{info["temp_range"]}</span></p>
-                                <p><strong style="color: #ffb74d;">pH Range:</strong> <span style="color: #b8c2cc;">{info["ph_range"]}</span></p>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
+            with col1:
+                render_gauge(N, 0, 140, "Nitrogen (N)")
+                render_gauge(P, 0, 145, "Phosphorus (P)")
+
+            with col2:
+                render_gauge(K, 0, 205, "Potassium (K)")
+                render_gauge(ph, 0, 14, "pH Level")
+
+            # Enhanced parameter comparison chart
+            values = [N, P, K, temperature, humidity, ph*10, rainfall/3]  # Normalized for better visualization
+            render_radar(values)
+
+            render_html(r"""
+            <div class="premium-card">
+                <h2 class="section-header">🗒️ Prediction Log</h2>
+            </div>
+            """)
+            render_prediction_log_panel()
+            render_drift_panel()
+
+    if tab_is_open(tab3):
+        with tab3:
+            render_html(r"""
+            <div class="premium-card">
+                <h2 class="section-header">📖 Comprehensive Crop Encyclopedia</h2>
+                <p style="color: #b8c2cc; text-align: center; font-size: 1.1rem;">
+                    Explore detailed information about different crops and their requirements
+                </p>
+            </div>
+            """)
+
+            # Crop cards are built once and rendered as a single grid block
+            catalogue = get_catalogue()
+            render_html(build_encyclopedia_html(catalogue, catalogue.version))
+
+    # Large uploads, grid sweeps and maps run on background workers and survive disconnects
+    if tab_is_open(tab4):
+        with tab4:
+            render_html(r"""
+            <div class="premium-card">
+                <h2 class="section-header">🗂️ Background Jobs</h2>
+            </div>
+            """)
+            submit_job_forms([N, P, K, temperature, humidity, ph, rainfall])
+            render_job_list()
 
     # Enhanced Footer
-    st.markdown(r"""
+    render_html(r"""
     <div class="footer">
         <h3 style="color: #667eea; margin-bottom: 1rem;">🌾 Smart Crop AI</h3>
         <p style="color: #b8c2cc; margin-bottom: 1rem;">
@@ -892,7 +874,9 @@ Our AI analyzes soil composition, environmental factors, and climatic conditions
             <a href="https://github.com" target="_blank">View Source Code</a>
         </p>
     </div>
-    """, unsafe_allow_html=True)
+    """)
+
+    show_render_report()
 
 if __name__ == '__main__':
     main()
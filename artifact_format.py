@@ -0,0 +1,306 @@
+"""Compact, versioned model artifact: scaler + learned arrays in one flat file.
+
+Layout of a ``.cropz`` file:
+
+    8 bytes   magic b"CROPZ\\x00\\x00\\x01"
+    8 bytes   little-endian length of the JSON manifest
+    manifest  JSON: format version, feature order, crop labels, scaler parameters,
+              training statistics for drift detection (or null), array table
+              (dtype, shape, offset) and the sha256 of the data section
+    data      raw little-endian arrays, each aligned to 64 bytes
+
+Loading memory-maps the file and wraps each array as a zero-copy numpy view; no
+pickle is involved, so a mismatched sklearn version cannot break or slow it.
+
+Usage:
+    python artifact_format.py export crop_recommendation_model.pkl scaler.pkl -o crop_recommendation_model.cropz
+    python artifact_format.py verify crop_recommendation_model.cropz
+"""
+import argparse
+import hashlib
+import json
+import struct
+import sys
+
+import numpy as np
+
+from crop_model import FEATURES, crop_dict
+
+MAGIC = b"CROPZ\x00\x00\x01"
+FORMAT_VERSION = 1
+EXTENSION = ".cropz"
+ALIGNMENT = 64
+
+
+class ArtifactError(ValueError):
+    """The artifact file is malformed, corrupted or doesn't match this app"""
+
+
+class FlatScaler:
+    """Scaler rebuilt from stored parameters; exposes the same attributes the engine folds
+
+    reference holds the training statistics exported with it (see drift.py), or None.
+    """
+
+    def __init__(self, kind, scale, offset, reference=None):
+        self.kind = kind
+        self.reference = reference
+        self.scale_ = scale
+        if kind == "minmax":
+            self.min_ = offset
+        else:
+            self.mean_ = offset
+
+    def affine(self):
+        """(kind, scale, offset) in the form inference.scaler_affine returns"""
+        offset = self.min_ if self.kind == "minmax" else self.mean_
+        return self.kind, np.asarray(self.scale_, dtype=np.float64), np.asarray(offset, dtype=np.float64)
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.kind == "minmax":
+            return X * self.scale_ + self.min_
+        return (X - self.mean_) / self.scale_
+
+
+class FlatForest:
+    """Tree ensemble evaluated directly over concatenated, memory-mapped node arrays"""
+
+    def __init__(self, classes, roots, left, right, feature, threshold, value, max_depth):
+        self.classes_ = classes
+        self.roots = roots
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.max_depth = max_depth
+
+    def leaves(self, X32):
+        """Leaf node index reached by every row in every tree, shape (n_trees, n_rows)"""
+        n = X32.shape[0]
+        node = np.repeat(self.roots[:, np.newaxis], n, axis=1)
+        rows = np.arange(n)[np.newaxis, :]
+        for _ in range(self.max_depth):
+            left = self.left[node]
+            internal = left != -1
+            if not internal.any():
+                break
+            values = X32[rows, np.maximum(self.feature[node], 0)]
+            step = np.where(values <= self.threshold[node], left, self.right[node])
+            node = np.where(internal, step, node)
+        return node
+
+    def predict_proba_into(self, X32, out):
+        """Average the per-tree leaf distributions for scaled float32 rows into out"""
+        out.fill(0.0)
+        for leaves in self.leaves(X32):
+            out += self.value[leaves]
+        out /= len(self.roots)
+        return out
+
+    def predict_proba(self, X):
+        X32 = np.ascontiguousarray(X, dtype=np.float32)
+        return self.predict_proba_into(X32, np.empty((X32.shape[0], len(self.classes_))))
+
+    def predict(self, X):
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+
+def _flatten_forest(model):
+    """Concatenate every tree's node arrays, offsetting child indices per tree"""
+    from inference import _tree_estimators
+
+    # Only models whose prediction is the plain average of their trees; anything else would load
+    # as a FlatForest that silently predicts different crops
+    trees = _tree_estimators(model)
+    if trees is None:
+        raise ArtifactError(f"Only RandomForest, ExtraTrees and DecisionTree classifiers can be exported, "
+                            f"not {type(model).__name__}")
+    n_classes = len(model.classes_)
+    roots, left, right, feature, threshold, value = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in trees:
+        tree = estimator.tree_
+        roots.append(offset)
+        tree_left = tree.children_left.astype(np.int64)
+        tree_right = tree.children_right.astype(np.int64)
+        left.append(np.where(tree_left == -1, -1, tree_left + offset))
+        right.append(np.where(tree_right == -1, -1, tree_right + offset))
+        feature.append(tree.feature.astype(np.int64))
+        threshold.append(tree.threshold.astype(np.float64))
+        leaf_value = tree.value[:, 0, :n_classes].astype(np.float64)
+        # Older sklearn stores class counts; store fractions like current versions
+        totals = leaf_value.sum(axis=1, keepdims=True)
+        totals[totals == 0.0] = 1.0
+        value.append(leaf_value / totals)
+        max_depth = max(max_depth, tree.max_depth)
+        offset += tree.node_count
+    return {
+        "classes": np.asarray(model.classes_),
+        "roots": np.asarray(roots, dtype=np.int64),
+        "left": np.concatenate(left),
+        "right": np.concatenate(right),
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "value": np.concatenate(value),
+    }, {"type": "forest", "max_depth": int(max_depth) + 1}
+
+
+def _scaler_params(scaler):
+    from inference import scaler_affine
+
+    names = getattr(scaler, "feature_names_in_", None)
+    if names is not None and list(names) != FEATURES:
+        raise ArtifactError(f"Scaler feature order {list(names)} does not match {FEATURES}")
+    affine = scaler_affine(scaler)
+    if affine is None:
+        raise ArtifactError(f"Only MinMaxScaler and StandardScaler can be exported, not {type(scaler).__name__}")
+    kind, scale, offset = affine
+    return kind, {"scaler_scale": scale, "scaler_offset": offset}
+
+
+def _validate_manifest(manifest):
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported artifact version {manifest.get('version')}")
+    if manifest.get("features") != FEATURES:
+        raise ArtifactError(f"Feature order {manifest.get('features')} does not match {FEATURES}")
+    labels = {int(label): name for label, name in manifest.get("labels", {}).items()}
+    if labels != crop_dict:
+        raise ArtifactError("Crop label set in the artifact does not match crop_dict")
+
+
+def export(model, scaler, path, reference=None):
+    """Write model and scaler to a single flat artifact file
+
+    reference is a drift reference to carry along (drift.reference_from_data);
+    by default whatever the scaler knows about the training data is stored.
+    """
+    from drift import reference_from_scaler
+
+    arrays, model_meta = _flatten_forest(model)
+    unknown = set(arrays["classes"].tolist()) - set(crop_dict)
+    if unknown:
+        raise ArtifactError(f"Model predicts labels missing from crop_dict: {sorted(unknown)}")
+    scaler_kind, scaler_arrays = _scaler_params(scaler)
+    arrays.update(scaler_arrays)
+
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        arrays[name] = array
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        table[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    data_size = offset
+
+    digest = hashlib.sha256()
+    data = bytearray(data_size)
+    for name, array in arrays.items():
+        start = table[name]["offset"]
+        data[start : start + array.nbytes] = array.tobytes()
+    digest.update(data)
+
+    manifest = {
+        "version": FORMAT_VERSION,
+        "features": FEATURES,
+        "labels": {str(label): name for label, name in crop_dict.items()},
+        "model": model_meta,
+        "scaler": {"type": scaler_kind},
+        # The flat scaler keeps only its affine form, so the training statistics for drift go here
+        "reference": reference if reference is not None else reference_from_scaler(scaler),
+        "arrays": table,
+        "data_size": data_size,
+        "sha256": digest.hexdigest(),
+    }
+    header = json.dumps(manifest).encode("utf-8")
+    # Pad the header so the data section starts on an aligned offset
+    prefix = len(MAGIC) + 8
+    padded = -(-(prefix + len(header)) // ALIGNMENT) * ALIGNMENT - prefix
+    header = header.ljust(padded, b" ")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(data)
+    return manifest
+
+
+def read_manifest(buffer):
+    if bytes(buffer[: len(MAGIC)]) != MAGIC:
+        raise ArtifactError("Not a crop model artifact")
+    (header_size,) = struct.unpack("<Q", bytes(buffer[len(MAGIC) : len(MAGIC) + 8]))
+    start = len(MAGIC) + 8
+    manifest = json.loads(bytes(buffer[start : start + header_size]).decode("utf-8"))
+    return manifest, start + header_size
+
+
+def load(path, verify=True):
+    """Memory-map an artifact and return (model, scaler) backed by zero-copy array views"""
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    manifest, data_start = read_manifest(buffer)
+    _validate_manifest(manifest)
+    data = buffer[data_start : data_start + manifest["data_size"]]
+    if len(data) != manifest["data_size"]:
+        raise ArtifactError("Artifact is truncated")
+    if verify and hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        raise ArtifactError("Artifact checksum mismatch")
+
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        view = np.frombuffer(data, dtype=dtype, count=count, offset=spec["offset"])
+        arrays[name] = view.reshape(spec["shape"])
+
+    model_meta = manifest["model"]
+    if model_meta["type"] != "forest":
+        raise ArtifactError(f"Unsupported model type {model_meta['type']}")
+    model = FlatForest(
+        arrays["classes"], arrays["roots"], arrays["left"], arrays["right"],
+        arrays["feature"], arrays["threshold"], arrays["value"], model_meta["max_depth"],
+    )
+    scaler = FlatScaler(manifest["scaler"]["type"], arrays["scaler_scale"], arrays["scaler_offset"],
+                        manifest.get("reference"))
+    return model, scaler
+
+
+def main(argv=None):
+    from crop_model import MODEL_PATH, SCALER_PATH, load_artifacts
+
+    parser = argparse.ArgumentParser(description="Export or verify the flat crop model artifact")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="convert joblib pickles to a flat artifact")
+    export_parser.add_argument("model", nargs="?", default=MODEL_PATH)
+    export_parser.add_argument("scaler", nargs="?", default=SCALER_PATH)
+    export_parser.add_argument("-o", "--output", default=None, help="output file (default: model path with .cropz)")
+    export_parser.add_argument("--reference", default=None,
+                               help="drift reference JSON to embed (default: the scaler's training statistics)")
+    verify_parser = sub.add_parser("verify", help="check the checksum, feature order and label set")
+    verify_parser.add_argument("artifact")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        model, scaler = load_artifacts(args.model, args.scaler)
+        output = args.output or args.model.rsplit(".", 1)[0] + EXTENSION
+        reference = None
+        if args.reference:
+            with open(args.reference) as f:
+                reference = json.load(f)
+        manifest = export(model, scaler, output, reference)
+        print(f"Wrote {output} ({manifest['data_size']:,} bytes of arrays, sha256 {manifest['sha256'][:12]})")
+        return 0
+
+    try:
+        model, scaler = load(args.artifact)
+    except ArtifactError as e:
+        print(f"Invalid artifact: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.artifact}: OK ({len(model.roots)} trees, {len(model.classes_)} classes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Headless batch crop prediction for CSV/Parquet soil survey exports.
+
+Usage:
+    python batch_predict.py survey.csv predictions.csv
+    python batch_predict.py survey.parquet predictions.parquet --chunk-size 100000
+
+Rows are checked against the slider bounds first: out-of-range values are
+clamped (or, with --out-of-range reject, the row is rejected) and rows with
+missing or non-numeric values are kept in the output with status "invalid" and
+no prediction, instead of aborting the batch.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from crop_model import FEATURES, MODEL_PATH, SCALER_PATH, label_names, load_artifacts
+from inference import InferenceEngine
+from validation import CLAMP, POLICIES, row_issues, validate
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in (".parquet", ".pq")
+
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrame chunks of at most chunk_size rows from a CSV or Parquet file"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class ChunkWriter:
+    """Append prediction chunks to a CSV or Parquet output file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = _is_parquet(path)
+        self._writer = None
+        self._first = True
+
+    def write(self, frame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def feature_block(frame):
+    """Extract the model features from a chunk as a float64 block in training order"""
+    columns = {column.lower(): column for column in frame.columns}
+    missing = [name for name in FEATURES if name.lower() not in columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+    block = frame[[columns[name.lower()] for name in FEATURES]]
+    if any(not pd.api.types.is_numeric_dtype(dtype) for dtype in block.dtypes):
+        # Stray text becomes NaN, which validation reports per row
+        block = block.apply(pd.to_numeric, errors="coerce")
+    return block.to_numpy(dtype=np.float64)
+
+
+def status_columns(checked, X_raw):
+    """status ("ok", "clamped" or "invalid") and issues columns for a validated chunk"""
+    status = np.where(checked.invalid, "invalid", np.where(checked.clamped, "clamped", "ok"))
+    issues = np.full(len(status), "", dtype=object)
+    for i in np.flatnonzero(checked.invalid | checked.clamped):
+        issues[i] = "; ".join(row_issues(X_raw[i]))
+    return status, issues
+
+
+def predict_frame(frame, engine, top_k=1, out_of_range=CLAMP):
+    """Add prediction, status and issues columns to one chunk in place; returns its validation summary
+
+    With top_k > 1 the best crop also gets a probability column, followed by
+    crop_2/probability_2 ... columns for the runner-up crops. Invalid rows get
+    label -1 and no probabilities.
+    """
+    X_raw = feature_block(frame)
+    checked = validate(X_raw, policy=out_of_range)
+    invalid = checked.invalid
+    if top_k > 1:
+        labels, proba = engine.top_k(checked.X, top_k)
+        labels[invalid] = -1
+        proba[invalid] = np.nan
+        frame["label"] = labels[:, 0]
+        frame["crop"] = label_names(labels[:, 0])
+        frame["probability"] = proba[:, 0]
+        for i in range(1, labels.shape[1]):
+            frame[f"crop_{i + 1}"] = label_names(labels[:, i])
+            frame[f"probability_{i + 1}"] = proba[:, i]
+    else:
+        labels = engine.predict(checked.X)
+        labels[invalid] = -1
+        frame["label"] = labels
+        frame["crop"] = label_names(labels)
+    frame["status"], frame["issues"] = status_columns(checked, X_raw)
+    return checked.summary()
+
+
+def run(input_path, output_path, engine, chunk_size=DEFAULT_CHUNK_SIZE, top_k=1, out_of_range=CLAMP):
+    """Predict every row of input_path chunk by chunk; returns row, invalid and clamped counts"""
+    writer = ChunkWriter(output_path)
+    counts = {"rows": 0, "invalid": 0, "clamped": 0}
+    try:
+        for frame in read_chunks(input_path, chunk_size):
+            summary = predict_frame(frame, engine, top_k, out_of_range)
+            writer.write(frame)
+            for key in counts:
+                counts[key] += summary[key]
+    finally:
+        writer.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch crop recommendations for soil survey files")
+    parser.add_argument("input", help="CSV or Parquet file with N, P, K, temperature, humidity, ph, rainfall columns")
+    parser.add_argument("output", help="CSV or Parquet file to write predictions to")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per processing block")
+    parser.add_argument("--top-k", type=int, default=1, help="also output the k most likely crops with probabilities")
+    parser.add_argument("--out-of-range", choices=POLICIES, default=CLAMP,
+                        help="clamp out-of-range values to the slider bounds, or reject those rows")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the trained model")
+    parser.add_argument("--scaler", default=SCALER_PATH, help="path to the fitted scaler")
+    args = parser.parse_args(argv)
+
+    try:
+        model, scaler = load_artifacts(args.model, args.scaler)
+    except FileNotFoundError as e:
+        parser.exit(1, f"Model files not found: {e}\n")
+
+    start = time.perf_counter()
+    counts = run(args.input, args.output, InferenceEngine(model, scaler), args.chunk_size, args.top_k, args.out_of_range)
+    elapsed = time.perf_counter() - start
+    rows = counts["rows"]
+    rate = rows / elapsed if elapsed > 0 else float("inf")
+    print(f"Predicted {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/s) -> {args.output}", file=sys.stderr)
+    if counts["invalid"] or counts["clamped"]:
+        print(f"{counts['invalid']} invalid rows, {counts['clamped']} rows clamped to the slider bounds", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
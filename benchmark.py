@@ -0,0 +1,298 @@
+"""Benchmark suite for the load, transform/predict and render paths.
+
+Times cold and warm model loading, scaler.transform + model.predict against the
+fused engine at batch sizes from 1 to 1e6 rows, gauge and radar figure
+construction and serialization, and full Streamlit script reruns. Results are
+written as JSON and can be compared against a stored baseline:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 1.25
+
+When the trained model is missing, a synthetic random forest of the same shape
+(22 crops, 100 trees) is trained into a temporary directory and used instead;
+the results record which one was measured. Exits with status 1 when any
+measurement is slower than the baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZES = [1, 10, 100, 1_000, 10_000, 100_000, 1_000_000]
+# Rows fed through the one-call-per-row loop before extrapolating
+SINGLE_ROW_SAMPLES = 200
+DEFAULT_THRESHOLD = 1.25
+
+
+def _artifact_paths():
+    # Mirrors crop_model; resolved before crop_model is imported so a synthetic model can be swapped in
+    model_path = os.environ.get("CROP_MODEL_PATH", os.path.join(APP_DIR, "crop_recommendation_model.pkl"))
+    scaler_path = os.environ.get("CROP_SCALER_PATH", os.path.join(APP_DIR, "scaler.pkl"))
+    return model_path, scaler_path
+
+
+def synthesize_model(directory, scaler_path=None):
+    """Train a stand-in forest on random inputs within the slider bounds; returns (model_path, scaler_path)"""
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import MinMaxScaler
+
+    from crop_model import crop_dict
+    from inference import random_samples
+
+    X = random_samples(4400, seed=11)
+    if scaler_path and os.path.isfile(scaler_path):
+        scaler = joblib.load(scaler_path)
+    else:
+        scaler = MinMaxScaler().fit(X)
+        scaler_path = os.path.join(directory, "scaler.pkl")
+        joblib.dump(scaler, scaler_path)
+    # Each crop owns a random centroid; rows take the label of the nearest one
+    Xs = scaler.transform(X)
+    labels = np.array(sorted(crop_dict))
+    centroids = np.random.default_rng(11).uniform(Xs.min(axis=0), Xs.max(axis=0), size=(len(labels), Xs.shape[1]))
+    y = labels[((Xs[:, None, :] - centroids[None]) ** 2).sum(axis=2).argmin(axis=1)]
+    model = RandomForestClassifier(n_estimators=100, random_state=11).fit(Xs, y)
+    model_path = os.path.join(directory, "crop_recommendation_model.pkl")
+    joblib.dump(model, model_path)
+    return model_path, scaler_path
+
+
+def _timings(fn, repeat, number=1):
+    """Per-call seconds for `repeat` rounds of `number` calls"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def _summary(times, rows=None):
+    result = {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "runs": len(times),
+    }
+    if rows:
+        result["rows_per_second"] = rows / result["median_s"]
+    return result
+
+
+def bench_load(model_path, scaler_path, repeat):
+    """Cold load in a fresh interpreter (imports included) and warm in-process reloads"""
+    from crop_model import load_artifacts
+
+    script = (
+        "import time; start = time.perf_counter(); "
+        "from crop_model import load_artifacts; "
+        f"load_artifacts({model_path!r}, {scaler_path!r}); "
+        "print(time.perf_counter() - start)"
+    )
+    cold = []
+    for _ in range(max(1, repeat // 2)):
+        output = subprocess.run([sys.executable, "-c", script], cwd=APP_DIR, capture_output=True, text=True, check=True)
+        cold.append(float(output.stdout.strip().splitlines()[-1]))
+    warm = _timings(lambda: load_artifacts(model_path, scaler_path), repeat)
+    return {"load.cold": _summary(cold), "load.warm": _summary(warm)}
+
+
+def bench_predict(model_path, scaler_path, sizes, repeat):
+    """Reference transform + predict against the fused engine, one call per batch and one call per row"""
+    from crop_model import load_artifacts, predict_labels
+    from inference import InferenceEngine, random_samples
+
+    model, scaler = load_artifacts(model_path, scaler_path)
+    engine = InferenceEngine(model, scaler)
+    X = random_samples(max(sizes), seed=5)
+    results = {}
+    for size in sizes:
+        block = X[:size]
+        # Fewer rounds for the large batches, which take seconds each
+        rounds = repeat if size <= 10_000 else max(1, repeat // 3)
+        number = max(1, 1000 // size)
+        results[f"predict.reference.batch.{size}"] = _summary(
+            _timings(lambda: predict_labels(model, scaler, block), rounds, number), size
+        )
+        results[f"predict.engine.batch.{size}"] = _summary(_timings(lambda: engine.predict(block), rounds, number), size)
+    rows = X[:SINGLE_ROW_SAMPLES]
+
+    def reference_rows():
+        for row in rows:
+            predict_labels(model, scaler, row.reshape(1, -1))
+
+    def engine_rows():
+        for row in rows:
+            engine.predict_one(*row)
+
+    results["predict.reference.single_row"] = _summary(
+        [t / len(rows) for t in _timings(reference_rows, repeat)], 1
+    )
+    results["predict.engine.single_row"] = _summary([t / len(rows) for t in _timings(engine_rows, repeat)], 1)
+    return results
+
+
+def bench_figures(repeat):
+    """Gauge and radar construction, in-place patching and JSON serialization"""
+    import figures
+
+    values = [90, 42, 43, 20.9, 82.0, 6.5, 202.9]
+    results = {
+        "figure.gauge.build": _summary(_timings(lambda: figures.create_parameter_gauge(90, 0, 140, "Nitrogen"),
+                                                repeat, 10)),
+        "figure.radar.build": _summary(_timings(lambda: figures.create_radar_chart(values), repeat, 10)),
+    }
+    gauge = figures.create_parameter_gauge(90, 0, 140, "Nitrogen")
+    radar = figures.create_radar_chart(values)
+
+    def patch_gauge():
+        gauge.data[0].value = gauge.data[0].value + 1
+
+    def patch_radar():
+        radar.data[0].r = [v + 1 for v in radar.data[0].r]
+
+    results["figure.gauge.patch"] = _summary(_timings(patch_gauge, repeat, 10))
+    results["figure.radar.patch"] = _summary(_timings(patch_radar, repeat, 10))
+    results["figure.gauge.to_json"] = _summary(_timings(gauge.to_json, repeat, 10))
+    results["figure.radar.to_json"] = _summary(_timings(radar.to_json, repeat, 10))
+    return results
+
+
+def bench_reruns(repeat):
+    """Full script runs of app.py: first run, idle reruns and reruns that make a prediction"""
+    from streamlit.testing.v1 import AppTest
+
+    from prediction_cache import get_prediction_cache
+
+    at = AppTest.from_file(os.path.join(APP_DIR, "app.py"), default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"app.py raised during the benchmark run: {at.exception[0].value}")
+
+    def rerun():
+        at.run()
+
+    def predict():
+        # Same inputs every round, so drop the memoized result to time a real prediction
+        get_prediction_cache().clear()
+        at.button[0].click()
+        at.run()
+
+    return {
+        "rerun.first": _summary([first]),
+        "rerun.idle": _summary(_timings(rerun, repeat)),
+        "rerun.predict": _summary(_timings(predict, repeat)),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Median ratios against a baseline; returns (ratios, names of regressions)"""
+    ratios, regressions = {}, []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous.get("median_s"):
+            continue
+        ratio = result["median_s"] / previous["median_s"]
+        ratios[name] = ratio
+        if ratio > threshold:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def _versions():
+    versions = {"python": platform.python_version()}
+    for module in ("numpy", "sklearn", "streamlit", "plotly"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return versions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crop recommendation hot paths")
+    parser.add_argument("--output", help="write the results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown ratio that counts as a regression")
+    parser.add_argument("--repeat", type=int, default=7, help="rounds per measurement")
+    parser.add_argument("--max-rows", type=int, default=SIZES[-1], help="largest batch size")
+    parser.add_argument("--only", nargs="+", choices=["load", "predict", "figures", "reruns"],
+                        default=["load", "predict", "figures", "reruns"])
+    parser.add_argument("--synthetic", action="store_true", help="use a synthetic model even if the real one exists")
+    args = parser.parse_args(argv)
+
+    model_path, scaler_path = _artifact_paths()
+    synthetic_dir = None
+    if args.synthetic or not os.path.isfile(model_path):
+        synthetic_dir = tempfile.mkdtemp(prefix="crop-bench-")
+        model_path, scaler_path = synthesize_model(synthetic_dir, scaler_path)
+        # Child processes read the environment; modules imported from here on copy crop_model's paths
+        os.environ["CROP_MODEL_PATH"], os.environ["CROP_SCALER_PATH"] = model_path, scaler_path
+        import crop_model
+
+        crop_model.MODEL_PATH, crop_model.SCALER_PATH = model_path, scaler_path
+
+    results = {}
+    try:
+        if "load" in args.only:
+            results.update(bench_load(model_path, scaler_path, args.repeat))
+        if "predict" in args.only:
+            sizes = [size for size in SIZES if size <= args.max_rows]
+            results.update(bench_predict(model_path, scaler_path, sizes, args.repeat))
+        if "figures" in args.only:
+            results.update(bench_figures(args.repeat))
+        if "reruns" in args.only:
+            results.update(bench_reruns(args.repeat))
+    finally:
+        if synthetic_dir:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host": platform.node(),
+            "cpus": os.cpu_count(),
+            "model": "synthetic" if synthetic_dir else model_path,
+            "versions": _versions(),
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratios, regressions = compare(results, baseline["results"], args.threshold)
+        report["comparison"] = {
+            "baseline": args.baseline,
+            "threshold": args.threshold,
+            "ratios": ratios,
+            "regressions": regressions,
+        }
+        for name in regressions:
+            print(f"REGRESSION {name}: {ratios[name]:.2f}x slower than baseline", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
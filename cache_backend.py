@@ -0,0 +1,503 @@
+"""Fleet-wide cache of predictions and figures on a Redis-compatible server.
+
+Every replica keeps its own in-process cache (prediction_cache.py); with
+``CROP_CACHE_URL=redis://host:6379/0`` the replicas also share a second tier
+on a Redis-compatible server, so a slider combination one replica has computed
+is served to all of them. The client speaks RESP directly over a small pool of
+sockets: the lookups of a batch go out as pipelined MGETs in one round trip,
+and writes are queued and pipelined by a background thread so no request
+waits for a SET.
+
+Keys are short binary strings: a prefix, a kind byte, the model version and
+the quantized inputs as zigzag varints (about 20 bytes for a prediction).
+Values are JSON, never pickles, so a compromised or shared server cannot run
+code in the replicas; callers store plain data (figures as ``fig.to_json()``).
+Entries expire after a TTL, and because the model version is part of the key
+a retrained model never reads its predecessor's results.
+
+While the server cannot be reached every lookup is a miss and writes are
+dropped, so replicas keep serving from their in-process tier; the server is
+retried with exponential backoff.
+
+Usage:
+    python cache_backend.py serve --port 6379        # in-memory stand-in for local testing
+    python cache_backend.py ping --url redis://127.0.0.1:6379/0
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+CACHE_URL = os.environ.get("CROP_CACHE_URL")
+DEFAULT_TIMEOUT = float(os.environ.get("CROP_CACHE_TIMEOUT_MS", "50")) / 1000.0
+DEFAULT_POOL_SIZE = int(os.environ.get("CROP_CACHE_POOL_SIZE", "8"))
+DEFAULT_TTL_SECONDS = float(os.environ.get("CROP_CACHE_TTL_SECONDS", "3600"))
+DEFAULT_PORT = 6379
+KEY_PREFIX = b"crop:"
+# Key kinds
+PREDICTION = b"p"
+SENSITIVITY = b"s"
+# Keys per MGET; larger lookups are split into several MGETs in one pipeline
+MGET_CHUNK = 1000
+# Queued writes before new ones are dropped, and SETs pipelined per round trip
+WRITE_QUEUE = 10_000
+WRITE_BATCH = 512
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+# Encoded values at least this large are zlib-compressed
+COMPRESS_BYTES = 1024
+
+
+def _version_bytes(version):
+    try:
+        return bytes.fromhex(version)
+    except (TypeError, ValueError):
+        return hashlib.blake2b(str(version).encode(), digest_size=6).digest()
+
+
+def encode_key(kind, version, steps, extra=b""):
+    """Binary cache key: prefix, kind, length-prefixed model version, extra bytes, zigzag varint steps"""
+    version = _version_bytes(version)
+    key = bytearray(KEY_PREFIX)
+    key += kind
+    key.append(len(version))
+    key += version
+    key += extra
+    for n in steps:
+        n = n << 1 if n >= 0 else (-n << 1) - 1
+        while n >= 0x80:
+            key.append(n & 0x7F | 0x80)
+            n >>= 7
+        key.append(n)
+    return bytes(key)
+
+
+def encode_value(value):
+    """JSON bytes of a value made of dicts, lists, strings, numbers, booleans and None"""
+    data = json.dumps(value, separators=(",", ":"), allow_nan=False).encode()
+    if len(data) >= COMPRESS_BYTES:
+        return b"z" + zlib.compress(data, 1)
+    return b"j" + data
+
+
+def decode_value(data):
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]))
+    if data[:1] == b"j":
+        return json.loads(data[1:])
+    raise ValueError("Unknown cache value encoding")
+
+
+class RespError(Exception):
+    """An error reply from the cache server"""
+
+
+class PoolExhausted(Exception):
+    """Every pooled connection stayed busy for the whole timeout"""
+
+
+def _command(*args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = b"%d" % arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(f):
+    """One RESP reply; error replies are returned, not raised, so a pipeline reads all of its replies"""
+    line = f.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the cache server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RespError(rest.decode(errors="replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        if len(data) != n + 2:
+            raise ConnectionError("Connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        n = int(rest)
+        return None if n < 0 else [_read_reply(f) for _ in range(n)]
+    raise ConnectionError(f"Unexpected reply from the cache server: {line[:32]!r}")
+
+
+class Connection:
+    """One socket to the server"""
+
+    def __init__(self, host, port, timeout, password=None, db=0):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rb")
+        setup = ([("AUTH", password)] if password else []) + ([("SELECT", db)] if db else [])
+        for reply in self.pipeline(setup):
+            if isinstance(reply, RespError):
+                self.close()
+                raise ConnectionError(f"Cache server refused the connection: {reply}")
+
+    def pipeline(self, commands):
+        """Send commands in one write and read their replies"""
+        if not commands:
+            return []
+        self.sock.sendall(b"".join(_command(*command) for command in commands))
+        return [_read_reply(self.file) for _ in commands]
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """At most size connections, reused most-recently-returned first"""
+
+    def __init__(self, host, port, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, password=None, db=0):
+        self.host, self.port = host, port
+        self.timeout = timeout
+        self.password, self.db = password, db
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.created = 0
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"No free cache connection within {self.timeout * 1000:.0f} ms")
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = Connection(self.host, self.port, self.timeout, self.password, self.db)
+                self.created += 1
+            try:
+                yield conn
+            except BaseException:
+                # The connection may have unread replies; never reuse it
+                conn.close()
+                raise
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RedisBackend:
+    """Client of a Redis-compatible server that degrades to misses while the server is unreachable"""
+
+    def __init__(self, url, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, ttl=DEFAULT_TTL_SECONDS):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Cache URL must look like redis://host:port/db, got {url!r}")
+        host, port = parsed.hostname or "127.0.0.1", parsed.port or DEFAULT_PORT
+        db = int(parsed.path.strip("/") or 0)
+        self.address = f"{host}:{port}/{db}"
+        self.pool = ConnectionPool(host, port, pool_size, timeout, parsed.password, db)
+        self.ttl = max(1, int(ttl))
+        self._writes = queue.Queue(WRITE_QUEUE)
+        self._writer = None
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._retry = RETRY_SECONDS
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.writes = 0
+        self.dropped_writes = 0
+        self.last_error = None
+
+    @property
+    def available(self):
+        """False while backing off after a failure"""
+        return time.monotonic() >= self._down_until
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, n in counts.items():
+                setattr(self, name, getattr(self, name) + n)
+
+    def _call(self, commands):
+        """Replies to commands sent in one round trip, or None if the server is unavailable"""
+        if not self.available:
+            return None
+        try:
+            with self.pool.connection() as conn:
+                replies = conn.pipeline(commands)
+        except PoolExhausted as e:
+            # Local overload, not a server failure: skip the server for this call only
+            self._count(errors=1)
+            self.last_error = str(e)
+            return None
+        except (OSError, ValueError) as e:
+            # The other idle sockets most likely went down with this one
+            self.pool.close()
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+                self._down_until = time.monotonic() + self._retry
+                self._retry = min(self._retry * 2, MAX_RETRY_SECONDS)
+            return None
+        self._retry = RETRY_SECONDS
+        return replies
+
+    def get_many(self, keys):
+        """Values stored under keys, None where missing, from pipelined MGETs in one round trip"""
+        if not keys:
+            return []
+        chunks = [keys[i : i + MGET_CHUNK] for i in range(0, len(keys), MGET_CHUNK)]
+        replies = self._call([("MGET", *chunk) for chunk in chunks])
+        if replies is None:
+            self._count(misses=len(keys))
+            return [None] * len(keys)
+        values = []
+        for chunk, reply in zip(chunks, replies):
+            if not isinstance(reply, list):
+                values.extend([None] * len(chunk))
+                continue
+            for data in reply:
+                try:
+                    values.append(None if data is None else decode_value(data))
+                except Exception:
+                    # Written by an incompatible version: treat as a miss
+                    values.append(None)
+        hits = sum(value is not None for value in values)
+        self._count(hits=hits, misses=len(values) - hits)
+        return values
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set_many(self, items):
+        """Store (key, value) pairs with the TTL in one round trip; False if the server was unavailable"""
+        commands = [("SET", key, encode_value(value), "EX", self.ttl) for key, value in items]
+        replies = self._call(commands)
+        if replies is None:
+            self._count(dropped_writes=len(commands))
+            return False
+        failed = sum(isinstance(reply, RespError) for reply in replies)
+        self._count(writes=len(commands) - failed, dropped_writes=failed)
+        return True
+
+    def put(self, key, value):
+        """Queue a write for the background writer; dropped if the queue is full"""
+        if self._writer is None:
+            self._start_writer()
+        try:
+            self._writes.put_nowait((key, value))
+        except queue.Full:
+            self._count(dropped_writes=1)
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="cache-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            items = [self._writes.get()]
+            while len(items) < WRITE_BATCH:
+                try:
+                    items.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.set_many(items)
+            except Exception as e:
+                # A value that is not plain JSON data must not stop the writer
+                self._count(dropped_writes=len(items))
+                self.last_error = str(e)
+
+    def get_or_compute(self, key, compute):
+        """The value under key, or compute() stored in the background on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def ping(self):
+        """Round-trip time to the server in seconds, or None if it is unavailable"""
+        start = time.perf_counter()
+        replies = self._call([("PING",)])
+        return None if replies is None else time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "server": self.address,
+                "available": self.available,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "errors": self.errors,
+                "writes": self.writes,
+                "dropped_writes": self.dropped_writes,
+                "pending_writes": self._writes.qsize(),
+                "connections": self.pool.created,
+                "last_error": self.last_error,
+            }
+
+    def metric_samples(self, prefix="crop_cache_remote"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        stats = self.stats()
+        samples = [(f"{prefix}_{name}_total", "counter", {}, stats[name])
+                   for name in ("hits", "misses", "errors", "writes", "dropped_writes")]
+        samples += [(f"{prefix}_available", "gauge", {}, int(stats["available"])),
+                    (f"{prefix}_pending_writes", "gauge", {}, stats["pending_writes"])]
+        return samples
+
+    def close(self):
+        self.pool.close()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend for CROP_CACHE_URL, or None when no shared cache is configured"""
+    global _backend
+    if not CACHE_URL:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            _backend = RedisBackend(CACHE_URL)
+        return _backend
+
+
+def _encode_reply(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode_reply(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = _read_reply(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if not isinstance(request, list) or not request:
+                return
+            self.wfile.write(_encode_reply(self.server.execute(request)))
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """In-memory server answering the subset of Redis commands this client uses, for local testing"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, max_keys=1_000_000):
+        super().__init__(address, _StandInHandler)
+        self.max_keys = max_keys
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def execute(self, request):
+        name, args = request[0].upper(), request[1:]
+        now = time.monotonic()
+        with self._lock:
+            if name == b"PING":
+                return "PONG"
+            if name in (b"SELECT", b"AUTH"):
+                return "OK"
+            if name == b"GET" and len(args) == 1:
+                return self._lookup(args[0], now)
+            if name == b"MGET" and args:
+                return [self._lookup(key, now) for key in args]
+            if name == b"SET" and len(args) >= 2:
+                expires = None
+                if len(args) == 4 and args[2].upper() in (b"EX", b"PX"):
+                    expires = now + int(args[3]) / (1 if args[2].upper() == b"EX" else 1000)
+                self._data.pop(args[0], None)
+                self._data[args[0]] = (args[1], expires)
+                while len(self._data) > self.max_keys:
+                    # Oldest write first
+                    del self._data[next(iter(self._data))]
+                return "OK"
+            if name == b"DEL":
+                return sum(self._data.pop(key, None) is not None for key in args)
+            if name == b"DBSIZE":
+                return len(self._data)
+            if name in (b"FLUSHDB", b"FLUSHALL"):
+                self._data.clear()
+                return "OK"
+        return RespError(f"unknown command or wrong arguments '{name.decode(errors='replace')}'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared prediction cache server tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run an in-memory stand-in server")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--max-keys", type=int, default=1_000_000)
+    ping = commands.add_parser("ping", help="check that a server is reachable")
+    ping.add_argument("--url", default=CACHE_URL or f"redis://127.0.0.1:{DEFAULT_PORT}/0")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        with StandInServer((args.host, args.port), args.max_keys) as server:
+            print(f"Stand-in cache server on {args.host}:{args.port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return
+    backend = RedisBackend(args.url)
+    elapsed = backend.ping()
+    if elapsed is None:
+        raise SystemExit(f"{backend.address} is unreachable: {backend.last_error}")
+    print(f"{backend.address} answered in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
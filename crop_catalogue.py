@@ -0,0 +1,203 @@
+"""Growing information for every crop label, loaded from crop_catalogue.csv.
+
+The CSV keeps the human-readable strings shown in the UI ("20-35°C",
+"High (1200-1800mm)"); on load they are also parsed into numeric columns,
+held as arrays indexed by crop label, so inputs can be compared against the
+ranges of many crops at once. Every label in crop_dict must have a row.
+
+get_catalogue() reloads the file when it changes on disk; a file that fails
+to parse is reported and the previous catalogue stays in use.
+
+Usage:
+    python crop_catalogue.py [path]        # check a catalogue file and print its parsed ranges
+"""
+import csv
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from crop_model import APP_DIR, crop_dict
+
+CATALOGUE_PATH = os.environ.get("CROP_CATALOGUE_PATH", os.path.join(APP_DIR, "crop_catalogue.csv"))
+# How often get_catalogue() stats the file for changes
+CHECK_SECONDS = 2.0
+COLUMNS = ["label", "crop", "icon", "season", "water_req", "temp_range", "ph_range"]
+
+_NUMBER = r"-?\d+(?:\.\d+)?"
+_RANGE = re.compile(rf"^\s*({_NUMBER})\s*-\s*({_NUMBER})\s*(?:°C)?\s*$")
+_WATER = re.compile(rf"^\s*(\w+)\s*\(\s*({_NUMBER})\s*-\s*({_NUMBER})\s*mm\s*\)\s*$")
+
+
+def parse_range(text):
+    """(low, high) of a "20-35°C" or "5.5-7.0" range"""
+    match = _RANGE.match(text)
+    if match is None:
+        raise ValueError(f"expected a range like 20-35, got {text!r}")
+    low, high = float(match.group(1)), float(match.group(2))
+    if low > high:
+        raise ValueError(f"range {text!r} is reversed")
+    return low, high
+
+
+def parse_water(text):
+    """(level, low mm, high mm) of a "High (1200-1800mm)" requirement"""
+    match = _WATER.match(text)
+    if match is None:
+        raise ValueError(f"expected a requirement like High (1200-1800mm), got {text!r}")
+    low, high = float(match.group(2)), float(match.group(3))
+    if low > high:
+        raise ValueError(f"range {text!r} is reversed")
+    return match.group(1), low, high
+
+
+class CropCatalogue:
+    """Crop rows as arrays indexed by label; the last slot stands for unknown labels"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        size = max(max(crop_dict), *(row["label"] for row in rows)) + 2
+        self.unknown = size - 1
+        self.names = np.full(size, "Unknown", dtype=object)
+        self.labels = {}
+        self._info = {}
+        columns = ("temp_min", "temp_max", "ph_min", "ph_max", "water_min", "water_max")
+        for name in columns:
+            setattr(self, name, np.full(size, np.nan))
+        for row in rows:
+            label = row["label"]
+            self.names[label] = row["crop"]
+            self.labels[row["crop"]] = label
+            for name in columns:
+                getattr(self, name)[label] = row[name]
+            self._info[row["crop"]] = {
+                "season": row["season"],
+                "water_req": row["water_req"],
+                "temp_range": row["temp_range"],
+                "ph_range": row["ph_range"],
+                "icon": row["icon"],
+                "water_mm": [row["water_min"], row["water_max"]],
+                "temp_c": [row["temp_min"], row["temp_max"]],
+                "ph": [row["ph_min"], row["ph_max"]],
+            }
+
+    @classmethod
+    def load(cls, path=CATALOGUE_PATH, version=None):
+        """Parse and check a catalogue CSV; ValueError names the offending line"""
+        rows = []
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            missing = [name for name in COLUMNS if name not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+            for line, record in enumerate(reader, start=2):
+                try:
+                    row = {name: (record[name] or "").strip() for name in COLUMNS}
+                    row["label"] = int(row["label"])
+                    row["temp_min"], row["temp_max"] = parse_range(row["temp_range"])
+                    row["ph_min"], row["ph_max"] = parse_range(row["ph_range"])
+                    _, row["water_min"], row["water_max"] = parse_water(row["water_req"])
+                except ValueError as e:
+                    raise ValueError(f"{path}, line {line}: {e}") from None
+                if row["label"] in crop_dict and crop_dict[row["label"]] != row["crop"]:
+                    raise ValueError(f"{path}, line {line}: label {row['label']} is {crop_dict[row['label']]}, "
+                                     f"not {row['crop']}")
+                rows.append(row)
+        labels = [row["label"] for row in rows]
+        duplicates = sorted({label for label in labels if labels.count(label) > 1})
+        if duplicates:
+            raise ValueError(f"{path}: duplicate labels {duplicates}")
+        uncovered = [name for label, name in crop_dict.items() if label not in labels]
+        if uncovered:
+            raise ValueError(f"{path}: no rows for {', '.join(uncovered)}")
+        return cls(rows, version)
+
+    def __contains__(self, crop):
+        return crop in self._info
+
+    def __len__(self):
+        return len(self._info)
+
+    def __iter__(self):
+        """Crop names in label order"""
+        return iter(sorted(self.labels, key=self.labels.get))
+
+    def info(self, crop):
+        """Display strings, icon and numeric ranges of a crop, or None for an unknown name"""
+        return self._info.get(crop)
+
+    def items(self):
+        return ((crop, self._info[crop]) for crop in self)
+
+    def label_array(self, crops):
+        """Labels of crop names, the unknown slot for names not in the catalogue"""
+        return np.array([self.labels.get(crop, self.unknown) for crop in crops], dtype=np.int64)
+
+    def fits(self, labels, temperature, ph):
+        """Whether temperature and pH fall within each label's ranges, as two boolean arrays
+
+        labels, temperature and ph broadcast against each other; unknown labels never fit.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        labels = np.where((labels >= 0) & (labels < self.unknown), labels, self.unknown)
+        temperature, ph = np.asarray(temperature), np.asarray(ph)
+        temperature_ok = (self.temp_min[labels] <= temperature) & (temperature <= self.temp_max[labels])
+        ph_ok = (self.ph_min[labels] <= ph) & (ph <= self.ph_max[labels])
+        return temperature_ok, ph_ok
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+_catalogue = None
+_next_check = 0.0
+_lock = threading.Lock()
+reload_error = None
+
+
+def get_catalogue():
+    """The catalogue in CATALOGUE_PATH, reloaded when the file changes (checked every CHECK_SECONDS)"""
+    global _catalogue, _next_check, reload_error
+    now = time.monotonic()
+    if _catalogue is not None and now < _next_check:
+        return _catalogue
+    with _lock:
+        if _catalogue is not None and now < _next_check:
+            return _catalogue
+        _next_check = now + CHECK_SECONDS
+        try:
+            signature = _signature(CATALOGUE_PATH)
+            if _catalogue is None or signature != _catalogue.version:
+                _catalogue = CropCatalogue.load(CATALOGUE_PATH, signature)
+                reload_error = None
+                metrics.inc("crop_catalogue_loads_total")
+        except (OSError, ValueError) as e:
+            if _catalogue is None:
+                raise
+            # Keep serving the last good catalogue until the file is fixed
+            reload_error = f"Catalogue reload failed, still serving the previous one: {e}"
+            metrics.inc("crop_catalogue_reload_failures_total")
+        return _catalogue
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else CATALOGUE_PATH
+    try:
+        catalogue = CropCatalogue.load(path)
+    except (OSError, ValueError) as e:
+        raise SystemExit(str(e))
+    print(f"{path}: {len(catalogue)} crops")
+    for crop, info in catalogue.items():
+        print(f"  {catalogue.labels[crop]:>3} {info['icon']} {crop:<12} temp {info['temp_c'][0]:g}-{info['temp_c'][1]:g} °C  "
+              f"pH {info['ph'][0]:g}-{info['ph'][1]:g}  water {info['water_mm'][0]:g}-{info['water_mm'][1]:g} mm")
+
+
+if __name__ == "__main__":
+    main()
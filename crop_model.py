@@ -0,0 +1,75 @@
+import os
+
+import joblib
+import numpy as np
+
+# Model artifacts live next to the app unless overridden
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("CROP_MODEL_PATH", os.path.join(APP_DIR, "crop_recommendation_model.pkl"))
+SCALER_PATH = os.environ.get("CROP_SCALER_PATH", os.path.join(APP_DIR, "scaler.pkl"))
+
+# Feature order expected by the scaler and the model
+FEATURES = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+# Slider bounds for each feature, in FEATURES order
+FEATURE_BOUNDS = {
+    "N": (0, 140),
+    "P": (0, 145),
+    "K": (0, 205),
+    "temperature": (0.0, 50.0),
+    "humidity": (0.0, 100.0),
+    "ph": (0.0, 14.0),
+    "rainfall": (0.0, 300.0),
+}
+
+# Slider step for each feature (Streamlit's default float step is 0.01)
+FEATURE_STEPS = {
+    "N": 1,
+    "P": 1,
+    "K": 1,
+    "temperature": 0.01,
+    "humidity": 0.01,
+    "ph": 0.1,
+    "rainfall": 0.01,
+}
+
+crop_dict = {
+    1: 'Rice', 2: 'Maize', 3: 'Jute', 4: 'Cotton', 5: 'Coconut',
+    6: 'Papaya', 7: 'Orange', 8: 'Apple', 9: 'Muskmelon', 10: 'Watermelon',
+    11: 'Grapes', 12: 'Mango', 13: 'Banana', 14: 'Pomegranate', 15: 'Lentil',
+    16: 'Blackgram', 17: 'Mungbean', 18: 'Mothbeans', 19: 'Pigeonpeas',
+    20: 'Kidneybeans', 21: 'Chickpea', 22: 'Coffee'
+}
+
+# Growing information for each crop is in crop_catalogue.csv (see crop_catalogue.py)
+
+# Label -> name lookup table for vectorised mapping; the last slot is "Unknown"
+_CROP_NAMES = np.array(
+    [crop_dict.get(label, "Unknown") for label in range(max(crop_dict) + 1)] + ["Unknown"], dtype=object
+)
+
+
+def load_artifacts(model_path=MODEL_PATH, scaler_path=SCALER_PATH, mmap_mode=None):
+    """Load the trained model and its scaler from disk"""
+    if model_path.endswith(".cropz"):
+        # Flat artifacts carry their own scaler and are memory-mapped rather than unpickled
+        from artifact_format import load
+
+        return load(model_path)
+    model = joblib.load(model_path, mmap_mode=mmap_mode)
+    scaler = joblib.load(scaler_path)
+    return model, scaler
+
+
+def predict_labels(model, scaler, X):
+    """Predict crop labels for a 2D block of feature rows"""
+    return model.predict(scaler.transform(X))
+
+
+def label_names(labels):
+    """Map an array of crop labels to crop names"""
+    labels = np.asarray(labels, dtype=np.int64)
+    unknown = len(_CROP_NAMES) - 1
+    index = np.where((labels >= 0) & (labels < unknown), labels, unknown)
+    return _CROP_NAMES[index]
+
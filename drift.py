@@ -0,0 +1,374 @@
+"""Streaming drift detection on incoming feature values.
+
+Every prediction's raw inputs are appended to a small buffer (a list append on
+the request path); a background thread folds the buffer into per-feature
+running statistics that use constant memory: Welford/Chan mean and variance,
+min and max, and P² estimates of the 5th, 50th and 95th percentiles. Statistics
+are kept for everything seen since startup and for a rolling window of recent
+inputs, which is what drift is scored on.
+
+The reference is the training data. ``drift_reference.json`` (built with
+``python drift.py reference training.csv``) holds its means, standard
+deviations, ranges and quantiles. Without it the scaler provides what it
+stored: the training range for a MinMaxScaler, means and standard deviations
+for a StandardScaler, and for a flat .cropz artifact the statistics written
+into its manifest at export. When none of these is available the monitor
+still tracks the inputs but reports that it has no reference instead of
+scoring drift.
+
+Per feature, the score is the largest of
+    - the shift of the mean, in reference standard deviations
+    - the largest shift of a tracked quantile, in reference standard deviations
+    - the share of inputs outside the training range, per OUTSIDE_ALERT
+so a score of 1.0 or more is flagged as drift.
+
+Usage:
+    python drift.py reference Crop_recommendation.csv
+    python drift.py report monsoon_survey.csv
+"""
+import argparse
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from crop_model import APP_DIR, FEATURES, MODEL_PATH, SCALER_PATH, load_artifacts
+
+REFERENCE_PATH = os.environ.get("CROP_DRIFT_REFERENCE", os.path.join(APP_DIR, "drift_reference.json"))
+QUANTILES = (0.05, 0.5, 0.95)
+# Observations per rolling window; drift is scored on the latest full window until the next one fills
+WINDOW_ROWS = int(os.environ.get("CROP_DRIFT_WINDOW", "5000"))
+# Share of inputs outside the training range that scores 1.0
+OUTSIDE_ALERT = 0.05
+DRIFT_THRESHOLD = 1.0
+# Observations before a window is scored at all
+MIN_ROWS = 30
+UPDATE_SECONDS = 1.0
+# Rows per update fed to the quantile sketches (an even sample beyond that), so heavy
+# traffic can't make the monitor fall behind; moments and ranges use every row
+SKETCH_ROWS = 1000
+
+
+class P2Quantile:
+    """P² estimate of one quantile in constant memory (Jain & Chlamtac, 1985)"""
+
+    __slots__ = ("p", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x, 1, 4) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        desired = self.desired
+        for i in range(5):
+            desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, falling back to linear if it breaks monotonicity
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            # Exact while there are too few points for the markers
+            return float(np.quantile(q, self.p))
+        return q[2]
+
+
+class FeatureStats:
+    """Running count, mean, variance, range and quantiles of every feature"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = np.zeros(len(FEATURES))
+        self.m2 = np.zeros(len(FEATURES))
+        self.low = np.full(len(FEATURES), np.inf)
+        self.high = np.full(len(FEATURES), -np.inf)
+        self.outside = np.zeros(len(FEATURES), dtype=np.int64)
+        self.quantiles = [[P2Quantile(p) for p in QUANTILES] for _ in FEATURES]
+
+    def update(self, X, ref_low=None, ref_high=None, sketch_rows=None):
+        """Fold a block of rows in: Chan's pairwise combination of Welford moments, then the sketches"""
+        n = len(X)
+        if not n:
+            return
+        block_mean = X.mean(axis=0)
+        block_m2 = ((X - block_mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += block_m2 + delta * delta * self.count * n / total
+        self.count = total
+        np.minimum(self.low, X.min(axis=0), out=self.low)
+        np.maximum(self.high, X.max(axis=0), out=self.high)
+        if ref_low is not None:
+            self.outside += ((X < ref_low) | (X > ref_high)).sum(axis=0)
+        if sketch_rows and n > sketch_rows:
+            X = X[:: -(-n // sketch_rows)]
+        for column, sketches in zip(X.T.tolist(), self.quantiles):
+            for sketch in sketches:
+                add = sketch.add
+                for value in column:
+                    add(value)
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros(len(FEATURES))
+
+
+def reference_from_scaler(scaler):
+    """What the fitted scaler knows about the training data, as a reference dict; None if it can't score drift"""
+    if hasattr(scaler, "reference"):
+        # A flat artifact's scaler carries the reference written into the artifact at export
+        return scaler.reference
+    reference = {"source": type(scaler).__name__, "features": {}}
+    for i, name in enumerate(FEATURES):
+        entry = {}
+        if getattr(scaler, "data_min_", None) is not None:
+            entry.update(min=float(scaler.data_min_[i]), max=float(scaler.data_max_[i]))
+        if getattr(scaler, "mean_", None) is not None and getattr(scaler, "var_", None) is not None:
+            entry.update(mean=float(scaler.mean_[i]), std=float(np.sqrt(scaler.var_[i])))
+        if not entry:
+            # e.g. RobustScaler, or a StandardScaler fitted with_std=False
+            return None
+        reference["features"][name] = entry
+    return reference
+
+
+def reference_from_data(X, source):
+    """Reference statistics computed from training rows"""
+    X = np.asarray(X, dtype=np.float64)
+    reference = {"source": source, "rows": len(X), "features": {}}
+    for i, name in enumerate(FEATURES):
+        column = X[:, i]
+        reference["features"][name] = {
+            "mean": float(column.mean()),
+            "std": float(column.std(ddof=1)),
+            "min": float(column.min()),
+            "max": float(column.max()),
+            "quantiles": {str(p): float(np.quantile(column, p)) for p in QUANTILES},
+        }
+    return reference
+
+
+def load_reference(scaler=None, path=REFERENCE_PATH):
+    """The reference file if there is one, otherwise the scaler's statistics; None if neither is available"""
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None if scaler is None else reference_from_scaler(scaler)
+
+
+def feature_drift(stats, reference):
+    """Per-feature live statistics and drift scores against the reference"""
+    report = {}
+    std = stats.std()
+    for i, name in enumerate(FEATURES):
+        ref = reference["features"][name]
+        quantiles = {p: sketch.value() for p, sketch in zip(QUANTILES, stats.quantiles[i])}
+        entry = {
+            "count": stats.count,
+            "mean": float(stats.mean[i]) if stats.count else None,
+            "std": float(std[i]),
+            "min": float(stats.low[i]) if stats.count else None,
+            "max": float(stats.high[i]) if stats.count else None,
+            "quantiles": quantiles,
+            "mean_shift": None,
+            "quantile_shift": None,
+            "outside": None,
+        }
+        scores = []
+        ref_std = ref.get("std")
+        if stats.count and ref_std:
+            entry["mean_shift"] = abs(entry["mean"] - ref["mean"]) / ref_std
+            scores.append(entry["mean_shift"])
+            if "quantiles" in ref and None not in quantiles.values():
+                entry["quantile_shift"] = max(abs(quantiles[p] - ref["quantiles"][str(p)]) / ref_std for p in QUANTILES)
+                scores.append(entry["quantile_shift"])
+        if stats.count and "min" in ref:
+            entry["outside"] = float(stats.outside[i]) / stats.count
+            scores.append(entry["outside"] / OUTSIDE_ALERT)
+        entry["score"] = max(scores) if scores else 0.0
+        entry["drifted"] = stats.count >= MIN_ROWS and entry["score"] >= DRIFT_THRESHOLD
+        report[name] = entry
+    return report
+
+
+class DriftMonitor:
+    """Buffered observation of raw inputs with all-time and rolling-window statistics"""
+
+    def __init__(self, reference, window_rows=WINDOW_ROWS):
+        """reference is None when there is nothing to score against; inputs are still tracked"""
+        self.reference = reference
+        self.window_rows = window_rows
+        features = reference["features"] if reference is not None else {}
+        if features and all("min" in features[name] for name in FEATURES):
+            self._ref_low = np.array([features[name]["min"] for name in FEATURES])
+            self._ref_high = np.array([features[name]["max"] for name in FEATURES])
+        else:
+            self._ref_low = self._ref_high = None
+        self.total = FeatureStats()
+        self.window = FeatureStats()
+        self.previous = None
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def observe(self, features):
+        """Queue one row of raw feature values; a list append on the caller's thread"""
+        with self._buffer_lock:
+            self._buffer.append(features)
+
+    def observe_many(self, X):
+        with self._buffer_lock:
+            self._buffer.extend(np.asarray(X, dtype=np.float64).tolist())
+
+    def start(self, interval=UPDATE_SECONDS):
+        """Fold buffered rows into the statistics on a daemon thread every interval seconds"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(interval,), name="drift-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.update()
+
+    def update(self):
+        """Fold the buffered rows in now; returns how many were used"""
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        X = np.array(rows, dtype=np.float64).reshape(-1, len(FEATURES))
+        # Missing values are a validation problem, not a distribution shift
+        X = X[np.isfinite(X).all(axis=1)]
+        with self._lock:
+            self.total.update(X, self._ref_low, self._ref_high, SKETCH_ROWS)
+            start = 0
+            while start < len(X):
+                take = min(self.window_rows - self.window.count, len(X) - start)
+                sketch_rows = -(-SKETCH_ROWS * take // len(X))
+                self.window.update(X[start:start + take], self._ref_low, self._ref_high, sketch_rows)
+                start += take
+                if self.window.count >= self.window_rows:
+                    self.previous, self.window = self.window, FeatureStats()
+        return len(X)
+
+    def recent(self):
+        """The current window once it has enough rows, otherwise the last full one"""
+        if self.window.count < MIN_ROWS and self.previous is not None:
+            return self.previous
+        return self.window
+
+    def report(self):
+        """Drift scores of the recent window plus all-time statistics; reference None (and no scores) without one"""
+        with self._lock:
+            if self.reference is None:
+                return {"reference": None, "observations": self.total.count, "window": None, "total": None}
+            return {
+                "reference": self.reference.get("source"),
+                "observations": self.total.count,
+                "window": feature_drift(self.recent(), self.reference),
+                "total": feature_drift(self.total, self.reference),
+            }
+
+    def metric_samples(self, prefix="crop_drift"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        report = self.report()
+        samples = [(f"{prefix}_observations_total", "counter", {}, report["observations"])]
+        for name, entry in (report["window"] or {}).items():
+            samples.append((f"{prefix}_score", "gauge", {"feature": name}, entry["score"]))
+            if entry["outside"] is not None:
+                samples.append((f"{prefix}_outside_ratio", "gauge", {"feature": name}, entry["outside"]))
+            if entry["mean"] is not None:
+                samples.append((f"{prefix}_input_mean", "gauge", {"feature": name}, entry["mean"]))
+            for p, value in entry["quantiles"].items():
+                if value is not None:
+                    samples.append((f"{prefix}_input_quantile", "gauge", {"feature": name, "quantile": str(p)}, value))
+        return samples
+
+
+def _read_features(path):
+    from batch_predict import feature_block, read_chunks
+
+    return np.concatenate([feature_block(frame) for frame in read_chunks(path, 100_000)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drift of input distributions against the training data")
+    parser.add_argument("--reference", default=REFERENCE_PATH, help="reference statistics file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("reference", help="compute reference statistics from the training data")
+    build.add_argument("training", help="CSV or Parquet file with the training rows")
+    report = commands.add_parser("report", help="score a file of inputs against the reference")
+    report.add_argument("input", help="CSV or Parquet file with N, P, K, temperature, humidity, ph, rainfall columns")
+    report.add_argument("--model", default=MODEL_PATH, help="model artifact; a .cropz carries its own reference")
+    report.add_argument("--scaler", default=SCALER_PATH, help="fitted scaler, used when there is no reference file")
+    args = parser.parse_args(argv)
+
+    if args.command == "reference":
+        reference = reference_from_data(_read_features(args.training), os.path.basename(args.training))
+        with open(args.reference, "w") as f:
+            json.dump(reference, f, indent=2)
+        print(f"Wrote reference statistics of {reference['rows']} rows to {args.reference}", file=sys.stderr)
+        return 0
+
+    scaler = None if os.path.exists(args.reference) else load_artifacts(args.model, args.scaler)[1]
+    reference = load_reference(scaler, args.reference)
+    if reference is None:
+        parser.exit(1, f"No drift reference: neither {args.reference} nor the scaler has training statistics; "
+                       f"build one with 'python drift.py reference training.csv'\n")
+    monitor = DriftMonitor(reference, window_rows=sys.maxsize)
+    monitor.observe_many(_read_features(args.input))
+    monitor.update()
+    result = monitor.report()
+    print(f"{result['observations']} rows scored against {result['reference']}")
+    for name, entry in result["total"].items():
+        parts = [f"score {entry['score']:.2f}"]
+        for key in ("mean_shift", "quantile_shift"):
+            if entry[key] is not None:
+                parts.append(f"{key} {entry[key]:.2f} sd")
+        if entry["outside"] is not None:
+            parts.append(f"outside training range {entry['outside']:.1%}")
+        flag = "  DRIFT" if entry["drifted"] else ""
+        print(f"{name:<12} mean {entry['mean']:.2f}  " + ", ".join(parts) + flag)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
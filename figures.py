@@ -0,0 +1,172 @@
+"""Plotly figures for the app, free of Streamlit so they can be built and timed anywhere.
+
+app.py wraps these in its caches and render functions; benchmark.py times them
+without importing the app (which would start its model loader, job workers and
+caches). Sensitivity figures also round-trip through JSON for the shared cache.
+"""
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from crop_model import FEATURE_BOUNDS, FEATURES, crop_dict
+from sensitivity import change_points, sweep
+
+
+def create_parameter_gauge(value, min_val, max_val, title, optimal_range=None):
+    """Create a beautiful gauge chart for parameters"""
+    fig = go.Figure(go.Indicator(
+        mode = "gauge+number+delta",
+        value = value,
+        domain = {'x': [0, 1], 'y': [0, 1]},
+        title = {'text': title, 'font': {'size': 16, 'color': '#ffffff'}},
+        delta = {'reference': (min_val + max_val) / 2},
+        gauge = {
+            'axis': {'range': [min_val, max_val], 'tickcolor': '#ffffff'},
+            'bar': {'color': "#667eea"},
+            'steps': [
+                {'range': [min_val, max_val * 0.3], 'color': "rgba(255, 182, 193, 0.3)"},
+                {'range': [max_val * 0.3, max_val * 0.7], 'color': "rgba(255, 255, 0, 0.3)"},
+                {'range': [max_val * 0.7, max_val], 'color': "rgba(144, 238, 144, 0.3)"}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': max_val * 0.9
+            }
+        }
+    ))
+
+    fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font={'color': '#ffffff', 'family': 'Inter'},
+        height=200
+    )
+
+    return fig
+
+
+def create_radar_chart(values):
+    """Create the agricultural parameters radar chart"""
+    categories = ['Nitrogen', 'Phosphorus', 'Potassium', 'Temperature', 'Humidity', 'pH', 'Rainfall']
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Scatterpolar(
+        r=values,
+        theta=categories,
+        fill='toself',
+        fillcolor='rgba(102, 126, 234, 0.3)',
+        line=dict(color='rgba(102, 126, 234, 1)', width=3),
+        name='Current Values'
+    ))
+
+    fig.update_layout(
+        polar=dict(
+            radialaxis=dict(
+                visible=True,
+                range=[0, 100],
+                gridcolor='rgba(255, 255, 255, 0.2)',
+                tickcolor='#ffffff'
+            ),
+            angularaxis=dict(
+                gridcolor='rgba(255, 255, 255, 0.2)',
+                tickcolor='#ffffff'
+            )
+        ),
+        showlegend=True,
+        title={
+            'text': "🎯 Agricultural Parameters Radar Analysis",
+            'x': 0.5,
+            'font': {'size': 20, 'color': '#ffffff'}
+        },
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font={'color': '#ffffff', 'family': 'Inter'},
+        height=500
+    )
+
+    return fig
+
+
+FEATURE_LABELS = {
+    "N": "Nitrogen", "P": "Phosphorus", "K": "Potassium", "temperature": "Temperature",
+    "humidity": "Humidity", "ph": "pH", "rainfall": "Rainfall",
+}
+
+
+def crop_colorscale():
+    """Stepped colorscale giving each crop code its own colour on a heatmap"""
+    palette = px.colors.qualitative.Alphabet
+    codes = sorted(crop_dict)
+    low, high = codes[0] - 0.5, codes[-1] + 0.5
+    scale = []
+    for i, code in enumerate(codes):
+        color = palette[i % len(palette)]
+        scale.append([(code - 0.5 - low) / (high - low), color])
+        scale.append([(code + 0.5 - low) / (high - low), color])
+    return scale, low, high
+
+
+def style_figure(fig, title, height):
+    fig.update_layout(
+        title={'text': title, 'x': 0.5, 'font': {'size': 18, 'color': '#ffffff'}},
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font={'color': '#ffffff', 'family': 'Inter'},
+        height=height,
+        showlegend=False,
+    )
+    return fig
+
+
+def build_sensitivity_figures(engine, features, pair):
+    """Sweep figures and crop change points for one input state"""
+    result = sweep(engine, features, pair)
+    scale, zmin, zmax = crop_colorscale()
+
+    # One row per feature, columns at the same relative positions along each slider
+    rows = [result["features"][name] for name in FEATURES]
+    positions = np.linspace(0, 100, len(rows[0]["values"]))
+    z = np.array([row["labels"] for row in rows])
+    hover = [[f"{FEATURE_LABELS[name]} = {value:g} → {crop_dict.get(int(label), 'Unknown')}"
+              for value, label in zip(row["values"], row["labels"])] for name, row in zip(FEATURES, rows)]
+    strips = go.Figure(go.Heatmap(
+        z=z, x=positions, y=[FEATURE_LABELS[name] for name in FEATURES], text=hover, hoverinfo="text",
+        colorscale=scale, zmin=zmin, zmax=zmax, showscale=False, xgap=1, ygap=3,
+    ))
+    current = [100 * (value - FEATURE_BOUNDS[name][0]) / (FEATURE_BOUNDS[name][1] - FEATURE_BOUNDS[name][0])
+               for name, value in zip(FEATURES, features)]
+    strips.add_trace(go.Scatter(x=current, y=[FEATURE_LABELS[name] for name in FEATURES], mode="markers",
+                                marker=dict(symbol="x", size=12, color="#ffffff"), hoverinfo="skip"))
+    strips.update_xaxes(title_text="Position along the slider range (%)")
+    style_figure(strips, "🎚️ One parameter at a time", 380)
+
+    grid = result["pair"]
+    names = [[crop_dict.get(int(label), "Unknown") for label in row] for row in grid["labels"]]
+    heatmap = go.Figure(go.Heatmap(
+        z=grid["labels"], x=grid["x_values"], y=grid["y_values"], text=names,
+        hovertemplate=f"{FEATURE_LABELS[grid['x']]} %{{x}}<br>{FEATURE_LABELS[grid['y']]} %{{y}}<br>%{{text}}<extra></extra>",
+        colorscale=scale, zmin=zmin, zmax=zmax, showscale=False,
+    ))
+    heatmap.add_trace(go.Scatter(x=[features[FEATURES.index(grid["x"])]], y=[features[FEATURES.index(grid["y"])]],
+                                 mode="markers", marker=dict(symbol="x", size=14, color="#ffffff"), hoverinfo="skip"))
+    heatmap.update_xaxes(title_text=FEATURE_LABELS[grid["x"]])
+    heatmap.update_yaxes(title_text=FEATURE_LABELS[grid["y"]])
+    style_figure(heatmap, f"🗺️ {FEATURE_LABELS[grid['x']]} × {FEATURE_LABELS[grid['y']]}", 460)
+
+    changes = {name: change_points(result, name, value) for name, value in zip(FEATURES, features)}
+    return result["baseline"], strips, heatmap, changes
+
+
+def sensitivity_to_json(figures):
+    """Plain JSON data for build_sensitivity_figures' result, figures as plotly JSON"""
+    baseline, strips, heatmap, changes = figures
+    return {"baseline": baseline, "strips": strips.to_json(), "heatmap": heatmap.to_json(), "changes": changes}
+
+
+def sensitivity_from_json(data):
+    """Inverse of sensitivity_to_json; KeyError, TypeError or ValueError for data in another shape"""
+    return (data["baseline"], pio.from_json(data["strips"]), pio.from_json(data["heatmap"]),
+            {name: tuple(points) for name, points in data["changes"].items()})
@@ -0,0 +1,271 @@
+"""Scaler-fused inference engine for the crop recommendation model.
+
+The Streamlit app used to call ``scaler.transform`` and then ``model.predict``
+for every sample, paying two rounds of sklearn input validation each time.
+``InferenceEngine`` folds the scaler's affine transform into the predictor,
+reuses per-thread input buffers and calls the compiled trees directly,
+so a single slider sample and a million-row block go through the same code.
+
+Run ``python inference.py`` to check parity against the two-step sklearn path.
+"""
+import sys
+import threading
+
+import numpy as np
+
+from crop_model import FEATURE_BOUNDS, FEATURES, load_artifacts, predict_labels
+
+DEFAULT_BLOCK_SIZE = 8192
+
+
+def scaler_affine(scaler):
+    """Return the (kind, a, b) parameters of a fitted scaler's transform, or None if unsupported
+
+    Only MinMaxScaler, StandardScaler and the flat artifact's scaler are folded;
+    anything else (RobustScaler, pipelines, ...) goes through scaler.transform.
+    """
+    from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+    from artifact_format import FlatScaler
+
+    if isinstance(scaler, FlatScaler):
+        return scaler.affine()
+    if isinstance(scaler, MinMaxScaler):
+        if scaler.clip:
+            return None
+        # X * scale_ + min_
+        return "minmax", np.asarray(scaler.scale_, dtype=np.float64), np.asarray(scaler.min_, dtype=np.float64)
+    if isinstance(scaler, StandardScaler):
+        # (X - mean_) / scale_, with either step skipped when disabled (mean_ is still fitted with with_mean=False)
+        n = scaler.n_features_in_
+        mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.with_mean else np.zeros(n)
+        scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler.with_std else np.ones(n)
+        return "standard", scale, mean
+    return None
+
+
+def _tree_estimators(model):
+    """Return the fitted trees of a random forest, extra-trees or decision tree classifier, or None
+
+    Other tree ensembles are not plain averages of their trees (AdaBoost weights
+    them, Bagging feeds each one a feature subset), so they are left to sklearn.
+    """
+    from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+    from sklearn.tree import DecisionTreeClassifier
+
+    if getattr(model, "n_outputs_", 1) != 1:
+        return None
+    if isinstance(model, DecisionTreeClassifier):
+        return [model]
+    if isinstance(model, (RandomForestClassifier, ExtraTreesClassifier)):
+        return list(model.estimators_)
+    return None
+
+
+def _is_ovr_linear(model):
+    """True for linear classifiers that predict the argmax of one score per class"""
+    from sklearn.linear_model import LogisticRegression, RidgeClassifier, SGDClassifier
+    from sklearn.svm import LinearSVC
+
+    if not isinstance(model, (LogisticRegression, LinearSVC, SGDClassifier, RidgeClassifier)):
+        return False
+    rows, n_classes = np.shape(model.coef_)[0], len(model.classes_)
+    return rows == n_classes or (n_classes == 2 and rows == 1)
+
+
+class InferenceEngine:
+    """Predict crop labels from raw (unscaled) feature rows in a single fused pass"""
+
+    def __init__(self, model, scaler, block_size=DEFAULT_BLOCK_SIZE):
+        self.model = model
+        self.scaler = scaler
+        self.block_size = block_size
+        self.n_features = len(FEATURES)
+        self.affine = scaler_affine(scaler)
+        self.trees = _tree_estimators(model)
+        self.classes = np.asarray(getattr(model, "classes_", []))
+
+        self.kind = "generic"
+        if hasattr(model, "predict_proba_into"):
+            # Flat artifact forest: evaluated straight from its memory-mapped arrays
+            self.kind = "flat"
+        elif self.trees is not None:
+            self.kind = "forest"
+            # Older sklearn stores class counts in tree_.value rather than fractions
+            values = self.trees[0].tree_.value[:, 0, :]
+            self._normalize_trees = not np.allclose(values.sum(axis=1), 1.0)
+        elif self.affine is not None and _is_ovr_linear(model):
+            self.kind = "linear"
+            self._fold_linear()
+
+        self._local = threading.local()
+
+    def _fold_linear(self):
+        """Fold the scaler into the linear model so raw inputs go straight into one matmul"""
+        kind, a, b = self.affine
+        coef = np.asarray(self.model.coef_, dtype=np.float64)
+        intercept = np.asarray(self.model.intercept_, dtype=np.float64)
+        if kind == "minmax":
+            # coef @ (x * a + b) = (coef * a) @ x + coef @ b
+            self._coef = (coef * a).T.copy()
+            self._intercept = intercept + coef @ b
+        else:
+            # coef @ ((x - mean) / scale) = (coef / scale) @ x - (coef / scale) @ mean
+            folded = coef / a
+            self._coef = folded.T.copy()
+            self._intercept = intercept - folded @ b
+
+    def _buffers(self, rows):
+        """Per-thread scratch buffers, grown on demand and reused across calls"""
+        local = self._local
+        if getattr(local, "capacity", 0) < rows:
+            local.capacity = rows
+            local.scaled = np.empty((rows, self.n_features), dtype=np.float64)
+            local.scaled32 = np.empty((rows, self.n_features), dtype=np.float32)
+            local.proba = np.empty((rows, len(self.classes)), dtype=np.float64)
+        return local
+
+    def _scale(self, X, out):
+        """Apply the scaler transform to X into out, mirroring sklearn's operation order"""
+        if self.affine is None:
+            out[...] = self.scaler.transform(X)
+            return out
+        kind, a, b = self.affine
+        if kind == "minmax":
+            np.multiply(X, a, out=out)
+            np.add(out, b, out=out)
+        else:
+            np.subtract(X, b, out=out)
+            np.divide(out, a, out=out)
+        return out
+
+    def _proba_block(self, X, out):
+        """Class probabilities for one block of raw rows, written into out"""
+        rows = X.shape[0]
+        local = self._buffers(rows)
+        scaled = self._scale(X, local.scaled[:rows])
+        if self.kind == "forest":
+            scaled32 = local.scaled32[:rows]
+            scaled32[...] = scaled
+            n_classes = out.shape[1]
+            out.fill(0.0)
+            for tree in self.trees:
+                proba = tree.tree_.predict(scaled32)[:, :n_classes]
+                if self._normalize_trees:
+                    normalizer = proba.sum(axis=1)[:, np.newaxis]
+                    normalizer[normalizer == 0.0] = 1.0
+                    proba /= normalizer
+                out += proba
+            out /= len(self.trees)
+        elif self.kind == "flat":
+            scaled32 = local.scaled32[:rows]
+            scaled32[...] = scaled
+            self.model.predict_proba_into(scaled32, out)
+        else:
+            out[...] = self.model.predict_proba(scaled)
+        return out
+
+    def _labels_block(self, X):
+        """Predicted labels for one block of raw rows"""
+        rows = X.shape[0]
+        if self.kind == "generic":
+            return self.model.predict(self._scale(X, self._buffers(rows).scaled[:rows]))
+        if self.kind == "linear":
+            scores = X @ self._coef + self._intercept
+            if scores.shape[1] == 1:
+                return self.classes.take((scores[:, 0] > 0).astype(np.intp))
+            return self.classes.take(scores.argmax(axis=1))
+        proba = self._proba_block(X, self._buffers(rows).proba[:rows])
+        return self.classes.take(proba.argmax(axis=1))
+
+    def _as_block(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X
+
+    def predict(self, X):
+        """Predict labels for a single row of 7 features or a 2D batch of rows"""
+        X = self._as_block(X)
+        n = X.shape[0]
+        if n <= self.block_size:
+            return self._labels_block(X)
+        out = np.empty(n, dtype=self.classes.dtype if len(self.classes) else np.int64)
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            out[start:stop] = self._labels_block(X[start:stop])
+        return out
+
+    def predict_proba(self, X):
+        """Class probabilities (columns ordered like self.classes) for a row or a batch"""
+        X = self._as_block(X)
+        n = X.shape[0]
+        out = np.empty((n, len(self.classes)), dtype=np.float64)
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            self._proba_block(X[start:stop], out[start:stop])
+        return out
+
+    def top_k(self, X, k=3):
+        """Top-k labels and probabilities per row from a single probability pass
+
+        Returns (labels, probabilities), both shaped (n_rows, k) and ordered from
+        most to least likely.
+        """
+        X = self._as_block(X)
+        n = X.shape[0]
+        k = min(k, len(self.classes))
+        labels = np.empty((n, k), dtype=self.classes.dtype)
+        proba = np.empty((n, k), dtype=np.float64)
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            block = self._proba_block(X[start:stop], self._buffers(stop - start).proba[: stop - start])
+            index = top_k_indices(block, k)
+            labels[start:stop] = self.classes.take(index)
+            proba[start:stop] = np.take_along_axis(block, index, axis=1)
+        return labels, proba
+
+    def predict_one(self, *values):
+        """Predict the label for one sample given as 7 positional feature values"""
+        return self.predict(values)[0]
+
+
+def top_k_indices(proba, k):
+    """Column indices of the k largest probabilities per row, most likely first
+
+    Uses a partial sort over each row, then orders only the k survivors. Ties keep
+    the lower class index first, matching argmax.
+    """
+    n_classes = proba.shape[1]
+    if k < n_classes:
+        index = np.argpartition(-proba, k - 1, axis=1)[:, :k]
+    else:
+        index = np.broadcast_to(np.arange(n_classes), proba.shape)
+    top = np.take_along_axis(proba, index, axis=1)
+    order = np.lexsort((index, -top), axis=1)
+    return np.take_along_axis(index, order, axis=1)
+
+
+def parity_check(engine, model, scaler, X):
+    """Return the number of rows where the engine disagrees with scaler.transform + model.predict"""
+    expected = predict_labels(model, scaler, X)
+    actual = engine.predict(X)
+    return int(np.count_nonzero(expected != actual))
+
+
+def random_samples(n, seed=0):
+    """Uniform random feature rows within the slider bounds"""
+    rng = np.random.default_rng(seed)
+    low = np.array([FEATURE_BOUNDS[name][0] for name in FEATURES], dtype=np.float64)
+    high = np.array([FEATURE_BOUNDS[name][1] for name in FEATURES], dtype=np.float64)
+    return rng.uniform(low, high, size=(n, len(FEATURES)))
+
+
+if __name__ == "__main__":
+    model, scaler = load_artifacts()
+    engine = InferenceEngine(model, scaler)
+    X = random_samples(20_000)
+    mismatches = parity_check(engine, model, scaler, X)
+    single = sum(engine.predict_one(*row) != predict_labels(model, scaler, row.reshape(1, -1))[0] for row in X[:200])
+    print(f"engine={engine.kind} batch mismatches={mismatches}/{len(X)} single-row mismatches={single}/200")
+    sys.exit(1 if mismatches or single else 0)
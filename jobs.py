@@ -0,0 +1,553 @@
+"""Background jobs for large batch, sweep and map predictions.
+
+Heavy work runs outside Streamlit script runs, so it neither blocks a session
+nor dies with the browser tab. Jobs are rows in a SQLite database under
+JOBS_DIR; each job gets its own directory for inputs, checkpointed parts and
+results. No broker is needed: any number of workers (a thread in the app, or
+``python jobs.py worker``) claim queued jobs with a single atomic update.
+
+Work is done in chunks and the checkpoint is committed after every chunk, with
+the chunk's output written first, so a job whose worker crashed resumes where
+it stopped. A running job keeps a heartbeat; once it is older than
+LEASE_SECONDS the next worker to look for work puts the job back in the queue.
+
+A job predicts every chunk with the model bundle that was live when it
+started, so a hot reload never mixes two models in one result; a job resumed
+under a different model starts over. Map jobs submitted from the UI may only
+read layers under RASTER_DIR.
+
+Kinds:
+    batch   CSV/Parquet survey file, predicted like batch_predict.py
+    sweep   dense 2D grid of two features around a base row, as CSV
+    raster  feature layers predicted into label/confidence rasters like raster_predict.py
+
+Usage:
+    python jobs.py submit batch survey.csv --top-k 3
+    python jobs.py submit sweep --pair N rainfall --points 1000
+    python jobs.py submit raster district_stack.npy --confidence
+    python jobs.py worker
+    python jobs.py status [job_id]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from batch_predict import DEFAULT_CHUNK_SIZE, _is_parquet, predict_frame, read_chunks
+from crop_model import APP_DIR, FEATURES, label_names
+from model_loader import ModelLoader
+from raster_predict import DEFAULT_TILE, open_layers, predict_raster, tiles
+from sensitivity import axis_values
+from validation import CLAMP, FILL, POLICIES
+
+JOBS_DIR = os.environ.get("CROP_JOBS_DIR", os.path.join(APP_DIR, "jobs"))
+# The only directory map jobs submitted from the UI may read layers from
+RASTER_DIR = os.environ.get("CROP_RASTER_DIR", os.path.join(APP_DIR, "rasters"))
+# A running job whose heartbeat is older than this is considered orphaned and requeued
+LEASE_SECONDS = 60.0
+# How often an idle worker looks for queued jobs
+POLL_SECONDS = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+BATCH = "batch"
+SWEEP = "sweep"
+RASTER = "raster"
+KINDS = (BATCH, SWEEP, RASTER)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    checkpoint TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    model_version TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """Job records in a SQLite database; safe to share between threads and processes"""
+
+    def __init__(self, root=JOBS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "jobs.db")
+        with closing(self._connect()) as db:
+            # WAL lets the UI read progress while a worker is writing
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _execute(self, sql, args=()):
+        with closing(self._connect()) as db:
+            cursor = db.execute(sql, args)
+            return cursor.rowcount, cursor.fetchall()
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def submit(self, kind, params, upload=None):
+        """Queue a job; returns its id
+
+        upload is an optional (file name, bytes) pair, such as a CSV from the
+        browser, stored with the job and used as its input.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+        job_id = uuid.uuid4().hex[:12]
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        if upload is not None:
+            name, data = upload
+            params = dict(params, input=os.path.join(self.job_dir(job_id), "input" + os.path.splitext(name)[1].lower()))
+            with open(params["input"], "wb") as f:
+                f.write(data)
+        self._execute(
+            "INSERT INTO jobs (id, kind, params, state, created) VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params), QUEUED, time.time()),
+        )
+        metrics.inc("crop_jobs_submitted_total", kind=kind)
+        return job_id
+
+    @staticmethod
+    def _record(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["checkpoint"] = json.loads(job["checkpoint"]) if job["checkpoint"] else None
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def get(self, job_id):
+        _, rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._record(rows[0]) if rows else None
+
+    def list(self, limit=50):
+        """Most recent jobs first"""
+        _, rows = self._execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+        return [self._record(row) for row in rows]
+
+    def requeue_orphans(self):
+        """Put running jobs whose worker stopped sending heartbeats back in the queue"""
+        count, _ = self._execute(
+            "UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND heartbeat < ?",
+            (QUEUED, RUNNING, time.time() - LEASE_SECONDS),
+        )
+        return count
+
+    def claim(self, worker_id):
+        """Atomically take the oldest queued job for worker_id; None if the queue is empty"""
+        self.requeue_orphans()
+        now = time.time()
+        count, _ = self._execute(
+            "UPDATE jobs SET state = ?, worker = ?, heartbeat = ?, started = COALESCE(started, ?) "
+            "WHERE id = (SELECT id FROM jobs WHERE state = ? ORDER BY created LIMIT 1) AND state = ?",
+            (RUNNING, worker_id, now, now, QUEUED, QUEUED),
+        )
+        if not count:
+            return None
+        _, rows = self._execute(
+            "SELECT * FROM jobs WHERE state = ? AND worker = ? AND heartbeat = ?", (RUNNING, worker_id, now)
+        )
+        return self._record(rows[0]) if rows else None
+
+    def progress(self, job_id, worker_id, done, total=None, checkpoint=None):
+        """Record progress and the resume point; raises JobCancelled if the job was cancelled or taken over"""
+        count, _ = self._execute(
+            "UPDATE jobs SET done = ?, total = COALESCE(?, total), checkpoint = COALESCE(?, checkpoint), "
+            "heartbeat = ? WHERE id = ? AND state = ? AND worker = ?",
+            (done, total, None if checkpoint is None else json.dumps(checkpoint), time.time(),
+             job_id, RUNNING, worker_id),
+        )
+        if not count:
+            raise JobCancelled(job_id)
+
+    def heartbeat(self, job_id, worker_id):
+        self._execute(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ? AND worker = ?",
+            (time.time(), job_id, RUNNING, worker_id),
+        )
+
+    def set_model_version(self, job_id, version):
+        self._execute("UPDATE jobs SET model_version = ? WHERE id = ?", (version, job_id))
+
+    def finish(self, job_id, worker_id, result):
+        self._execute(
+            "UPDATE jobs SET state = ?, done = COALESCE(total, done), result = ?, finished = ? "
+            "WHERE id = ? AND state = ? AND worker = ?",
+            (DONE, json.dumps(result), time.time(), job_id, RUNNING, worker_id),
+        )
+
+    def fail(self, job_id, worker_id, error):
+        self._execute(
+            "UPDATE jobs SET state = ?, error = ?, finished = ? WHERE id = ? AND state = ? AND worker = ?",
+            (FAILED, error, time.time(), job_id, RUNNING, worker_id),
+        )
+
+    def cancel(self, job_id):
+        """Stop a queued or running job (a running job stops after its current chunk); False if it already finished"""
+        count, _ = self._execute(
+            "UPDATE jobs SET state = ?, finished = ? WHERE id = ? AND state IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+        )
+        return bool(count)
+
+    def delete(self, job_id):
+        """Remove a finished job and its files"""
+        count, _ = self._execute(
+            f"DELETE FROM jobs WHERE id = ? AND state IN ({', '.join('?' * len(FINISHED))})", (job_id, *FINISHED)
+        )
+        if count:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return bool(count)
+
+    def counts(self):
+        """Number of jobs per state"""
+        _, rows = self._execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")
+        return {row["state"]: row["n"] for row in rows}
+
+    def metric_samples(self, prefix="crop_jobs"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        counts = self.counts()
+        return [(prefix, "gauge", {"state": state}, counts.get(state, 0)) for state in (QUEUED, RUNNING, *FINISHED)]
+
+
+def _part_path(job_dir, index, suffix):
+    return os.path.join(job_dir, "parts", f"part-{index:06d}{suffix}")
+
+
+def _write_part(job_dir, index, frame, suffix):
+    """Write one chunk's output atomically, so a checkpoint never points at a half-written part"""
+    path = _part_path(job_dir, index, suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    if suffix == ".parquet":
+        frame.to_parquet(tmp, index=False)
+    else:
+        frame.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _merge_parts(job_dir, parts, output_path):
+    """Concatenate the part files into output_path without loading them all at once"""
+    if output_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for index in range(parts):
+                table = pq.read_table(_part_path(job_dir, index, ".parquet"))
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(output_path, "wb") as out:
+            for index in range(parts):
+                with open(_part_path(job_dir, index, ".csv"), "rb") as part:
+                    if index:
+                        part.readline()  # header
+                    shutil.copyfileobj(part, out, 1 << 20)
+    shutil.rmtree(os.path.join(job_dir, "parts"), ignore_errors=True)
+
+
+def count_rows(path):
+    """Data rows in a CSV or Parquet file, for progress totals"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    # A final line without a newline still counts; the header does not
+    return max(lines + (last != b"\n") - 1, 0)
+
+
+def raster_input(path, root=RASTER_DIR):
+    """Absolute path of a layer stack named relative to root; ValueError if it resolves outside root"""
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Layers must be under {root}")
+    if not os.path.exists(resolved):
+        raise ValueError(f"No layers at {resolved}")
+    return resolved
+
+
+def _run_batch(job, job_dir, bundle, loader, report):
+    params = job["params"]
+    suffix = ".parquet" if _is_parquet(params["input"]) else ".csv"
+    chunk_size = params.get("chunk_size", DEFAULT_CHUNK_SIZE)
+    checkpoint = job["checkpoint"] or {"chunks": 0, "rows": 0, "invalid": 0, "clamped": 0}
+    total = count_rows(params["input"])
+    report(checkpoint["rows"], total, None)
+    for index, frame in enumerate(read_chunks(params["input"], chunk_size)):
+        if index < checkpoint["chunks"]:
+            continue
+        summary = predict_frame(frame, bundle.engine, params.get("top_k", 1), params.get("out_of_range", CLAMP))
+        _write_part(job_dir, index, frame, suffix)
+        checkpoint = {
+            "chunks": index + 1,
+            "rows": checkpoint["rows"] + summary["rows"],
+            "invalid": checkpoint["invalid"] + summary["invalid"],
+            "clamped": checkpoint["clamped"] + summary["clamped"],
+        }
+        report(checkpoint["rows"], total, checkpoint)
+    output = os.path.join(job_dir, "predictions" + suffix)
+    _merge_parts(job_dir, checkpoint["chunks"], output)
+    return {"path": output, **{key: checkpoint[key] for key in ("rows", "invalid", "clamped")}}
+
+
+def sweep_grid(base, pair, points, start, stop):
+    """Rows start..stop of the points x points grid over pair around base, with pair[0] varying fastest"""
+    x_name, y_name = pair
+    x_values, y_values = axis_values(x_name, points), axis_values(y_name, points)
+    index = np.arange(start, stop)
+    X = np.repeat(np.asarray(base, dtype=np.float64)[None, :], len(index), axis=0)
+    X[:, FEATURES.index(x_name)] = x_values[index % points]
+    X[:, FEATURES.index(y_name)] = y_values[index // points]
+    return X
+
+
+def _run_sweep(job, job_dir, bundle, loader, report):
+    params = job["params"]
+    pair, points = params["pair"], params["points"]
+    chunk_size = params.get("chunk_size", DEFAULT_CHUNK_SIZE)
+    total = points * points
+    checkpoint = job["checkpoint"] or {"chunks": 0}
+    chunks = -(-total // chunk_size)
+    report(min(checkpoint["chunks"] * chunk_size, total), total, None)
+    for index in range(checkpoint["chunks"], chunks):
+        start, stop = index * chunk_size, min((index + 1) * chunk_size, total)
+        X = sweep_grid(params["base"], pair, points, start, stop)
+        labels = bundle.engine.predict(X)
+        frame = pd.DataFrame({pair[0]: X[:, FEATURES.index(pair[0])], pair[1]: X[:, FEATURES.index(pair[1])],
+                              "label": labels, "crop": label_names(labels)})
+        _write_part(job_dir, index, frame, ".csv")
+        checkpoint = {"chunks": index + 1}
+        report(stop, total, checkpoint)
+    output = os.path.join(job_dir, "sweep.csv")
+    _merge_parts(job_dir, chunks, output)
+    return {"path": output, "rows": total}
+
+
+def _run_raster(job, job_dir, bundle, loader, report):
+    params = job["params"]
+    windows = len(tiles(open_layers(params["input"])[0].shape, params.get("tile", DEFAULT_TILE)))
+    checkpoint = job["checkpoint"] or {"tiles": 0, "pixels": 0, "nodata": 0, "clamped": 0}
+    labels_path = os.path.join(job_dir, "labels.npy")
+    confidence_path = os.path.join(job_dir, "confidence.npy") if params.get("confidence") else None
+    report(checkpoint["tiles"], windows, None)
+
+    def on_tile(done, pixels, nodata, clamped):
+        checkpoint.update(tiles=done, pixels=checkpoint["pixels"] + pixels,
+                          nodata=checkpoint["nodata"] + nodata, clamped=checkpoint["clamped"] + clamped)
+        report(done, windows, dict(checkpoint))
+
+    # Workers load the loader's files in their own processes and refuse any version but the job's bundle
+    summary = predict_raster(params["input"], labels_path, confidence_path, params.get("tile", DEFAULT_TILE),
+                             params.get("workers"), loader.model_path, loader.scaler_path, progress=False,
+                             start_tile=checkpoint["tiles"], on_tile=on_tile, model_version=bundle.version)
+    result = {"path": labels_path, "rows": summary["rows"], "cols": summary["cols"],
+              **{key: checkpoint[key] for key in ("pixels", "nodata", "clamped")}}
+    if confidence_path:
+        result["confidence_path"] = confidence_path
+    return result
+
+
+_RUNNERS = {BATCH: _run_batch, SWEEP: _run_sweep, RASTER: _run_raster}
+
+
+class JobWorker:
+    """Claim and run queued jobs on a background thread with the loader's engine"""
+
+    def __init__(self, store, loader, poll=POLL_SECONDS):
+        self.store = store
+        self.loader = loader
+        self.poll = poll
+        self.id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.current = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="job-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self.loader.wait(self.poll) or not self.run_next():
+                self._stop.wait(self.poll)
+
+    def run_next(self):
+        """Run one queued job to completion; False if there was nothing to do"""
+        job = self.store.claim(self.id)
+        if job is None:
+            return False
+        self.current = job["id"]
+        beating = threading.Event()
+        # Long chunks (large tiles, big CSV chunks) must not let the lease lapse
+        beat = threading.Thread(target=self._beat, args=(job["id"], beating), daemon=True)
+        beat.start()
+        try:
+            self._run(job)
+        finally:
+            beating.set()
+            self.current = None
+        return True
+
+    def _beat(self, job_id, stop):
+        while not stop.wait(LEASE_SECONDS / 4):
+            self.store.heartbeat(job_id, self.id)
+
+    def _run(self, job):
+        job_id, kind = job["id"], job["kind"]
+        # One bundle for the whole job: a hot reload applies from the next job
+        bundle = self.loader.bundle
+        if job["model_version"] not in (None, bundle.version):
+            # The saved parts came from another model
+            job = dict(job, checkpoint=None)
+        self.store.set_model_version(job_id, bundle.version)
+
+        def report(done, total, checkpoint):
+            self.store.progress(job_id, self.id, done, total, checkpoint)
+
+        start = time.perf_counter()
+        try:
+            result = _RUNNERS[kind](job, self.store.job_dir(job_id), bundle, self.loader, report)
+        except JobCancelled:
+            metrics.inc("crop_jobs_finished_total", kind=kind, state=CANCELLED)
+            return
+        except Exception as e:
+            self.store.fail(job_id, self.id, f"{type(e).__name__}: {e}")
+            metrics.inc("crop_jobs_finished_total", kind=kind, state=FAILED)
+            return
+        self.store.finish(job_id, self.id, result)
+        metrics.inc("crop_jobs_finished_total", kind=kind, state=DONE)
+        metrics.observe("crop_job_seconds", time.perf_counter() - start, kind=kind)
+
+
+def _print_job(job):
+    total = job["total"]
+    progress = f"{job['done']}/{total}" if total else str(job["done"])
+    line = f"{job['id']}  {job['kind']:<6}  {job['state']:<9}  {progress}"
+    if job["result"]:
+        line += f"  -> {job['result']['path']}"
+    if job["error"]:
+        line += f"  {job['error']}"
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background prediction jobs")
+    parser.add_argument("--jobs-dir", default=JOBS_DIR, help="directory holding the job database and outputs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="queue a job")
+    kinds = submit.add_subparsers(dest="kind", required=True)
+    batch = kinds.add_parser(BATCH, help="predict a CSV or Parquet survey file")
+    batch.add_argument("input")
+    batch.add_argument("--top-k", type=int, default=1)
+    batch.add_argument("--out-of-range", choices=POLICIES, default=CLAMP)
+    batch.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    sweep = kinds.add_parser(SWEEP, help="predict a dense grid of two features")
+    sweep.add_argument("--pair", nargs=2, default=["N", "rainfall"], choices=FEATURES)
+    sweep.add_argument("--points", type=int, default=500, help="grid points per feature")
+    sweep.add_argument("--base", nargs=len(FEATURES), type=float, metavar="VALUE",
+                       help="values of the other features, in FEATURES order (default: slider midpoints)")
+    sweep.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    raster = kinds.add_parser(RASTER, help="predict label rasters from feature layers")
+    raster.add_argument("input")
+    raster.add_argument("--confidence", action="store_true")
+    raster.add_argument("--tile", type=int, default=DEFAULT_TILE)
+    raster.add_argument("--workers", type=int, default=None)
+
+    commands.add_parser("worker", help="run queued jobs until interrupted")
+    status = commands.add_parser("status", help="list jobs")
+    status.add_argument("job_id", nargs="?")
+    cancel = commands.add_parser("cancel", help="cancel a queued or running job")
+    cancel.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    store = JobStore(args.jobs_dir)
+    if args.command == "submit":
+        if args.kind == BATCH:
+            params = {"input": os.path.abspath(args.input), "top_k": args.top_k,
+                      "out_of_range": args.out_of_range, "chunk_size": args.chunk_size}
+        elif args.kind == SWEEP:
+            params = {"pair": args.pair, "points": args.points, "chunk_size": args.chunk_size,
+                      "base": list(args.base) if args.base else FILL.tolist()}
+        else:
+            params = {"input": os.path.abspath(args.input), "confidence": args.confidence,
+                      "tile": args.tile, "workers": args.workers}
+        print(store.submit(args.kind, params))
+    elif args.command == "worker":
+        loader = ModelLoader().start()
+        if not loader.wait():
+            parser.exit(1, f"{loader.error}\n")
+        worker = JobWorker(store, loader)
+        print(f"Worker {worker.id} waiting for jobs in {store.root}", file=sys.stderr)
+        try:
+            while True:
+                if not worker.run_next():
+                    time.sleep(worker.poll)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "status":
+        jobs = [store.get(args.job_id)] if args.job_id else store.list()
+        for job in jobs:
+            if job is None:
+                parser.exit(1, f"No job {args.job_id}\n")
+            _print_job(job)
+    elif args.command == "cancel":
+        if not store.cancel(args.job_id):
+            parser.exit(1, f"Job {args.job_id} is not queued or running\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Load test for the prediction API (api_server.py).
+
+Usage:
+    python load_test.py --url http://127.0.0.1:8080 --concurrency 64 --duration 20
+    python load_test.py --batch-size 500 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+import numpy as np
+
+from crop_model import FEATURES
+from inference import random_samples
+
+
+async def _worker(session, url, payloads, deadline, latencies, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        body = payloads[i % len(payloads)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                await response.read()
+                if response.status != 200:
+                    errors[response.status] = errors.get(response.status, 0) + 1
+                    continue
+        except aiohttp.ClientError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(url, concurrency, duration, batch_size):
+    samples = random_samples(max(1000, batch_size * 20), seed=7)
+    if batch_size > 1:
+        endpoint = url.rstrip("/") + "/predict/batch"
+        payloads = [
+            json.dumps({"instances": samples[start : start + batch_size].round(2).tolist()})
+            for start in range(0, len(samples) - batch_size + 1, batch_size)
+        ]
+    else:
+        endpoint = url.rstrip("/") + "/predict"
+        payloads = [json.dumps(dict(zip(FEATURES, row.round(2).tolist()))) for row in samples]
+
+    latencies, errors = [], {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(
+            *(_worker(session, endpoint, payloads[i::concurrency] or payloads, deadline, latencies, errors)
+              for i in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+
+    result = {"endpoint": endpoint, "requests": len(latencies), "errors": errors, "seconds": elapsed,
+              "requests_per_second": len(latencies) / elapsed,
+              "rows_per_second": len(latencies) * batch_size / elapsed}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+        result.update({"p50_ms": p50, "p95_ms": p95, "p99_ms": p99})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the crop prediction API")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--batch-size", type=int, default=1, help="rows per request; >1 uses /predict/batch")
+    args = parser.parse_args(argv)
+    result = asyncio.run(run(args.url, args.concurrency, args.duration, args.batch_size))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Precomputed decision-surface lookup table over the slider grid.
+
+An offline build evaluates the model at every node of a coarse grid spanning the
+slider ranges and stores the predicted class, plus the top few ranked crops and
+their probabilities, as memory-mapped arrays.
+Interactive requests snap to the nearest grid node for an O(1) answer; nodes that
+sit next to a different class are flagged as boundary cells, where callers can
+fall back to the exact model.
+
+Usage:
+    python lookup_table.py build decision_table --points 10 --workers 8
+    python lookup_table.py check decision_table
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from crop_model import APP_DIR, FEATURE_BOUNDS, FEATURES, MODEL_PATH, SCALER_PATH, load_artifacts
+from inference import InferenceEngine, random_samples
+from model_loader import artifact_files, artifact_version
+
+TABLE_DIR = os.environ.get("CROP_LOOKUP_TABLE", os.path.join(APP_DIR, "decision_table"))
+FORMAT_VERSION = 2
+DEFAULT_POINTS = 8
+# Ranked alternatives stored per grid node
+TABLE_TOP_K = 3
+BUILD_BLOCK = 65_536
+
+_LOW = np.array([FEATURE_BOUNDS[name][0] for name in FEATURES], dtype=np.float64)
+_HIGH = np.array([FEATURE_BOUNDS[name][1] for name in FEATURES], dtype=np.float64)
+
+
+def grid_axes(points):
+    """Grid node coordinates for each feature"""
+    return [np.linspace(low, high, n) for low, high, n in zip(_LOW, _HIGH, points)]
+
+
+# Per-worker state for the parallel build
+_worker = {}
+
+
+def _init_worker(model_path, scaler_path, out_dir, shape, classes):
+    model, scaler = load_artifacts(model_path, scaler_path)
+    _worker["engine"] = InferenceEngine(model, scaler)
+    _worker["labels"] = np.load(os.path.join(out_dir, "labels.npy"), mmap_mode="r+")
+    _worker["topk_labels"] = np.load(os.path.join(out_dir, "topk_labels.npy"), mmap_mode="r+")
+    _worker["topk_proba"] = np.load(os.path.join(out_dir, "topk_proba.npy"), mmap_mode="r+")
+    _worker["axes"] = grid_axes(shape)
+    _worker["shape"] = shape
+    _worker["classes"] = np.asarray(classes)
+
+
+def _evaluate_range(start, stop):
+    """Evaluate the model on flat grid indices [start, stop) and write class indices into the table"""
+    index = np.unravel_index(np.arange(start, stop), _worker["shape"])
+    X = np.column_stack([axis[i] for axis, i in zip(_worker["axes"], index)])
+    labels, proba = _worker["engine"].top_k(X, TABLE_TOP_K)
+    classes = _worker["classes"]
+    _worker["labels"].reshape(-1)[start:stop] = np.searchsorted(classes, labels[:, 0])
+    k = labels.shape[1]
+    _worker["topk_labels"].reshape(-1, k)[start:stop] = np.searchsorted(classes, labels)
+    _worker["topk_proba"].reshape(-1, k)[start:stop] = proba
+    return stop - start
+
+
+def _boundary_mask(labels, boundary):
+    """Flag every node whose neighbour along any axis predicts a different class"""
+    n0 = labels.shape[0]
+    for start in range(0, n0, 8):
+        stop = min(start + 8, n0)
+        lo, hi = max(start - 1, 0), min(stop + 1, n0)
+        slab = np.asarray(labels[lo:hi])
+        mask = np.zeros(slab.shape, dtype=bool)
+        for axis in range(slab.ndim):
+            head = [slice(None)] * slab.ndim
+            tail = [slice(None)] * slab.ndim
+            head[axis] = slice(1, None)
+            tail[axis] = slice(None, -1)
+            diff = slab[tuple(head)] != slab[tuple(tail)]
+            mask[tuple(head)] |= diff
+            mask[tuple(tail)] |= diff
+        boundary[start:stop] = mask[start - lo : start - lo + (stop - start)]
+
+
+def build(out_dir, points, model_path=MODEL_PATH, scaler_path=SCALER_PATH, workers=None, samples=20_000):
+    """Evaluate the model over the grid in parallel and write the table to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    shape = tuple(int(n) for n in points)
+    model_version = artifact_version(artifact_files(model_path, scaler_path))
+    model, scaler = load_artifacts(model_path, scaler_path)
+    classes = np.asarray(model.classes_)
+    if len(classes) > 255:
+        raise ValueError("Lookup tables support at most 255 classes")
+
+    k = min(TABLE_TOP_K, len(classes))
+    for name, dtype, node_shape in (
+        ("labels", np.uint8, shape),
+        ("topk_labels", np.uint8, shape + (k,)),
+        ("topk_proba", np.float16, shape + (k,)),
+    ):
+        np.lib.format.open_memmap(os.path.join(out_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=node_shape)
+
+    total = int(np.prod(shape))
+    start_time = time.perf_counter()
+    ranges = [(start, min(start + BUILD_BLOCK, total)) for start in range(0, total, BUILD_BLOCK)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        # Spawn rather than fork, which is unsafe once the caller has started threads
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_path, scaler_path, out_dir, shape, classes.tolist()),
+    ) as pool:
+        done = 0
+        for count in pool.map(_evaluate_range, *zip(*ranges)):
+            done += count
+            print(f"\r{done}/{total} grid nodes", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    build_seconds = time.perf_counter() - start_time
+    # The workers loaded the files themselves: a table spanning two models must not be tagged with either
+    if artifact_version(artifact_files(model_path, scaler_path)) != model_version:
+        raise ValueError("The model or scaler changed during the build; build the table again")
+
+    labels = np.load(os.path.join(out_dir, "labels.npy"), mmap_mode="r")
+    boundary = np.lib.format.open_memmap(os.path.join(out_dir, "boundary.npy"), mode="w+", dtype=bool, shape=shape)
+    _boundary_mask(labels, boundary)
+    boundary.flush()
+    del boundary
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "features": FEATURES,
+        "low": _LOW.tolist(),
+        "high": _HIGH.tolist(),
+        "points": list(shape),
+        "classes": classes.tolist(),
+        "model_version": model_version,
+        "build_seconds": build_seconds,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    table = DecisionTable.load(out_dir)
+    meta["disagreement"] = table.disagreement(InferenceEngine(model, scaler), samples)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class DecisionTable:
+    """Memory-mapped grid of predicted classes with O(1) nearest-node lookup"""
+
+    def __init__(self, labels, boundary, topk_labels, topk_proba, meta):
+        self.labels = labels
+        self.boundary = boundary
+        self.meta = meta
+        self.k = topk_labels.shape[-1]
+        self._flat_topk_labels = topk_labels.reshape(-1, self.k)
+        self._flat_topk_proba = topk_proba.reshape(-1, self.k)
+        self.classes = np.asarray(meta["classes"])
+        self.low = np.asarray(meta["low"], dtype=np.float64)
+        self.high = np.asarray(meta["high"], dtype=np.float64)
+        self.points = np.asarray(meta["points"], dtype=np.int64)
+        self._step = (self.high - self.low) / (self.points - 1)
+        self._strides = np.array([int(np.prod(self.points[i + 1 :])) for i in range(len(self.points))], dtype=np.int64)
+        self._flat_labels = labels.reshape(-1)
+        self._flat_boundary = boundary.reshape(-1)
+
+    @classmethod
+    def load(cls, table_dir=TABLE_DIR):
+        with open(os.path.join(table_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION or meta.get("features") != FEATURES:
+            raise ValueError(f"Unsupported lookup table in {table_dir}")
+        labels = np.load(os.path.join(table_dir, "labels.npy"), mmap_mode="r")
+        boundary = np.load(os.path.join(table_dir, "boundary.npy"), mmap_mode="r")
+        topk_labels = np.load(os.path.join(table_dir, "topk_labels.npy"), mmap_mode="r")
+        topk_proba = np.load(os.path.join(table_dir, "topk_proba.npy"), mmap_mode="r")
+        return cls(labels, boundary, topk_labels, topk_proba, meta)
+
+    def is_stale(self, model_version):
+        """True unless the table was built with the model of this version (see model_loader.artifact_version)"""
+        return self.meta.get("model_version") != model_version
+
+    def _flat_index(self, X):
+        nodes = np.rint((X - self.low) / self._step)
+        np.clip(nodes, 0, self.points - 1, out=nodes)
+        return nodes.astype(np.int64) @ self._strides
+
+    def lookup(self, X):
+        """Return (labels, boundary flags) for a row or a 2D batch of raw feature rows"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        flat = self._flat_index(X)
+        return self.classes.take(self._flat_labels[flat]), np.asarray(self._flat_boundary[flat])
+
+    def predict(self, X, engine=None):
+        """Table predictions, re-evaluated with the exact engine on boundary cells when one is given"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        labels, boundary = self.lookup(X)
+        if engine is not None and boundary.any():
+            labels[boundary] = engine.predict(X[boundary])
+        return labels
+
+    def top_k(self, X, k, engine=None):
+        """Ranked (labels, probabilities) from the table, exact on boundary cells when an engine is given"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if k > self.k:
+            if engine is None:
+                raise ValueError(f"Table only stores the top {self.k} crops")
+            return engine.top_k(X, k)
+        flat = self._flat_index(X)
+        labels = self.classes.take(self._flat_topk_labels[flat, :k])
+        proba = self._flat_topk_proba[flat, :k].astype(np.float64)
+        boundary = np.asarray(self._flat_boundary[flat])
+        if engine is not None and boundary.any():
+            labels[boundary], proba[boundary] = engine.top_k(X[boundary], k)
+        return labels, proba
+
+    def disagreement(self, engine, samples=20_000, seed=1):
+        """Fraction of random samples where the table disagrees with the exact model"""
+        X = random_samples(samples, seed)
+        exact = engine.predict(X)
+        table_only, boundary = self.lookup(X)
+        with_fallback = table_only.copy()
+        with_fallback[boundary] = exact[boundary]
+        return {
+            "samples": samples,
+            "table_only": float(np.mean(table_only != exact)),
+            "with_fallback": float(np.mean(with_fallback != exact)),
+            "boundary_fraction": float(np.mean(boundary)),
+        }
+
+
+def _parse_points(text):
+    """Parse '8' or 'N=14,P=14,K=20,temperature=10,humidity=10,ph=14,rainfall=15'"""
+    if "=" not in text:
+        return [int(text)] * len(FEATURES)
+    points = dict.fromkeys(FEATURES, DEFAULT_POINTS)
+    for part in text.split(","):
+        name, value = part.split("=")
+        if name not in points:
+            raise argparse.ArgumentTypeError(f"Unknown feature '{name}'")
+        points[name] = int(value)
+    return [points[name] for name in FEATURES]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or check the precomputed crop decision table")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="evaluate the model over the slider grid")
+    build_parser.add_argument("out_dir", nargs="?", default=TABLE_DIR)
+    build_parser.add_argument("--points", type=_parse_points, default=[DEFAULT_POINTS] * len(FEATURES),
+                              help="grid points per feature, e.g. 8 or N=14,P=14,...")
+    build_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    build_parser.add_argument("--samples", type=int, default=20_000, help="random samples for the disagreement report")
+    check_parser = sub.add_parser("check", help="report how often the table disagrees with the exact model")
+    check_parser.add_argument("table_dir", nargs="?", default=TABLE_DIR)
+    check_parser.add_argument("--samples", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        meta = build(args.out_dir, args.points, workers=args.workers, samples=args.samples)
+        report = meta["disagreement"]
+        print(f"Built {'x'.join(map(str, meta['points']))} grid in {meta['build_seconds']:.1f}s")
+    else:
+        table = DecisionTable.load(args.table_dir)
+        if table.is_stale(artifact_version(artifact_files(MODEL_PATH, SCALER_PATH))):
+            print("Warning: the model or scaler changed since this table was built", file=sys.stderr)
+        report = table.disagreement(InferenceEngine(*load_artifacts()), args.samples)
+    print(
+        f"Disagreement with exact model: {report['table_only']:.2%} table only, "
+        f"{report['with_fallback']:.2%} with boundary fallback "
+        f"({report['boundary_fraction']:.1%} of samples in boundary cells)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Low-overhead in-process metrics with a Prometheus text endpoint.
+
+Stage timings go into fixed log-spaced histogram buckets (one bisect and one
+counter increment per observation), so recording stays on in production.
+Quantiles (p50/p95/p99) are estimated from the buckets when a snapshot is taken.
+Counters carry optional labels, and collectors are called at scrape time for
+values owned elsewhere, such as the prediction cache counters.
+
+    import metrics
+    with metrics.timed("crop_predict_seconds", path="engine"):
+        ...
+    metrics.inc("crop_predictions_total", crop="Rice")
+
+``start_http_server(port)`` serves ``/metrics`` (Prometheus text format) and
+``/metrics.json`` (snapshot with quantiles) from a daemon thread.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket upper bounds from 10us to ~100s, about 12 per decade
+BUCKETS = tuple(10 ** (exp / 12.0) * 1e-5 for exp in range(0, 12 * 7 + 1))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating inside the bucket that crosses it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Registry:
+    """Thread-safe store of histograms, counters and gauges keyed by name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def register_collector(self, collector):
+        """Add a callable returning (name, "counter" | "gauge", labels, value) tuples at scrape time"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collected(self):
+        counters, gauges = {}, {}
+        for collector in list(self._collectors):
+            try:
+                samples = list(collector())
+            except Exception:
+                # A broken collector must not take the whole endpoint down
+                continue
+            for name, kind, labels, value in samples:
+                target = counters if kind == "counter" else gauges
+                target[(name, _label_key(labels))] = value
+        return counters, gauges
+
+    def _copy(self):
+        with self._lock:
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                copy = Histogram()
+                copy.counts, copy.total, copy.count = list(histogram.counts), histogram.total, histogram.count
+                histograms[key] = copy
+            counters, gauges = dict(self._counters), dict(self._gauges)
+        collected_counters, collected_gauges = self._collected()
+        counters.update(collected_counters)
+        gauges.update(collected_gauges)
+        return histograms, counters, gauges
+
+    def snapshot(self):
+        """Plain dict of every metric, with p50/p95/p99 for histograms"""
+        histograms, counters, gauges = self._copy()
+        result = {"histograms": {}, "counters": {}, "gauges": {}}
+        for (name, key), histogram in sorted(histograms.items()):
+            entry = {"count": histogram.count, "sum": histogram.total}
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}"] = histogram.quantile(q)
+            result["histograms"][name + _format_labels(key)] = entry
+        for section, values in (("counters", counters), ("gauges", gauges)):
+            for (name, key), value in sorted(values.items()):
+                result[section][name + _format_labels(key)] = value
+        return result
+
+    def render_prometheus(self):
+        """Prometheus text exposition format"""
+        histograms, counters, gauges = self._copy()
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), histogram in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (math.inf,), histogram.counts):
+                cumulative += n
+                # Empty leading buckets add nothing to a cumulative histogram
+                if cumulative or bound == math.inf:
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {histogram.total!r}")
+            lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, key), value in sorted(values.items()):
+                header(name, kind)
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+describe = REGISTRY.describe
+observe = REGISTRY.observe
+timed = REGISTRY.timed
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+register_collector = REGISTRY.register_collector
+snapshot = REGISTRY.snapshot
+render_prometheus = REGISTRY.render_prometheus
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(self.registry.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics and /metrics.json for registry on a daemon thread; returns the server"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
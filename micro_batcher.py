@@ -0,0 +1,144 @@
+"""Micro-batching dispatcher for concurrent single-sample predictions.
+
+Each sklearn call has a fixed overhead that dwarfs the work for one 1x7 row.
+``MicroBatcher`` collects rows submitted from many threads (Streamlit sessions or
+API requests) for up to ``max_wait_ms`` or ``max_batch`` rows, runs one vectorized
+prediction on the stacked block and hands each caller its own row of the result.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from crop_model import FEATURES
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 2.0
+DEFAULT_MAX_QUEUE = 10_000
+
+
+class MicroBatcher:
+    """Coalesce single-row predictions into batched calls of predict_fn
+
+    predict_fn takes an (n, 7) float64 block and returns either an array or a
+    tuple of arrays whose first axis has n rows; each caller receives its row
+    (or a tuple of its rows).
+    """
+
+    def __init__(self, predict_fn, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 max_queue=DEFAULT_MAX_QUEUE):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._block = np.empty((max_batch, len(FEATURES)), dtype=np.float64)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.max_seen = 0
+        # batch_sizes[i] counts batches of size in (2**(i-1), 2**i]
+        self.batch_sizes = [0] * (max(max_batch, 1).bit_length() + 1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, features):
+        """Queue one row of 7 features; returns a Future for its prediction
+
+        Raises queue.Full when max_queue rows are already waiting.
+        """
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put_nowait((features, future))
+        return future
+
+    def predict(self, features, timeout=None):
+        """Submit one row and block until its prediction is ready"""
+        return self.submit(features).result(timeout)
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Drop requests whose callers already gave up
+            batch = [(features, future) for features, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            rows = [features for features, _ in batch]
+            futures = [future for _, future in batch]
+            n = len(rows)
+            block = self._block[:n]
+            try:
+                block[...] = rows
+                result = self.predict_fn(block)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self._record(n)
+            for i, future in enumerate(futures):
+                if isinstance(result, tuple):
+                    future.set_result(tuple(part[i] for part in result))
+                else:
+                    future.set_result(result[i])
+
+    def _record(self, n):
+        with self._lock:
+            self.batches += 1
+            self.rows += n
+            self.max_seen = max(self.max_seen, n)
+            self.batch_sizes[(n - 1).bit_length()] += 1
+
+    def stats(self):
+        """Achieved batch sizes so far"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_seen,
+                "batch_size_histogram": {
+                    f"<={2 ** i}": count for i, count in enumerate(self.batch_sizes) if count
+                },
+                "queued": self._queue.qsize(),
+            }
+
+    def metric_samples(self, prefix="crop_microbatch"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        stats = self.stats()
+        return [
+            (f"{prefix}_batches_total", "counter", {}, stats["batches"]),
+            (f"{prefix}_rows_total", "counter", {}, stats["rows"]),
+            (f"{prefix}_max_size", "gauge", {}, stats["max_batch_size"]),
+            (f"{prefix}_queued", "gauge", {}, stats["queued"]),
+        ]
+
+    def close(self):
+        """Stop the dispatcher after the requests already queued are served"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
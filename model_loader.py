@@ -0,0 +1,267 @@
+"""Background model loading with a readiness state the UI can poll.
+
+Unpickling the forest is the slowest part of a cold start, so it runs on a
+warm-up thread instead of inside the first session's script run. Missing files
+are reported straight away with the exact paths instead of a generic error.
+
+A loaded loader can pick up retrained artifacts without a restart: ``reload()``
+loads and validates the new files on a background thread and then swaps the
+engine in with a single reference assignment, so predictions already running
+finish on the old model. Model, scaler, engine and version are published
+together as one immutable ``ModelBundle``: a request reads ``loader.bundle``
+once and uses its engine and version, so a result is never tagged with the
+version of a model that did not compute it. ``watch()`` polls the files and reloads once a change
+has settled.
+
+``CROP_MODEL_MMAP=r`` loads the model with joblib's ``mmap_mode`` so numpy arrays
+stored in the pickle are shared between worker processes through the page cache.
+Note that sklearn trees copy their node arrays on unpickling; for fully shared
+forests use the flat artifact format instead.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+from crop_model import FEATURES, MODEL_PATH, SCALER_PATH, crop_dict, load_artifacts
+from inference import InferenceEngine, random_samples
+
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+MMAP_MODE = os.environ.get("CROP_MODEL_MMAP") or None
+# How often to check the artifact files for a retrained model (0 = never)
+WATCH_SECONDS = float(os.environ.get("CROP_MODEL_WATCH_SECONDS", "5"))
+# Rows predicted to validate freshly loaded artifacts before they go live
+VALIDATION_ROWS = 256
+
+# Everything one loaded artifact set provides, swapped in as a unit
+ModelBundle = namedtuple("ModelBundle", ["model", "scaler", "engine", "version"])
+
+
+def _file_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def artifact_files(model_path, scaler_path):
+    """The files a model version covers; a flat artifact carries its own scaler"""
+    if model_path.endswith(".cropz"):
+        return (model_path,)
+    return (model_path, scaler_path)
+
+
+def artifact_version(paths):
+    """Short content hash identifying a set of artifact files"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_version(model_path, scaler_path, version):
+    """load_artifacts for one model version; ValueError if the files on disk are, or become, another version
+
+    For processes that load a bundle's model for themselves, such as raster
+    workers, so a hot reload mid-run cannot mix two models in one result.
+    """
+    paths = artifact_files(model_path, scaler_path)
+    if artifact_version(paths) != version:
+        raise ValueError(f"The model files on disk are no longer version {version}")
+    model, scaler = load_artifacts(model_path, scaler_path)
+    # Replaced while loading: what was read may belong to either version
+    if artifact_version(paths) != version:
+        raise ValueError(f"The model files changed from version {version} while loading")
+    return model, scaler
+
+
+def validate_engine(engine):
+    """Raise ValueError unless the engine predicts known crop labels for in-range inputs"""
+    labels = engine.predict(random_samples(VALIDATION_ROWS, seed=2))
+    unknown = sorted(set(labels.tolist()) - set(crop_dict))
+    if unknown:
+        raise ValueError(f"Model predicts unknown crop labels: {unknown}")
+
+
+class ModelLoader:
+    """Load the model, scaler and inference engine on a background thread"""
+
+    def __init__(self, model_path=MODEL_PATH, scaler_path=SCALER_PATH, mmap_mode=MMAP_MODE):
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.mmap_mode = mmap_mode
+        self.state = LOADING
+        self.error = None
+        self.bundle = ModelBundle(None, None, None, None)
+        self.load_seconds = None
+        self.reloads = 0
+        self.reload_error = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self._listeners = []
+        self._watcher = None
+
+    def start(self):
+        """Start warming up in the background; returns immediately"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, name="model-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _fail(self, message):
+        self.error = message
+        self.state = FAILED
+        self._ready.set()
+
+    @property
+    def model(self):
+        return self.bundle.model
+
+    @property
+    def scaler(self):
+        return self.bundle.scaler
+
+    @property
+    def engine(self):
+        return self.bundle.engine
+
+    @property
+    def version(self):
+        return self.bundle.version
+
+    @property
+    def _paths(self):
+        return artifact_files(self.model_path, self.scaler_path)
+
+    def _build(self):
+        """Load, set up and validate the artifacts on disk as a ModelBundle"""
+        missing = [path for path in self._paths if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError("Model files not found: " + ", ".join(missing))
+        version = artifact_version(self._paths)
+        model, scaler = load_artifacts(self.model_path, self.scaler_path, mmap_mode=self.mmap_mode)
+        engine = InferenceEngine(model, scaler)
+        # One throwaway prediction so the first real request doesn't pay for lazy setup
+        engine.predict(np.zeros(len(FEATURES)))
+        validate_engine(engine)
+        return ModelBundle(model, scaler, engine, version)
+
+    def _swap(self, bundle):
+        previous = self.bundle.version
+        # One assignment: callers hold on to the bundle they read, so in-flight predictions finish on the old model
+        self.bundle = bundle
+        if previous is not None:
+            metrics.set_gauge("crop_model_info", 0, version=previous)
+        metrics.set_gauge("crop_model_info", 1, version=bundle.version)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception as e:
+                self.reload_error = f"Loaded {self.version}, but a listener failed: {e}"
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            bundle = self._build()
+        except FileNotFoundError as e:
+            self._fail(str(e))
+            return
+        except Exception as e:
+            self._fail(f"Failed to load the model: {e}")
+            return
+        self._swap(bundle)
+        self.load_seconds = time.perf_counter() - start
+        metrics.observe("crop_model_load_seconds", self.load_seconds)
+        self.state = READY
+        self._ready.set()
+
+    def add_listener(self, callback):
+        """Call callback(loader) after every successful reload, including one that recovers a failed load"""
+        self._listeners.append(callback)
+
+    def reload(self):
+        """Reload the artifacts in the background; False if a reload is already running"""
+        with self._reload_lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+        threading.Thread(target=self._reload, name="model-reload", daemon=True).start()
+        return True
+
+    def _reload(self):
+        try:
+            if not self.ready:
+                # Nothing live to keep serving: retry the initial load
+                self._ready.clear()
+                self.state = LOADING
+                self._load()
+                if self.ready:
+                    self._notify()
+                return
+            start = time.perf_counter()
+            try:
+                bundle = self._build()
+            except Exception as e:
+                # Keep serving the current model
+                self.reload_error = f"Reload failed, still serving {self.version}: {e}"
+                metrics.inc("crop_model_reload_failures_total")
+                return
+            if bundle.version == self.version:
+                return
+            self._swap(bundle)
+            self.reloads += 1
+            self.reload_error = None
+            metrics.inc("crop_model_reloads_total")
+            metrics.observe("crop_model_load_seconds", time.perf_counter() - start)
+            self._notify()
+        finally:
+            with self._reload_lock:
+                self._reloading = False
+
+    def watch(self, interval):
+        """Poll the artifact files every interval seconds and reload once a change has settled"""
+        if self._watcher is None and interval > 0:
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name="model-watch", daemon=True)
+            self._watcher.start()
+        return self
+
+    def _watch(self, interval):
+        current = _file_signature(self._paths)
+        while True:
+            time.sleep(interval)
+            signature = _file_signature(self._paths)
+            if signature == current:
+                continue
+            # Wait for the copy to finish: the files must stop changing for one interval
+            time.sleep(interval)
+            if _file_signature(self._paths) != signature:
+                continue
+            if self.reload():
+                current = signature
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        """Block until loading finishes (or timeout); True if the model is ready"""
+        self.start()
+        self._ready.wait(timeout)
+        return self.ready
@@ -0,0 +1,335 @@
+"""Process-wide memoizing cache for single-sample crop predictions.
+
+Slider inputs move in fixed steps, so the same 7-tuples come up again and again
+across sessions. Keys are the inputs quantized to the slider steps; entries are
+evicted least-recently-used once the entry or memory cap is hit, expire after a
+TTL, and the whole cache is dropped when the model or scaler file changes.
+
+Entries belong to one model version. Callers pass the version of the model
+bundle they predicted with: a lookup for any other version misses and a put
+for it is dropped, so a result computed by a model that has just been swapped
+out is never served under its successor's version.
+
+Every consumer stores the same value: a ranking_entry(), the row's top-k
+labels and probabilities as JSON-safe [[label, probability], ...] pairs, so
+the app and the HTTP API can share entries. A cache holds rankings of one
+length, top_k, which is part of the shared key.
+
+With CROP_CACHE_URL set, a SharedPredictionCache adds a second tier on a
+Redis-compatible server shared by every replica (see cache_backend.py).
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import cache_backend
+from crop_model import FEATURE_STEPS, FEATURES, MODEL_PATH, SCALER_PATH
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 3600.0
+# How often to stat the artifact files for changes
+ARTIFACT_CHECK_SECONDS = 2.0
+
+_STEPS = [FEATURE_STEPS[name] for name in FEATURES]
+_MISSING = object()
+
+
+def quantize(values):
+    """Quantize 7 raw feature values to a tuple of integer slider steps"""
+    return tuple(int(round(float(value) / step)) for value, step in zip(values, _STEPS))
+
+
+def on_grid(values):
+    """Whether raw feature values all sit on the slider grid, where quantize() loses nothing
+
+    Entries are shared by every input in the same slider step, so callers
+    whose inputs are arbitrary floats (the HTTP API) only use the cache for
+    inputs on the grid.
+    """
+    for value, step in zip(values, _STEPS):
+        steps = float(value) / step
+        if abs(steps - round(steps)) > 1e-6:
+            return False
+    return True
+
+
+def ranking_entry(labels, proba):
+    """The cached form of one row's ranking, shared by every consumer: [[label, probability], ...]"""
+    return [[int(label), float(probability)] for label, probability in zip(labels, proba)]
+
+
+def _entry_size(key, value):
+    """Approximate memory held by one cache entry, including the OrderedDict slot"""
+    size = sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+    return size + _value_size(value) + 2 * sys.getsizeof(0.0) + 100
+
+
+def _value_size(value):
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_value_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _artifact_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class PredictionCache:
+    """Thread-safe LRU/TTL cache of predictions keyed on quantized inputs"""
+
+    # Second tier shared between replicas; see SharedPredictionCache
+    remote = None
+
+    def __init__(
+        self,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_bytes=DEFAULT_MAX_BYTES,
+        ttl=DEFAULT_TTL_SECONDS,
+        artifact_paths=(MODEL_PATH, SCALER_PATH),
+        top_k=None,
+    ):
+        self.top_k = top_k
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.artifact_paths = tuple(artifact_paths)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._signature = _artifact_signature(self.artifact_paths)
+        self._next_check = time.monotonic() + ARTIFACT_CHECK_SECONDS
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_artifacts(self, now):
+        """Drop every entry if the model or scaler changed on disk (lock held)"""
+        if now < self._next_check:
+            return
+        self._next_check = now + ARTIFACT_CHECK_SECONDS
+        signature = _artifact_signature(self.artifact_paths)
+        if signature != self._signature:
+            self._signature = signature
+            self._clear()
+            self.invalidations += 1
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _pop(self, key):
+        value, _, size = self._entries.pop(key)
+        self._bytes -= size
+        return value
+
+    def set_version(self, version):
+        """Tie entries to a model version, dropping the in-process ones when it changes"""
+        if version == self.version:
+            return
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._clear()
+
+    def _current(self, version):
+        """Whether entries for version may be used, adopting it if no version is set yet (lock held)"""
+        if version is None:
+            return True
+        if self.version is None:
+            self.version = version
+        return version == self.version
+
+    def get(self, values, default=None, version=None):
+        """Return the cached prediction for raw feature values, or default"""
+        return self.local_get(values, default, version)
+
+    def local_get(self, values, default=None, version=None):
+        """Lookup in this process only"""
+        key = quantize(values)
+        now = time.monotonic()
+        with self._lock:
+            self._check_artifacts(now)
+            entry = self._entries.get(key) if self._current(version) else None
+            if entry is None:
+                self.misses += 1
+                return default
+            if self.ttl is not None and now - entry[1] > self.ttl:
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, values, value, version=None):
+        """Store a prediction for raw feature values, evicting old entries if over capacity
+
+        A prediction made by a model version other than the cache's is dropped.
+        """
+        key = quantize(values)
+        size = _entry_size(key, value)
+        now = time.monotonic()
+        with self._lock:
+            self._check_artifacts(now)
+            if not self._current(version):
+                return False
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, now, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+        return True
+
+    def get_many(self, rows, default=None, version=None):
+        """Cached predictions for several rows of raw feature values, default where missing"""
+        return [self.local_get(values, default, version) for values in rows]
+
+    def put_many(self, rows, results, version=None):
+        for values, value in zip(rows, results):
+            self.put(values, value, version)
+
+    def get_or_compute(self, values, compute, version=None):
+        """Return the cached prediction for values, calling compute(*values) on a miss"""
+        value = self.get(values, _MISSING, version)
+        if value is _MISSING:
+            value = compute(*values)
+            self.put(values, value, version)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        """Counters and current size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def metric_samples(self, prefix="crop_cache"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        stats = self.stats()
+        samples = [(f"{prefix}_{name}_total", "counter", {}, stats[name])
+                   for name in ("hits", "misses", "evictions", "expirations", "invalidations")]
+        samples += [(f"{prefix}_entries", "gauge", {}, stats["entries"]), (f"{prefix}_bytes", "gauge", {}, stats["bytes"]),
+                    (f"{prefix}_hit_rate", "gauge", {}, stats["hit_rate"])]
+        return samples
+
+
+class SharedPredictionCache(PredictionCache):
+    """PredictionCache with a fleet-wide second tier on a cache server
+
+    Lookups try this process first and then the server, copying server hits
+    into the process; puts go to both, the server's through the backend's
+    background writer. Server keys include the model version, so nothing is
+    looked up or stored remotely until a version is known.
+    """
+
+    def __init__(self, remote, **kwargs):
+        super().__init__(**kwargs)
+        self.remote = remote
+
+    def _remote_version(self, version):
+        """Version to key server entries on; None while unknown or when version is stale"""
+        return self.version if version in (None, self.version) else None
+
+    def _key(self, values, version):
+        return cache_backend.encode_key(cache_backend.PREDICTION, version, quantize(values),
+                                        # Rankings of another length live under other keys
+                                        bytes([self.top_k or 0]))
+
+    def remote_get(self, values, default=None, version=None):
+        """Lookup on the server only; a hit is copied into this process"""
+        version = self._remote_version(version)
+        if version is None:
+            return default
+        value = self.remote.get(self._key(values, version))
+        if value is None:
+            return default
+        super().put(values, value, version)
+        return value
+
+    def get(self, values, default=None, version=None):
+        value = self.local_get(values, _MISSING, version)
+        return self.remote_get(values, default, version) if value is _MISSING else value
+
+    def get_many(self, rows, default=None, version=None):
+        """Local hits plus one pipelined server round trip for all local misses"""
+        values = super().get_many(rows, _MISSING, version)
+        misses = [i for i, value in enumerate(values) if value is _MISSING]
+        version = self._remote_version(version)
+        if misses and version is not None:
+            found = self.remote.get_many([self._key(rows[i], version) for i in misses])
+            for i, value in zip(misses, found):
+                if value is not None:
+                    values[i] = value
+                    super().put(rows[i], value, version)
+        return [default if value is _MISSING else value for value in values]
+
+    def put(self, values, value, version=None):
+        stored = super().put(values, value, version)
+        version = self._remote_version(version)
+        if stored and version is not None:
+            self.remote.put(self._key(values, version), value)
+        return stored
+
+    def stats(self):
+        stats = super().stats()
+        stats["remote"] = self.remote.stats()
+        return stats
+
+    def metric_samples(self, prefix="crop_cache"):
+        return super().metric_samples(prefix) + self.remote.metric_samples(f"{prefix}_remote")
+
+
+def create_prediction_cache(top_k=None):
+    """A cache of top_k rankings sized from the environment, with the shared tier when CROP_CACHE_URL is set"""
+    options = dict(
+        top_k=top_k,
+        max_entries=int(os.environ.get("CROP_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        max_bytes=int(os.environ.get("CROP_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        ttl=float(os.environ.get("CROP_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+    )
+    remote = cache_backend.get_backend()
+    return PredictionCache(**options) if remote is None else SharedPredictionCache(remote, **options)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_prediction_cache(top_k=None):
+    """The process-wide cache shared by every Streamlit session, created for top_k rankings on first use"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = create_prediction_cache(top_k)
+        elif top_k is not None and top_k != _default_cache.top_k:
+            raise ValueError(f"The prediction cache holds top-{_default_cache.top_k} rankings, not top-{top_k}")
+        return _default_cache
@@ -0,0 +1,316 @@
+"""Append-only log of predictions in compressed columnar segments.
+
+``record()`` only appends a tuple to an in-memory buffer; a background thread
+writes the buffer every few seconds as one zstd-compressed Arrow record batch.
+Segments are Arrow IPC stream files, one per process at a time, rotated by row
+count and age into a directory per day. A stream file stays readable up to its
+last complete batch, so a crash loses at most the unflushed buffer.
+
+Next to every segment a small JSON summary is rewritten on each flush: row
+count, time range, predictions per crop and source, and per-feature sums and
+fixed-bin histograms. Dashboards aggregate the summaries instead of scanning
+rows; ``read()`` scans the segments overlapping a time range for ad-hoc
+analysis.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from crop_model import APP_DIR, FEATURE_BOUNDS, FEATURES, crop_dict
+
+LOG_DIR = os.environ.get("CROP_PREDICTION_LOG_DIR", os.path.join(APP_DIR, "prediction_log"))
+FLUSH_SECONDS = 5.0
+# Buffered records that trigger a flush before the next interval
+FLUSH_ROWS = 10_000
+ROTATE_ROWS = 1_000_000
+ROTATE_SECONDS = 3600.0
+HISTOGRAM_BINS = 20
+
+_LOW = np.array([FEATURE_BOUNDS[name][0] for name in FEATURES], dtype=np.float64)
+_HIGH = np.array([FEATURE_BOUNDS[name][1] for name in FEATURES], dtype=np.float64)
+
+
+def histogram_edges(name):
+    """Bin edges of a feature's summary histogram (its slider range in HISTOGRAM_BINS bins)"""
+    low, high = FEATURE_BOUNDS[name]
+    return np.linspace(low, high, HISTOGRAM_BINS + 1)
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [pa.field("time", pa.timestamp("ms"))]
+        + [pa.field(name, pa.float32()) for name in FEATURES]
+        + [
+            pa.field("label", pa.uint8()),
+            pa.field("probability", pa.float32()),
+            pa.field("source", pa.dictionary(pa.int32(), pa.string())),
+            pa.field("model_version", pa.dictionary(pa.int32(), pa.string())),
+        ]
+    )
+
+
+class _Summary:
+    """Running aggregates of one segment"""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.start = None
+        self.end = None
+        self.labels = np.zeros(max(crop_dict) + 1, dtype=np.int64)
+        self.sources = {}
+        self.versions = {}
+        self.sums = np.zeros(len(FEATURES))
+        self.sumsq = np.zeros(len(FEATURES))
+        self.histograms = np.zeros((len(FEATURES), HISTOGRAM_BINS), dtype=np.int64)
+
+    def update(self, times, X, labels, sources, versions):
+        self.rows += len(times)
+        self.start = times[0] if self.start is None else self.start
+        self.end = times[-1]
+        self.labels += np.bincount(labels, minlength=len(self.labels))[: len(self.labels)]
+        for counts, values in ((self.sources, sources), (self.versions, versions)):
+            names, n = np.unique(values, return_counts=True)
+            for name, count in zip(names.tolist(), n.tolist()):
+                counts[name] = counts.get(name, 0) + count
+        self.sums += X.sum(axis=0)
+        self.sumsq += (X * X).sum(axis=0)
+        # Fixed bins over the slider range; out-of-range values land in the end bins
+        bins = ((X - _LOW) / (_HIGH - _LOW) * HISTOGRAM_BINS).astype(np.int64)
+        np.clip(bins, 0, HISTOGRAM_BINS - 1, out=bins)
+        for i in range(len(FEATURES)):
+            self.histograms[i] += np.bincount(bins[:, i], minlength=HISTOGRAM_BINS)
+
+    def save(self, closed=False):
+        summary = {
+            "segment": os.path.basename(self.path),
+            "rows": self.rows,
+            "start": self.start,
+            "end": self.end,
+            "closed": closed,
+            "labels": {str(label): int(n) for label, n in enumerate(self.labels) if n},
+            "sources": self.sources,
+            "versions": self.versions,
+            "sums": dict(zip(FEATURES, self.sums.tolist())),
+            "sumsq": dict(zip(FEATURES, self.sumsq.tolist())),
+            "histograms": dict(zip(FEATURES, self.histograms.tolist())),
+        }
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(summary, f)
+        os.replace(tmp, self.path + ".json")
+
+
+class PredictionLog:
+    """Buffered writer of prediction records; one per process"""
+
+    def __init__(self, root=LOG_DIR, flush_seconds=FLUSH_SECONDS, rotate_rows=ROTATE_ROWS,
+                 rotate_seconds=ROTATE_SECONDS):
+        self.root = root
+        self.flush_seconds = flush_seconds
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._segment = None
+        self._sink = None
+        self._writer = None
+        self._summary = None
+        self._opened = None
+        self._serial = 0
+
+    def start(self):
+        """Flush on a daemon thread every flush_seconds (sooner when the buffer fills) and at exit"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prediction-log", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Logging must never take predictions down; the failed batch is dropped and counted
+                metrics.inc("crop_prediction_log_errors_total")
+
+    def record(self, features, label, probability, source="ui", model_version=None):
+        """Queue one prediction; costs a tuple append"""
+        with self._lock:
+            self._buffer.append((time.time(), *features, label, probability, source, model_version or ""))
+            full = len(self._buffer) >= FLUSH_ROWS
+        if full:
+            self._wake.set()
+
+    def _open_segment(self, now):
+        import pyarrow as pa
+
+        day = time.strftime("%Y-%m-%d", time.localtime(now))
+        os.makedirs(os.path.join(self.root, day), exist_ok=True)
+        self._serial += 1
+        stamp = time.strftime("%H%M%S", time.localtime(now))
+        self._segment = os.path.join(self.root, day, f"segment-{stamp}-{os.getpid()}-{self._serial}.arrow")
+        self._sink = pa.OSFile(self._segment, "wb")
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        self._writer = pa.ipc.new_stream(self._sink, _schema(), options=options)
+        self._summary = _Summary(self._segment)
+        self._opened = now
+
+    def _close_segment(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        self._summary.save(closed=True)
+        self._writer = self._sink = self._segment = None
+
+    def flush(self):
+        """Write the buffered records as one batch; returns the number written"""
+        import pyarrow as pa
+
+        with self._write_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            now = time.time()
+            if self._writer is not None and (
+                self._summary.rows >= self.rotate_rows
+                or now - self._opened >= self.rotate_seconds
+                or time.localtime(now).tm_yday != time.localtime(self._opened).tm_yday
+            ):
+                self._close_segment()
+            if self._writer is None:
+                self._open_segment(now)
+
+            columns = list(zip(*rows))
+            times = np.array(columns[0])
+            X = np.array(columns[1 : 1 + len(FEATURES)], dtype=np.float64).T
+            labels = np.array(columns[1 + len(FEATURES)], dtype=np.uint8)
+            probabilities = np.array(columns[2 + len(FEATURES)], dtype=np.float32)
+            sources, versions = columns[3 + len(FEATURES)], columns[4 + len(FEATURES)]
+            arrays = [pa.array((times * 1000).astype(np.int64), pa.timestamp("ms"))]
+            arrays += [pa.array(X[:, i].astype(np.float32)) for i in range(len(FEATURES))]
+            arrays += [
+                pa.array(labels),
+                pa.array(probabilities),
+                pa.array(sources).dictionary_encode(),
+                pa.array(versions).dictionary_encode(),
+            ]
+            batch = pa.RecordBatch.from_arrays(arrays, schema=_schema())
+            self._writer.write_batch(batch)
+            self._sink.flush()
+            self._summary.update(times, X, labels, sources, versions)
+            self._summary.save()
+            metrics.inc("crop_prediction_log_rows_total", len(rows))
+            metrics.observe("crop_prediction_log_flush_seconds", time.perf_counter() - start)
+            return len(rows)
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            self._close_segment()
+
+    def metric_samples(self, prefix="crop_prediction_log"):
+        """(name, kind, labels, value) samples for metrics.register_collector"""
+        return [(f"{prefix}_buffered", "gauge", {}, len(self._buffer))]
+
+
+def summaries(root=LOG_DIR, start=None, end=None):
+    """Segment summaries whose time range overlaps [start, end] (epoch seconds, None = open)"""
+    result = []
+    for path in sorted(glob.glob(os.path.join(root, "*", "segment-*.arrow.json"))):
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not summary["rows"]:
+            continue
+        if (start is not None and summary["end"] < start) or (end is not None and summary["start"] > end):
+            continue
+        summary["path"] = path[: -len(".json")]
+        result.append(summary)
+    return result
+
+
+def aggregate(root=LOG_DIR, start=None, end=None):
+    """Totals over the segment summaries: rows, predictions per crop, per-feature means, stds and histograms
+
+    Segments are the unit of filtering, so start/end select whole segments
+    (at most ROTATE_SECONDS wide).
+    """
+    parts = summaries(root, start, end)
+    rows = sum(part["rows"] for part in parts)
+    crops, sources = {}, {}
+    for part in parts:
+        for label, n in part["labels"].items():
+            crop = crop_dict.get(int(label), "Unknown")
+            crops[crop] = crops.get(crop, 0) + n
+        for source, n in part["sources"].items():
+            sources[source] = sources.get(source, 0) + n
+    features = {}
+    for name in FEATURES:
+        total = sum(part["sums"][name] for part in parts)
+        total_sq = sum(part["sumsq"][name] for part in parts)
+        mean = total / rows if rows else None
+        features[name] = {
+            "mean": mean,
+            "std": float(np.sqrt(max(total_sq / rows - mean * mean, 0.0))) if rows else None,
+            "edges": histogram_edges(name).tolist(),
+            "counts": np.sum([part["histograms"][name] for part in parts], axis=0).tolist() if parts
+            else [0] * HISTOGRAM_BINS,
+        }
+    return {
+        "rows": rows,
+        "segments": len(parts),
+        "start": min((part["start"] for part in parts), default=None),
+        "end": max((part["end"] for part in parts), default=None),
+        "crops": dict(sorted(crops.items(), key=lambda item: -item[1])),
+        "sources": sources,
+        "features": features,
+    }
+
+
+def read(root=LOG_DIR, start=None, end=None, columns=None):
+    """Records with start <= time <= end as a DataFrame, reading only the overlapping segments"""
+    import pandas as pd
+    import pyarrow as pa
+
+    batches = []
+    for summary in summaries(root, start, end):
+        try:
+            reader = pa.ipc.open_stream(pa.memory_map(summary["path"]))
+            while True:
+                try:
+                    batches.append(reader.read_next_batch())
+                except StopIteration:
+                    break
+        except (OSError, pa.ArrowInvalid):
+            # The tail of a segment whose writer died mid-batch; complete batches were kept
+            continue
+    if not batches:
+        return pd.DataFrame(columns=_schema().names if columns is None else columns)
+    table = pa.Table.from_batches(batches, schema=_schema())
+    frame = table.to_pandas()
+    if start is not None:
+        frame = frame[frame["time"] >= pd.Timestamp(start, unit="s")]
+    if end is not None:
+        frame = frame[frame["time"] <= pd.Timestamp(end, unit="s")]
+    frame["crop"] = frame["label"].map(crop_dict)
+    return frame if columns is None else frame[columns]
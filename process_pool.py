@@ -0,0 +1,370 @@
+"""Multi-process inference backend for CPU-bound predictions.
+
+Every Streamlit session runs in one Python process, so concurrent predictions
+serialize on the GIL. ``ProcessInferencePool`` starts worker processes that each
+load the model once (flat ``.cropz`` artifacts are memory-mapped, so their pages
+are shared between workers) and exchange feature rows and results through a
+shared-memory block per worker. Only a tiny (op, rows, k) message crosses the
+pipe, so there is no per-call pickling of arrays. ``reload()`` makes every worker
+load the artifacts again once its current call has finished; a worker that
+failed to reload raises RuntimeError instead of answering with the old model,
+until a later reload succeeds.
+
+The pool mirrors the ``InferenceEngine`` prediction methods and can be used in
+its place. Run this module to benchmark throughput against the number of workers:
+
+    python process_pool.py --processes 1 2 4 8 --rows 64 --seconds 5
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from crop_model import FEATURES, MODEL_PATH, SCALER_PATH, crop_dict, load_artifacts
+from inference import InferenceEngine, random_samples
+
+# Rows each worker can take per call; larger inputs are split across workers
+DEFAULT_MAX_ROWS = 8192
+# Output columns reserved per row, enough for the full probability vector
+MAX_CLASSES = len(crop_dict)
+START_TIMEOUT_SECONDS = 120.0
+
+def _layout(max_rows):
+    """Byte offsets of the input, label and probability arrays in a worker's shared block"""
+    inputs = max_rows * len(FEATURES) * 8
+    labels = max_rows * MAX_CLASSES * 8
+    return inputs, inputs + labels, inputs + 2 * labels
+
+
+def _views(buf, max_rows):
+    labels_at, proba_at, _ = _layout(max_rows)
+    X = np.ndarray((max_rows, len(FEATURES)), dtype=np.float64, buffer=buf)
+    labels = np.ndarray((max_rows, MAX_CLASSES), dtype=np.int64, buffer=buf, offset=labels_at)
+    proba = np.ndarray((max_rows, MAX_CLASSES), dtype=np.float64, buffer=buf, offset=proba_at)
+    return X, labels, proba
+
+
+def _load_engine(model_path, scaler_path, mmap_mode):
+    model, scaler = load_artifacts(model_path, scaler_path, mmap_mode=mmap_mode)
+    engine = InferenceEngine(model, scaler)
+    engine.predict(np.zeros(len(FEATURES)))
+    return engine
+
+
+def _worker_main(conn, shm_name, max_rows, model_path, scaler_path, mmap_mode):
+    """Worker loop: load the model once, then serve requests written to shared memory"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        try:
+            engine = _load_engine(model_path, scaler_path, mmap_mode)
+        except Exception as e:
+            conn.send(("error", f"Failed to load the model: {e}"))
+            return
+        conn.send(("ready", engine.classes.tolist()))
+        X, out_labels, out_proba = _views(shm.buf, max_rows)
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            op, n, k = message
+            if op == "reload":
+                try:
+                    engine = _load_engine(model_path, scaler_path, mmap_mode)
+                except Exception as e:
+                    # Keep serving the model already loaded
+                    conn.send(("error", f"Failed to reload the model: {e}"))
+                    continue
+                conn.send(("ok", engine.classes.tolist()))
+                continue
+            try:
+                if op == "predict":
+                    out_labels[:n, 0] = engine.predict(X[:n])
+                elif op == "predict_proba":
+                    out_proba[:n, : len(engine.classes)] = engine.predict_proba(X[:n])
+                else:
+                    labels, proba = engine.top_k(X[:n], k)
+                    out_labels[:n, :k] = labels
+                    out_proba[:n, :k] = proba
+            except Exception as e:
+                conn.send(("error", str(e)))
+                continue
+            conn.send(("ok", n))
+        del X, out_labels, out_proba
+    finally:
+        shm.close()
+
+
+class _Worker:
+    def __init__(self, ctx, max_rows, model_path, scaler_path, mmap_mode):
+        self.shm = shared_memory.SharedMemory(create=True, size=_layout(max_rows)[2])
+        self.X, self.labels, self.proba = _views(self.shm.buf, max_rows)
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child, self.shm.name, max_rows, model_path, scaler_path, mmap_mode),
+            name="inference-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.generation = 0
+        # Why the last reload failed; the worker still holds the previous model
+        self.stale = None
+
+    def call(self, op, n, k):
+        self.conn.send((op, n, k))
+        try:
+            status, detail = self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Inference worker {self.process.pid} exited unexpectedly")
+        if status != "ok":
+            raise RuntimeError(detail)
+        return detail
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        del self.X, self.labels, self.proba
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ProcessInferencePool:
+    """Run InferenceEngine predictions in worker processes that each hold the model"""
+
+    def __init__(self, processes=None, model_path=MODEL_PATH, scaler_path=SCALER_PATH, mmap_mode=None,
+                 max_rows=DEFAULT_MAX_ROWS):
+        self.processes = processes or os.cpu_count() or 1
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.mmap_mode = mmap_mode
+        self.max_rows = max_rows
+        self.classes = None
+        self._workers = []
+        self._free = queue.Queue()
+        self._fanout = None
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def start(self, timeout=START_TIMEOUT_SECONDS):
+        """Spawn the workers and wait until every one has loaded the model"""
+        with self._lock:
+            if self._workers:
+                return self
+            # Spawn rather than fork: the parent may already be running threads
+            ctx = multiprocessing.get_context("spawn")
+            workers = [
+                _Worker(ctx, self.max_rows, self.model_path, self.scaler_path, self.mmap_mode)
+                for _ in range(self.processes)
+            ]
+            try:
+                for worker in workers:
+                    if not worker.conn.poll(timeout):
+                        raise RuntimeError("Timed out waiting for inference workers to load the model")
+                    status, detail = worker.conn.recv()
+                    if status != "ready":
+                        raise RuntimeError(detail)
+                    self.classes = np.asarray(detail)
+            except (RuntimeError, EOFError) as e:
+                for worker in workers:
+                    worker.close()
+                if isinstance(e, EOFError):
+                    raise RuntimeError("An inference worker exited while loading the model")
+                raise
+            self._workers = workers
+            for worker in workers:
+                self._free.put(worker)
+            self._fanout = ThreadPoolExecutor(max_workers=self.processes, thread_name_prefix="pool-fanout")
+        return self
+
+    def _run_chunk(self, op, X, k, out_labels, out_proba):
+        """Copy one chunk into a free worker's shared block, run op there and copy the results out"""
+        n = X.shape[0]
+        worker = self._free.get()
+        try:
+            self._refresh(worker)
+            if worker.stale is not None:
+                raise RuntimeError(f"Inference worker still has the previous model: {worker.stale}")
+            worker.X[:n] = X
+            worker.call(op, n, k)
+            if op == "predict":
+                out_labels[:] = worker.labels[:n, 0]
+            elif op == "predict_proba":
+                out_proba[:] = worker.proba[:n, : len(self.classes)]
+            else:
+                out_labels[:] = worker.labels[:n, :k]
+                out_proba[:] = worker.proba[:n, :k]
+        finally:
+            self._free.put(worker)
+
+    def _refresh(self, worker):
+        """Reload a worker picked from the free queue if it predates the last reload(); returns an error or None"""
+        generation = self.generation
+        if worker.generation == generation:
+            return None
+        # Attempted once per reload(): a worker that fails refuses calls until the next reload()
+        worker.generation = generation
+        try:
+            self.classes = np.asarray(worker.call("reload", 0, 0))
+        except RuntimeError as e:
+            worker.stale = str(e)
+            return worker.stale
+        worker.stale = None
+        return None
+
+    def reload(self):
+        """Have every worker load the artifacts again, after the call it is serving finishes
+
+        Raises RuntimeError if a worker failed to load; that worker then raises
+        RuntimeError on every call until a later reload() succeeds.
+        """
+        self.generation += 1
+
+        def refresh_one():
+            worker = self._free.get()
+            try:
+                return self._refresh(worker)
+            finally:
+                self._free.put(worker)
+
+        # Workers this misses (one picked twice) reload on their next call instead
+        futures = [self._fanout.submit(refresh_one) for _ in range(self.processes)]
+        errors = [error for error in (future.result() for future in futures) if error]
+        if errors:
+            raise RuntimeError(errors[0])
+
+    def _call(self, op, X, k=1):
+        if not self._workers:
+            raise RuntimeError("ProcessInferencePool is not started")
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n = X.shape[0]
+        n_classes = len(self.classes)
+        if op == "predict":
+            labels, proba = np.empty(n, dtype=np.int64), None
+        elif op == "predict_proba":
+            labels, proba = None, np.empty((n, n_classes), dtype=np.float64)
+        else:
+            labels, proba = np.empty((n, k), dtype=np.int64), np.empty((n, k), dtype=np.float64)
+
+        def part(result, start, stop):
+            return None if result is None else result[start:stop]
+
+        # Split large inputs so every worker gets a share
+        chunk = min(self.max_rows, max(1, -(-n // self.processes)))
+        bounds = [(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+        if len(bounds) == 1:
+            self._run_chunk(op, X, k, labels, proba)
+        else:
+            futures = [
+                self._fanout.submit(self._run_chunk, op, X[start:stop], k, part(labels, start, stop),
+                                    part(proba, start, stop))
+                for start, stop in bounds
+            ]
+            for future in futures:
+                future.result()
+        if labels is not None:
+            labels = labels.astype(self.classes.dtype, copy=False)
+        return labels, proba
+
+    def predict(self, X):
+        """Predict labels for a single row of 7 features or a 2D batch of rows"""
+        return self._call("predict", X)[0]
+
+    def predict_proba(self, X):
+        """Class probabilities (columns ordered like self.classes) for a row or a batch"""
+        return self._call("predict_proba", X)[1]
+
+    def top_k(self, X, k=3):
+        """Top-k labels and probabilities per row, as InferenceEngine.top_k"""
+        return self._call("top_k", X, min(k, len(self.classes)))
+
+    def predict_one(self, *values):
+        """Predict the label for one sample given as 7 positional feature values"""
+        return self.predict(values)[0]
+
+    def close(self):
+        with self._lock:
+            if self._fanout is not None:
+                self._fanout.shutdown()
+                self._fanout = None
+            for worker in self._workers:
+                worker.close()
+            self._workers = []
+            self._free = queue.Queue()
+
+
+def _throughput(predictor, X, rows, clients, seconds):
+    """Rows per second achieved by `clients` threads calling top_k on `rows`-row blocks"""
+    blocks = [X[start : start + rows] for start in range(0, len(X) - rows + 1, rows)]
+    deadline = time.perf_counter() + seconds
+    done = [0] * clients
+
+    def client(i):
+        j = i
+        while time.perf_counter() < deadline:
+            predictor.top_k(blocks[j % len(blocks)], 3)
+            done[i] += rows
+            j += clients
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / (time.perf_counter() - start)
+
+
+def benchmark(process_counts, rows=64, seconds=5.0, mmap_mode=None):
+    """Compare in-process threads against pools of increasing size; returns result dicts"""
+    X = random_samples(max(20_000, rows * 100), seed=3)
+    model, scaler = load_artifacts(mmap_mode=mmap_mode)
+    engine = InferenceEngine(model, scaler)
+    baseline = _throughput(engine, X, rows, max(process_counts), seconds)
+    results = [{"backend": "threads", "workers": max(process_counts), "rows_per_second": baseline}]
+    for processes in process_counts:
+        pool = ProcessInferencePool(processes, mmap_mode=mmap_mode).start()
+        try:
+            expected = engine.predict(X[:2000])
+            if not np.array_equal(pool.predict(X[:2000]), expected):
+                raise RuntimeError("Process pool predictions differ from the in-process engine")
+            rate = _throughput(pool, X, rows, processes * 2, seconds)
+        finally:
+            pool.close()
+        results.append({"backend": "processes", "workers": processes, "rows_per_second": rate})
+    single = next((r["rows_per_second"] for r in results if r["backend"] == "processes"), None)
+    for result in results:
+        result["speedup"] = result["rows_per_second"] / single if single else None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the multi-process inference backend")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--rows", type=int, default=1, help="rows per prediction call")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each measurement")
+    parser.add_argument("--mmap", default=None, help="joblib mmap_mode for the model, e.g. r")
+    args = parser.parse_args(argv)
+    counts = sorted(set(args.processes))
+    print(f"{os.cpu_count()} CPUs, {args.rows} rows per call")
+    for result in benchmark(counts, args.rows, args.seconds, args.mmap):
+        print(f"{result['backend']:>9} x{result['workers']:<3} {result['rows_per_second']:>12,.0f} rows/s"
+              f"  {result['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Crop-suitability maps from gridded feature layers.
+
+The input is either one stacked ``.npy`` of shape (7, rows, cols) or
+(rows, cols, 7) with bands in FEATURES order, or a directory with one
+(rows, cols) ``.npy`` per feature (N.npy, P.npy, ..., rainfall.npy). Layers are
+memory-mapped and predicted tile by tile in worker processes that write
+straight into memory-mapped output rasters, so peak memory depends on the tile
+size and the number of workers, not on the size of the map.
+
+The label raster holds crop_dict codes as uint8, with 0 where any layer has no
+data (NaN or infinite). The optional confidence raster holds the probability of
+the predicted crop as float32 (NaN where there is no data). Values outside the
+slider bounds are clamped, as in batch predictions.
+
+Usage:
+    python raster_predict.py district_stack.npy labels.npy --confidence confidence.npy --workers 8
+    python raster_predict.py district_layers/ labels.npy --tile 1024
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from crop_model import FEATURES, MODEL_PATH, SCALER_PATH, load_artifacts
+from inference import InferenceEngine
+from model_loader import load_version
+from validation import validate
+
+DEFAULT_TILE = 512
+NODATA = 0
+# Seconds between progress lines
+PROGRESS_SECONDS = 2.0
+
+
+def open_layers(path):
+    """Memory-map the feature layers; returns a list of 7 (rows, cols) arrays in FEATURES order"""
+    if os.path.isdir(path):
+        layers = []
+        for name in FEATURES:
+            layer_path = os.path.join(path, f"{name}.npy")
+            if not os.path.isfile(layer_path):
+                raise ValueError(f"Missing layer {layer_path}")
+            layers.append(np.load(layer_path, mmap_mode="r"))
+    else:
+        stack = np.load(path, mmap_mode="r")
+        if stack.ndim != 3 or len(FEATURES) not in (stack.shape[0], stack.shape[-1]):
+            raise ValueError(f"Expected a (7, rows, cols) or (rows, cols, 7) stack, got shape {stack.shape}")
+        if stack.shape[0] == len(FEATURES):
+            layers = [stack[i] for i in range(len(FEATURES))]
+        else:
+            layers = [stack[..., i] for i in range(len(FEATURES))]
+    shapes = {layer.shape for layer in layers}
+    if len(shapes) != 1 or len(next(iter(shapes))) != 2:
+        raise ValueError(f"Feature layers must be 2D and the same shape, got {sorted(shapes)}")
+    return layers
+
+
+def tiles(shape, tile):
+    """(row0, row1, col0, col1) windows covering a raster, row by row"""
+    rows, cols = shape
+    return [
+        (r0, min(r0 + tile, rows), c0, min(c0 + tile, cols))
+        for r0 in range(0, rows, tile)
+        for c0 in range(0, cols, tile)
+    ]
+
+
+# Per-worker state: engine, input layers and output rasters
+_worker = {}
+
+
+def _load(model_path, scaler_path, model_version):
+    if model_version is None:
+        return load_artifacts(model_path, scaler_path)
+    return load_version(model_path, scaler_path, model_version)
+
+
+def _init_worker(input_path, labels_path, confidence_path, model_path, scaler_path, model_version=None):
+    try:
+        model, scaler = _load(model_path, scaler_path, model_version)
+    except ValueError as e:
+        # Raised from the tiles, where the caller sees it, rather than breaking the pool
+        _worker["error"] = e
+        return
+    _worker["error"] = None
+    _worker["engine"] = InferenceEngine(model, scaler)
+    _worker["layers"] = open_layers(input_path)
+    _worker["labels"] = np.load(labels_path, mmap_mode="r+")
+    _worker["confidence"] = np.load(confidence_path, mmap_mode="r+") if confidence_path else None
+
+
+def _predict_tile(r0, r1, c0, c1):
+    """Predict one window and write its labels (and confidence); returns (pixels, nodata, clamped)"""
+    if _worker["error"] is not None:
+        raise _worker["error"]
+    n = (r1 - r0) * (c1 - c0)
+    X = np.empty((n, len(FEATURES)), dtype=np.float64)
+    for i, layer in enumerate(_worker["layers"]):
+        X[:, i] = layer[r0:r1, c0:c1].reshape(-1)
+    checked = validate(X, copy=False)
+    labels, proba = _worker["engine"].top_k(checked.X, 1)
+    labels, proba = labels[:, 0], proba[:, 0]
+    labels[checked.invalid] = NODATA
+    _worker["labels"][r0:r1, c0:c1] = labels.reshape(r1 - r0, c1 - c0)
+    if _worker["confidence"] is not None:
+        proba[checked.invalid] = np.nan
+        _worker["confidence"][r0:r1, c0:c1] = proba.reshape(r1 - r0, c1 - c0)
+    summary = checked.summary()
+    return n, summary["invalid"], summary["clamped"]
+
+
+class Progress:
+    """Throttled progress and throughput lines on stderr"""
+
+    def __init__(self, total_tiles, total_pixels, enabled=True):
+        self.total_tiles = total_tiles
+        self.total_pixels = total_pixels
+        self.enabled = enabled
+        self.tiles = 0
+        self.pixels = 0
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, pixels):
+        self.tiles += 1
+        self.pixels += pixels
+        now = time.perf_counter()
+        if self.enabled and (now - self._last >= PROGRESS_SECONDS or self.tiles == self.total_tiles):
+            self._last = now
+            elapsed = now - self.start
+            rate = self.pixels / elapsed if elapsed > 0 else 0.0
+            eta = (self.total_pixels - self.pixels) / rate if rate else float("inf")
+            print(
+                f"\r{self.tiles}/{self.total_tiles} tiles, {self.pixels / self.total_pixels:.1%} of pixels, "
+                f"{rate:,.0f} pixels/s, ETA {eta:,.0f}s   ",
+                end="",
+                file=sys.stderr,
+            )
+
+    def close(self):
+        if self.enabled:
+            print(file=sys.stderr)
+
+
+def predict_raster(input_path, labels_path, confidence_path=None, tile=DEFAULT_TILE, workers=None,
+                   model_path=MODEL_PATH, scaler_path=SCALER_PATH, progress=True, start_tile=0, on_tile=None,
+                   model_version=None):
+    """Write label (and confidence) rasters for the layers at input_path; returns a run summary
+
+    With start_tile > 0 the output rasters must already exist and only the
+    tiles from start_tile on are predicted, so an interrupted run can resume.
+    on_tile(tiles_done, pixels, nodata, clamped) is called after each tile, in
+    tile order. With model_version set, every worker checks that the files it
+    loads are that version (see model_loader.load_version) and the run fails
+    with ValueError if any is not.
+    """
+    shape = open_layers(input_path)[0].shape
+    model, _ = _load(model_path, scaler_path, model_version)
+    if max(model.classes_) > np.iinfo(np.uint8).max or min(model.classes_) <= NODATA:
+        raise ValueError("Label rasters need crop codes between 1 and 255")
+    del model
+    if not start_tile:
+        # Create the outputs for the workers to open r+
+        np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.uint8, shape=shape).flush()
+        if confidence_path:
+            np.lib.format.open_memmap(confidence_path, mode="w+", dtype=np.float32, shape=shape).flush()
+
+    windows = tiles(shape, tile)
+    todo = windows[start_tile:]
+    tracker = Progress(len(todo), sum((r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in todo), progress)
+    nodata = clamped = 0
+    initargs = (input_path, labels_path, confidence_path, model_path, scaler_path, model_version)
+    if todo and workers == 1:
+        _init_worker(*initargs)
+        results = (_predict_tile(*window) for window in todo)
+        nodata, clamped = _consume(results, tracker, start_tile, on_tile)
+    elif todo:
+        # Spawn rather than fork: the caller may be a multithreaded server such as the app's job worker
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            try:
+                nodata, clamped = _consume(pool.map(_predict_tile, *zip(*todo)), tracker, start_tile, on_tile)
+            except BaseException:
+                # Don't finish the remaining tiles for a caller that gave up
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    tracker.close()
+    seconds = time.perf_counter() - tracker.start
+    return {
+        "rows": shape[0],
+        "cols": shape[1],
+        "pixels": tracker.pixels,
+        "nodata": nodata,
+        "clamped": clamped,
+        "tiles": len(windows),
+        "seconds": seconds,
+        "pixels_per_second": tracker.pixels / seconds if seconds > 0 else None,
+    }
+
+
+def _consume(results, tracker, start_tile=0, on_tile=None):
+    nodata = clamped = 0
+    for done, (pixels, tile_nodata, tile_clamped) in enumerate(results, start_tile + 1):
+        nodata += tile_nodata
+        clamped += tile_clamped
+        tracker.update(pixels)
+        if on_tile is not None:
+            on_tile(done, pixels, tile_nodata, tile_clamped)
+    return nodata, clamped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict crop-suitability rasters from gridded feature layers")
+    parser.add_argument("input", help="stacked .npy (7 bands) or a directory with one .npy per feature")
+    parser.add_argument("labels", help=".npy file to write the uint8 crop code raster to (0 = no data)")
+    parser.add_argument("--confidence", help=".npy file to write the float32 probability of the predicted crop to")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE, help="tile edge in pixels")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the trained model")
+    parser.add_argument("--scaler", default=SCALER_PATH, help="path to the fitted scaler")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = predict_raster(args.input, args.labels, args.confidence, args.tile, args.workers,
+                                 args.model, args.scaler, progress=not args.quiet)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"{e}\n")
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
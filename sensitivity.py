@@ -0,0 +1,99 @@
+"""What-if sensitivity sweeps around one set of inputs.
+
+For the current slider state, every feature is swept across its slider range
+with the others held fixed, and one pair of features is swept over a 2D grid.
+All perturbations are stacked into a single block and predicted in one
+vectorized call; the result records where the recommended crop changes.
+"""
+import numpy as np
+
+from crop_model import FEATURE_BOUNDS, FEATURE_STEPS, FEATURES, crop_dict
+
+DEFAULT_POINTS = 41
+DEFAULT_GRID_POINTS = 31
+
+
+def axis_values(name, points):
+    """Evenly spaced values over a feature's slider range, snapped to its slider step"""
+    low, high = FEATURE_BOUNDS[name]
+    step = FEATURE_STEPS[name]
+    values = np.round(np.linspace(low, high, points) / step) * step
+    return np.clip(values, low, high)
+
+
+def _segments(values, labels):
+    """Runs of equal labels along a 1D sweep as (crop, first value, last value)"""
+    cuts = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    starts = np.concatenate(([0], cuts))
+    stops = np.concatenate((cuts, [len(labels)])) - 1
+    return [(crop_dict.get(int(labels[a]), "Unknown"), float(values[a]), float(values[b])) for a, b in zip(starts, stops)]
+
+
+def sweep(engine, base, pair=("N", "rainfall"), points=DEFAULT_POINTS, grid_points=DEFAULT_GRID_POINTS):
+    """Predict one-parameter sweeps of every feature and a 2D sweep of pair around base
+
+    base holds the 7 raw feature values in FEATURES order. Returns a dict with
+    the baseline crop, per-feature axis values, labels and crop segments, and
+    the 2D grid of labels for pair (rows follow pair[1], columns pair[0]).
+    """
+    base = np.asarray(base, dtype=np.float64)
+    blocks, axes = [], {}
+    for i, name in enumerate(FEATURES):
+        values = axis_values(name, points)
+        block = np.repeat(base[None, :], len(values), axis=0)
+        block[:, i] = values
+        blocks.append(block)
+        axes[name] = values
+
+    x_name, y_name = pair
+    x_values, y_values = axis_values(x_name, grid_points), axis_values(y_name, grid_points)
+    grid = np.repeat(base[None, :], len(x_values) * len(y_values), axis=0)
+    grid[:, FEATURES.index(x_name)] = np.tile(x_values, len(y_values))
+    grid[:, FEATURES.index(y_name)] = np.repeat(y_values, len(x_values))
+    blocks.append(grid)
+    blocks.append(base[None, :])
+
+    # One model call for every perturbation
+    labels = engine.predict(np.concatenate(blocks))
+    baseline = int(labels[-1])
+    result = {"baseline": crop_dict.get(baseline, "Unknown"), "baseline_label": baseline, "features": {}}
+    offset = 0
+    for name in FEATURES:
+        values = axes[name]
+        feature_labels = labels[offset : offset + len(values)]
+        offset += len(values)
+        result["features"][name] = {
+            "values": values,
+            "labels": feature_labels,
+            "segments": _segments(values, feature_labels),
+        }
+    result["pair"] = {
+        "x": x_name,
+        "y": y_name,
+        "x_values": x_values,
+        "y_values": y_values,
+        "labels": labels[offset : offset + len(grid)].reshape(len(y_values), len(x_values)),
+    }
+    return result
+
+
+def change_points(result, name, value):
+    """Nearest values below and above value where the recommended crop changes, with the crop it changes to
+
+    Changes are measured from the baseline crop at value itself, not from the
+    sweep's nearest grid point, which can fall on the other side of a boundary.
+    """
+    values = result["features"][name]["values"]
+    labels = result["features"][name]["labels"]
+    current = result["baseline_label"]
+    below = above = None
+    # Grid points strictly below and strictly above value
+    for i in range(int(np.searchsorted(values, value, side="left")) - 1, -1, -1):
+        if labels[i] != current:
+            below = (float(values[i]), crop_dict.get(int(labels[i]), "Unknown"))
+            break
+    for i in range(int(np.searchsorted(values, value, side="right")), len(values)):
+        if labels[i] != current:
+            above = (float(values[i]), crop_dict.get(int(labels[i]), "Unknown"))
+            break
+    return below, above
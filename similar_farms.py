@@ -0,0 +1,432 @@
+"""Nearest-neighbour index of past fields, for "similar farms" lookups.
+
+Rows are the 7 raw features of logged predictions (or imported survey files)
+with the crop grown there. They are indexed in the scaler's feature space, so
+distances weigh features the way the model sees them, using an inverted-file
+layout: a k-means coarse quantizer splits the space into cells, and every cell
+is an append-only file of (float32 vector, label, time) records. A query
+ranks the cells by centroid distance and scans only the nprobe nearest ones
+through memory maps, so tens of millions of rows answer in milliseconds
+without being loaded into RAM. The search is approximate: a neighbour in a
+cell outside the nprobe nearest is missed.
+
+New rows are buffered and appended in bulk by a background thread; buffered
+rows are searched too. The index keeps the scaling it was created with, so it
+stays consistent if the live scaler is later replaced. ``rebuild`` retrains the
+cells on a sample of the stored rows once the data has drifted away from the
+initial uniform training set.
+
+Several processes (app replicas, the CLI) may share one index directory:
+appends, crash repair and rebuilds take an exclusive lock on a file next to
+the directory, and a process notices a rebuild by another one and switches to
+its cells. Queries read without locking and only ever see whole records.
+
+Usage:
+    python similar_farms.py add survey.csv
+    python similar_farms.py query 90 42 43 20.8 82 6.5 203 -k 5
+    python similar_farms.py rebuild --lists 1024
+    python similar_farms.py stats
+"""
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_predict import feature_block, read_chunks
+from crop_model import APP_DIR, FEATURES, MODEL_PATH, SCALER_PATH, crop_dict, label_names, load_artifacts
+from inference import random_samples, scaler_affine
+from validation import validate
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+SIMILAR_DIR = os.environ.get("CROP_SIMILAR_DIR", os.path.join(APP_DIR, "similar_farms"))
+FORMAT_VERSION = 1
+DEFAULT_LISTS = 1024
+DEFAULT_NPROBE = 8
+# Buffered rows that trigger a flush before the next interval
+FLUSH_ROWS = 4096
+FLUSH_SECONDS = 2.0
+# Rows compared per pass when scanning a cell
+SCAN_ROWS = 1 << 18
+# How long len() trusts its row count before checking the cell files for other writers' rows
+COUNT_SECONDS = 10.0
+
+RECORD_DTYPE = np.dtype([("vector", "<f4", (len(FEATURES),)), ("label", "<i4"), ("time", "<f8")])
+
+_CROP_CODES = {name.lower(): code for code, name in crop_dict.items()}
+
+
+def index_scaling(scaler):
+    """(scale, offset) with scaler.transform(X) == X * scale + offset, the space rows are indexed in"""
+    affine = scaler_affine(scaler)
+    if affine is not None:
+        kind, a, b = affine
+        # minmax is X * a + b, standard is (X - b) / a
+        return (a, b) if kind == "minmax" else (1.0 / a, -b / a)
+    # Other per-feature affine scalers: measure the transform
+    zero = scaler.transform(np.zeros((1, len(FEATURES))))[0]
+    scale = scaler.transform(np.eye(len(FEATURES)))[np.arange(len(FEATURES)), np.arange(len(FEATURES))] - zero
+    return scale.astype(np.float64), zero.astype(np.float64)
+
+
+def _sq_distances(X, centroids, centroid_norms):
+    """Squared distances of every row of X to every centroid, via one matrix product"""
+    d = (X * X).sum(axis=1)[:, None] - 2.0 * (X @ centroids.T) + centroid_norms[None, :]
+    return np.maximum(d, 0, out=d)
+
+
+def kmeans(X, n_clusters, iterations=10, seed=0, block=8192):
+    """Lloyd's k-means on float32 rows, assigning in blocks to bound memory"""
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), n_clusters, replace=len(X) < n_clusters)].astype(np.float32)
+    for _ in range(iterations):
+        norms = (centroids * centroids).sum(axis=1)
+        assignment = np.concatenate([
+            _sq_distances(X[start:start + block], centroids, norms).argmin(axis=1)
+            for start in range(0, len(X), block)
+        ])
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, assignment, X)
+        filled = counts > 0
+        # Empty cells keep their centroid
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+    return centroids
+
+
+class SimilarFarmsIndex:
+    """Persisted inverted-file index of scaled feature rows and the crops grown there"""
+
+    def __init__(self, root=SIMILAR_DIR, scaler=None, n_lists=DEFAULT_LISTS):
+        self.root = root
+        self._lock = threading.Lock()
+        # Held while writing to the cell files; rebuild holds it throughout
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._flusher = None
+        self._meta = None
+        self._rows = None
+        with self._locked():
+            if not os.path.exists(os.path.join(root, "meta.json")):
+                if scaler is None:
+                    raise FileNotFoundError(f"No similar-farms index in {root}; pass the scaler to create one")
+                self._create(scaler, n_lists)
+            self._load_meta()
+            self._repair()
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Exclusive access to the cell files, across threads and processes"""
+        with self._write_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.root)), exist_ok=True)
+            # Next to the directory, so the lock survives a rebuild swapping the directory
+            with open(self.root.rstrip(os.sep) + ".lock", "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+
+    def _meta_signature(self):
+        stat = os.stat(os.path.join(self.root, "meta.json"))
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load_meta(self):
+        signature = self._meta_signature()
+        with open(os.path.join(self.root, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported similar-farms index format {meta.get('format')} in {self.root}")
+        self.scale = np.array(meta["scale"])
+        self.offset = np.array(meta["offset"])
+        centroids = np.load(os.path.join(self.root, "centroids.npy"))
+        self.centroids, self._centroid_norms = centroids, (centroids * centroids).sum(axis=1)
+        self._meta = signature
+        self._rows = None
+
+    def _refresh_meta(self):
+        """Switch to the cells of a rebuild another process finished"""
+        try:
+            if self._meta_signature() != self._meta:
+                self._load_meta()
+        except (OSError, ValueError):
+            pass  # Caught mid-swap: keep the current cells until the next call
+
+    def _create(self, scaler, n_lists):
+        os.makedirs(os.path.join(self.root, "lists"), exist_ok=True)
+        scale, offset = index_scaling(scaler)
+        # No data yet: train the cells on inputs spread uniformly over the slider ranges
+        sample = (random_samples(16 * n_lists, seed=3) * scale + offset).astype(np.float32)
+        self._write_meta(self.root, scale, offset, kmeans(sample, n_lists, iterations=5))
+
+    @staticmethod
+    def _write_meta(root, scale, offset, centroids):
+        np.save(os.path.join(root, "centroids.npy"), centroids)
+        meta = {"format": FORMAT_VERSION, "features": FEATURES, "scale": list(scale), "offset": list(offset),
+                "lists": len(centroids)}
+        tmp = os.path.join(root, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(root, "meta.json"))
+
+    def _path(self, cell, root=None):
+        return os.path.join(root or self.root, "lists", f"{cell:05d}.rec")
+
+    def _cell_rows(self, cell):
+        try:
+            return os.path.getsize(self._path(cell)) // RECORD_DTYPE.itemsize
+        except OSError:
+            return 0
+
+    def _repair(self):
+        """Cut cells back to their last complete record, in case a write was interrupted (lock held)"""
+        for cell in range(self.n_lists):
+            path = self._path(cell)
+            if os.path.exists(path) and os.path.getsize(path) % RECORD_DTYPE.itemsize:
+                os.truncate(path, self._cell_rows(cell) * RECORD_DTYPE.itemsize)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) * self.scale + self.offset).astype(np.float32)
+
+    def assign(self, vectors, block=16384):
+        """Nearest cell of each scaled row"""
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            _sq_distances(vectors[start:start + block], self.centroids, self._centroid_norms).argmin(axis=1)
+            for start in range(0, len(vectors), block)
+        ])
+
+    def add(self, X, labels, times=None):
+        """Queue raw feature rows and their crop labels; invalid rows are dropped, out-of-range ones clamped"""
+        checked = validate(X)
+        keep = checked.valid
+        labels = np.broadcast_to(np.asarray(labels, dtype=np.int32), keep.shape)[keep]
+        if times is None:
+            times = np.full(len(labels), time.time())
+        else:
+            times = np.broadcast_to(np.asarray(times, dtype=np.float64), keep.shape)[keep]
+        records = np.empty(len(labels), dtype=RECORD_DTYPE)
+        records["vector"], records["label"], records["time"] = self.transform(checked.X[keep]), labels, times
+        with self._lock:
+            self._pending.append(records)
+            pending = sum(len(chunk) for chunk in self._pending)
+        if pending >= FLUSH_ROWS:
+            self._wake.set()
+
+    def flush(self):
+        """Append the buffered rows to their cells; returns the number of rows written"""
+        with self._locked():
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            self._refresh_meta()
+            records = np.concatenate(pending)
+            self._append(self.root, self.assign(records["vector"]), records)
+            if self._rows is not None:
+                self._rows[0] += len(records)
+            return len(records)
+
+    def _append(self, root, cells, records):
+        """Append records to the files of their cells, one write per cell (lock held)"""
+        order = np.argsort(cells, kind="stable")
+        cells, records = cells[order], records[order]
+        bounds = np.flatnonzero(np.diff(cells)) + 1
+        for start, stop in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(cells)]))):
+            with open(self._path(int(cells[start]), root), "ab") as f:
+                f.write(records[start:stop].tobytes())
+
+    def autoflush(self, interval=FLUSH_SECONDS):
+        """Flush on a daemon thread every interval seconds (sooner when the buffer fills) and at exit"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name="similar-flush",
+                                             daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+        return self
+
+    def _flush_loop(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            self.flush()
+
+    def __len__(self):
+        now = time.monotonic()
+        rows = self._rows
+        if rows is None or now - rows[1] > COUNT_SECONDS:
+            # [stored rows, when counted]; flushes add to it, other writers show up at the next count
+            rows = self._rows = [sum(self._cell_rows(cell) for cell in range(self.n_lists)), now]
+        with self._lock:
+            pending = sum(len(chunk) for chunk in self._pending)
+        return pending + rows[0]
+
+    def _open_cell(self, cell):
+        rows = self._cell_rows(cell)
+        if not rows:
+            return None
+        return np.memmap(self._path(cell), dtype=RECORD_DTYPE, mode="r", shape=(rows,))
+
+    def nearest(self, x, k=5, nprobe=DEFAULT_NPROBE):
+        """The k stored rows closest to the raw feature row x, nearest first
+
+        Returns a DataFrame with the raw features, crop, label, time (epoch
+        seconds) and distance in scaled space.
+        """
+        self._refresh_meta()
+        q = self.transform(validate(x).X)[0]
+        probe = np.argsort(_sq_distances(q[None, :], self.centroids, self._centroid_norms)[0])[:nprobe]
+        sources = [self._open_cell(int(cell)) for cell in probe]
+        with self._lock:
+            sources += list(self._pending)
+        # The k best of every block, merged once at the end
+        distances, best = [], []
+        for records in sources:
+            if records is None:
+                continue
+            for start in range(0, len(records), SCAN_ROWS):
+                block = np.asarray(records[start:start + SCAN_ROWS])
+                diff = block["vector"] - q
+                d = np.einsum("ij,ij->i", diff, diff)
+                top = np.argpartition(d, k)[:k] if len(d) > k else np.arange(len(d))
+                distances.append(d[top])
+                best.append(block[top])
+        best_d = np.concatenate(distances) if distances else np.empty(0, dtype=np.float32)
+        best = np.concatenate(best) if best else np.empty(0, dtype=RECORD_DTYPE)
+
+        order = np.argsort(best_d, kind="stable")[:k]
+        raw = (best["vector"][order].astype(np.float64) - self.offset) / self.scale
+        labels = best["label"][order].astype(np.int64)
+        # One constructor call; adding columns one by one costs more than the search
+        columns = {name: raw[:, i] for i, name in enumerate(FEATURES)}
+        columns.update(crop=label_names(labels), label=labels, time=best["time"][order],
+                       distance=np.sqrt(best_d[order]))
+        return pd.DataFrame(columns)
+
+    def rebuild(self, n_lists=None, sample_rows=200_000, iterations=10):
+        """Retrain the cells on a sample of the stored rows and redistribute them, one cell at a time
+
+        Rows added meanwhile stay buffered until it finishes; other processes
+        wait for it before their next write and then use the new cells.
+        """
+        self.flush()
+        with self._locked():
+            self._refresh_meta()
+            self._rebuild(n_lists, sample_rows, iterations)
+
+    def _rebuild(self, n_lists, sample_rows, iterations):
+        n_lists = n_lists or self.n_lists
+        total = sum(self._cell_rows(cell) for cell in range(self.n_lists))
+        if not total:
+            return
+        # Every cell contributes rows in proportion to its size
+        fraction = min(1.0, sample_rows / total)
+        sample = []
+        for cell in range(self.n_lists):
+            records = self._open_cell(cell)
+            if records is not None:
+                step = max(1, int(round(1 / fraction)))
+                sample.append(np.asarray(records["vector"][::step]))
+        centroids = kmeans(np.concatenate(sample), n_lists, iterations)
+        norms = (centroids * centroids).sum(axis=1)
+
+        staging = self.root.rstrip(os.sep) + ".rebuild"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(os.path.join(staging, "lists"))
+        for cell in range(self.n_lists):
+            records = self._open_cell(cell)
+            if records is None:
+                continue
+            for start in range(0, len(records), SCAN_ROWS):
+                block = np.asarray(records[start:start + SCAN_ROWS])
+                targets = _sq_distances(block["vector"], centroids, norms).argmin(axis=1)
+                self._append(staging, targets, block)
+        self._write_meta(staging, self.scale, self.offset, centroids)
+        retired = self.root.rstrip(os.sep) + ".old"
+        shutil.rmtree(retired, ignore_errors=True)
+        os.rename(self.root, retired)
+        os.rename(staging, self.root)
+        self._load_meta()
+        shutil.rmtree(retired, ignore_errors=True)
+
+    def stats(self):
+        sizes = np.array([self._cell_rows(cell) for cell in range(self.n_lists)])
+        return {"rows": int(sizes.sum()), "lists": self.n_lists, "largest_list": int(sizes.max()),
+                "empty_lists": int((sizes == 0).sum()), "bytes": int(sizes.sum()) * RECORD_DTYPE.itemsize}
+
+
+def _frame_labels(frame, engine, X):
+    """Crop codes from a label or crop column, or predicted when the file has neither"""
+    columns = {column.lower(): column for column in frame.columns}
+    if "label" in columns:
+        return frame[columns["label"]].to_numpy(dtype=np.int64)
+    if "crop" in columns:
+        return frame[columns["crop"]].str.lower().map(_CROP_CODES).fillna(0).to_numpy(dtype=np.int64)
+    return engine.predict(validate(X).X)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Similar-farms nearest-neighbour index")
+    parser.add_argument("--index", default=SIMILAR_DIR, help="index directory")
+    parser.add_argument("--model", default=MODEL_PATH, help="path to the trained model")
+    parser.add_argument("--scaler", default=SCALER_PATH, help="path to the fitted scaler")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="import a CSV or Parquet file of fields (crop/label column optional)")
+    add.add_argument("input")
+    add.add_argument("--chunk-size", type=int, default=100_000)
+    add.add_argument("--lists", type=int, default=DEFAULT_LISTS, help="cells when creating a new index")
+    query = commands.add_parser("query", help="nearest stored fields to one set of readings")
+    query.add_argument("values", nargs=len(FEATURES), type=float, metavar="VALUE", help=" ".join(FEATURES))
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    rebuild = commands.add_parser("rebuild", help="retrain the cells on the stored rows")
+    rebuild.add_argument("--lists", type=int, default=None)
+    commands.add_parser("stats", help="index size and balance")
+    args = parser.parse_args(argv)
+
+    try:
+        model, scaler = load_artifacts(args.model, args.scaler)
+    except FileNotFoundError as e:
+        parser.exit(1, f"Model files not found: {e}\n")
+    index = SimilarFarmsIndex(args.index, scaler, getattr(args, "lists", None) or DEFAULT_LISTS)
+
+    if args.command == "add":
+        from inference import InferenceEngine
+
+        engine = InferenceEngine(model, scaler)
+        start, rows = time.perf_counter(), 0
+        for frame in read_chunks(args.input, args.chunk_size):
+            X = feature_block(frame)
+            index.add(X, _frame_labels(frame, engine, X))
+            rows += index.flush()
+        print(f"Indexed {rows} rows in {time.perf_counter() - start:.1f}s ({len(index)} total)", file=sys.stderr)
+    elif args.command == "query":
+        start = time.perf_counter()
+        result = index.nearest(args.values, args.k, args.nprobe)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(result.to_string(index=False))
+        print(f"{elapsed:.1f} ms over {len(index)} rows", file=sys.stderr)
+    elif args.command == "rebuild":
+        index.rebuild(args.lists)
+    if args.command != "query":
+        print(json.dumps(index.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crop_model import crop_dict  # noqa: E402
+from inference import random_samples  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def training_data():
+    """Rows within the slider bounds labelled by their nearest of 22 random centres"""
+    X = random_samples(3000, seed=1)
+    centres = random_samples(len(crop_dict), seed=2)
+    span = X.max(axis=0) - X.min(axis=0)
+    distances = (((X[:, None, :] - centres[None, :, :]) / span) ** 2).sum(axis=2)
+    y = np.array(sorted(crop_dict))[distances.argmin(axis=1)]
+    return X, y
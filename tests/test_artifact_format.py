@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import AdaBoostClassifier, BaggingClassifier, ExtraTreesClassifier, RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler, RobustScaler, StandardScaler
+from sklearn.tree import DecisionTreeClassifier
+
+import artifact_format
+from drift import DriftMonitor, load_reference, reference_from_scaler
+from inference import InferenceEngine, random_samples
+
+
+def fit(model, scaler, training_data):
+    X, y = training_data
+    scaler = scaler.fit(X)
+    return model.fit(scaler.transform(X), y), scaler
+
+
+@pytest.mark.parametrize("model", [
+    RandomForestClassifier(n_estimators=10, random_state=0),
+    ExtraTreesClassifier(n_estimators=10, random_state=0),
+    DecisionTreeClassifier(random_state=0),
+], ids=type)
+@pytest.mark.parametrize("scaler", [MinMaxScaler(), StandardScaler()], ids=type)
+def test_round_trip_predicts_like_sklearn(model, scaler, training_data, tmp_path):
+    model, scaler = fit(model, scaler, training_data)
+    path = tmp_path / "model.cropz"
+    artifact_format.export(model, scaler, str(path))
+    flat_model, flat_scaler = artifact_format.load(str(path))
+    X = random_samples(2000, seed=5)
+    expected = model.predict(scaler.transform(X))
+    engine = InferenceEngine(flat_model, flat_scaler)
+    assert engine.kind == "flat"
+    np.testing.assert_array_equal(engine.predict(X), expected)
+    np.testing.assert_allclose(engine.predict_proba(X), model.predict_proba(scaler.transform(X)), atol=1e-6)
+
+
+@pytest.mark.parametrize("model", [
+    AdaBoostClassifier(DecisionTreeClassifier(max_depth=3), n_estimators=5, algorithm="SAMME", random_state=0),
+    BaggingClassifier(DecisionTreeClassifier(), n_estimators=5, max_features=0.6, random_state=0),
+], ids=type)
+def test_refuses_models_that_are_not_plain_tree_averages(model, training_data, tmp_path):
+    model, scaler = fit(model, MinMaxScaler(), training_data)
+    with pytest.raises(artifact_format.ArtifactError, match="can be exported"):
+        artifact_format.export(model, scaler, str(tmp_path / "model.cropz"))
+
+
+def test_refuses_unsupported_scalers(training_data, tmp_path):
+    model, scaler = fit(DecisionTreeClassifier(random_state=0), RobustScaler(), training_data)
+    with pytest.raises(artifact_format.ArtifactError, match="MinMaxScaler and StandardScaler"):
+        artifact_format.export(model, scaler, str(tmp_path / "model.cropz"))
+
+
+def test_corrupted_and_truncated_files_are_rejected(training_data, tmp_path):
+    model, scaler = fit(DecisionTreeClassifier(random_state=0), MinMaxScaler(), training_data)
+    path = tmp_path / "model.cropz"
+    artifact_format.export(model, scaler, str(path))
+    data = bytearray(path.read_bytes())
+    data[-10] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(artifact_format.ArtifactError, match="checksum"):
+        artifact_format.load(str(path))
+    path.write_bytes(bytes(data[:-100]))
+    with pytest.raises(artifact_format.ArtifactError, match="truncated"):
+        artifact_format.load(str(path))
+
+
+@pytest.mark.parametrize("scaler", [MinMaxScaler(), StandardScaler()], ids=type)
+def test_flat_scaler_carries_the_drift_reference(scaler, training_data, tmp_path):
+    model, scaler = fit(RandomForestClassifier(n_estimators=5, random_state=0), scaler, training_data)
+    path = tmp_path / "model.cropz"
+    artifact_format.export(model, scaler, str(path))
+    _, flat_scaler = artifact_format.load(str(path))
+    reference = load_reference(flat_scaler, str(tmp_path / "missing.json"))
+    assert reference == reference_from_scaler(scaler)
+    monitor = DriftMonitor(reference)
+    monitor.observe_many(training_data[0][:100] * 3)
+    monitor.update()
+    assert max(entry["score"] for entry in monitor.report()["total"].values()) > 1
+
+
+def test_no_reference_is_reported_as_such(training_data):
+    assert reference_from_scaler(RobustScaler().fit(training_data[0])) is None
+    assert reference_from_scaler(StandardScaler(with_std=False).fit(training_data[0])) is None
+    monitor = DriftMonitor(None)
+    monitor.observe_many(training_data[0][:10])
+    monitor.update()
+    assert monitor.report() == {"reference": None, "observations": 10, "window": None, "total": None}
+    assert monitor.metric_samples() == [("crop_drift_observations_total", "counter", {}, 10)]
@@ -0,0 +1,55 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+import cache_backend
+from cache_backend import RedisBackend, StandInServer, decode_value, encode_value
+from prediction_cache import SharedPredictionCache, ranking_entry
+
+ROW = (90, 42, 43, 20.9, 82.0, 6.5, 202.9)
+
+
+@pytest.fixture
+def backend():
+    server = StandInServer(("127.0.0.1", 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    backend = RedisBackend(f"redis://127.0.0.1:{server.server_address[1]}/0", timeout=1.0)
+    yield backend
+    backend.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_values_round_trip_as_json():
+    value = {"ranking": [[8, 0.75], [1, 0.25]], "figure": "x" * 5000}
+    for data in (encode_value(value["ranking"]), encode_value(value)):
+        assert data[:1] in (b"j", b"z")
+    assert decode_value(encode_value(value)) == value
+
+
+def test_pickled_values_are_never_loaded():
+    with pytest.raises(ValueError):
+        decode_value(b"p" + pickle.dumps([1, 2]))
+    with pytest.raises(TypeError):
+        encode_value(object())
+
+
+def test_rankings_are_shared_per_length_and_version(backend):
+    top3 = SharedPredictionCache(backend, top_k=3)
+    top3.put(ROW, ranking_entry([8, 1, 20], [0.7, 0.2, 0.1]), "a1")
+    deadline = time.monotonic() + 5
+    while backend.stats()["writes"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    other_replica = SharedPredictionCache(backend, top_k=3)
+    assert other_replica.get(ROW, version="a1") == [[8, 0.7], [1, 0.2], [20, 0.1]]
+    assert SharedPredictionCache(backend, top_k=5).get(ROW, version="a1") is None
+    assert SharedPredictionCache(backend, top_k=3).get(ROW, version="b2") is None
+
+
+def test_encode_key_separates_kinds_and_extra():
+    steps = (1, -2, 300)
+    keys = {cache_backend.encode_key(kind, "abcdef123456", steps, extra)
+            for kind in (cache_backend.PREDICTION, cache_backend.SENSITIVITY) for extra in (b"", b"\x03")}
+    assert len(keys) == 4
@@ -0,0 +1,16 @@
+from crop_catalogue import CATALOGUE_PATH, CropCatalogue
+
+
+def test_values_on_a_range_bound_fit():
+    catalogue = CropCatalogue.load(CATALOGUE_PATH)
+    labels = catalogue.label_array(["Cotton", "Mungbean"])
+    # 5.8 is Cotton's pH minimum and 7.2 Mungbean's maximum; 20 and 35 are their temperature bounds
+    temperature_ok, ph_ok = catalogue.fits(labels, [20.0, 35.0], [5.8, 7.2])
+    assert temperature_ok.tolist() == [True, True]
+    assert ph_ok.tolist() == [True, True]
+
+
+def test_unknown_crops_never_fit():
+    catalogue = CropCatalogue.load(CATALOGUE_PATH)
+    temperature_ok, ph_ok = catalogue.fits(catalogue.label_array(["Quinoa"]), 25.0, 6.5)
+    assert not temperature_ok.any() and not ph_ok.any()
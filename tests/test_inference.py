@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import AdaBoostClassifier, BaggingClassifier, ExtraTreesClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import MinMaxScaler, RobustScaler, StandardScaler
+from sklearn.svm import SVC, LinearSVC
+from sklearn.tree import DecisionTreeClassifier
+
+from inference import InferenceEngine, random_samples, scaler_affine
+
+SCALERS = {
+    "minmax": lambda: MinMaxScaler(),
+    "standard": lambda: StandardScaler(),
+    "standard-no-mean": lambda: StandardScaler(with_mean=False),
+    "standard-no-std": lambda: StandardScaler(with_std=False),
+    "robust": lambda: RobustScaler(),
+}
+
+MODELS = {
+    "forest": lambda: RandomForestClassifier(n_estimators=15, random_state=0),
+    "extra-trees": lambda: ExtraTreesClassifier(n_estimators=15, random_state=0),
+    "tree": lambda: DecisionTreeClassifier(random_state=0),
+    "adaboost": lambda: AdaBoostClassifier(DecisionTreeClassifier(max_depth=3), n_estimators=10, algorithm="SAMME",
+                                           random_state=0),
+    "bagging": lambda: BaggingClassifier(DecisionTreeClassifier(), n_estimators=10, max_features=0.6, random_state=0),
+    "logistic": lambda: LogisticRegression(max_iter=500),
+    "linear-svc": lambda: LinearSVC(dual=False),
+    "svc-linear-ovo": lambda: SVC(kernel="linear"),
+}
+
+
+def fit(model_name, scaler_name, training_data):
+    X, y = training_data
+    scaler = SCALERS[scaler_name]().fit(X)
+    model = MODELS[model_name]().fit(scaler.transform(X), y)
+    return model, scaler
+
+
+@pytest.mark.parametrize("scaler_name", sorted(SCALERS))
+@pytest.mark.parametrize("model_name", sorted(MODELS))
+def test_predict_matches_sklearn(model_name, scaler_name, training_data):
+    model, scaler = fit(model_name, scaler_name, training_data)
+    engine = InferenceEngine(model, scaler, block_size=1000)
+    X = random_samples(2500, seed=3)
+    expected = model.predict(scaler.transform(X))
+    np.testing.assert_array_equal(engine.predict(X), expected)
+    assert engine.predict_one(*X[0]) == expected[0]
+
+
+@pytest.mark.parametrize("model_name", ["forest", "extra-trees", "tree", "adaboost", "bagging", "logistic"])
+def test_proba_and_top_k_match_sklearn(model_name, training_data):
+    model, scaler = fit(model_name, "minmax", training_data)
+    engine = InferenceEngine(model, scaler)
+    X = random_samples(500, seed=4)
+    expected = model.predict_proba(scaler.transform(X))
+    np.testing.assert_allclose(engine.predict_proba(X), expected, atol=1e-9)
+    labels, proba = engine.top_k(X, 3)
+    np.testing.assert_array_equal(labels[:, 0], model.classes_[expected.argmax(axis=1)])
+    np.testing.assert_allclose(proba[:, 0], expected.max(axis=1), atol=1e-9)
+
+
+def test_fast_paths_only_for_supported_models(training_data):
+    kinds = {name: InferenceEngine(*fit(name, "minmax", training_data)).kind for name in MODELS}
+    assert kinds["forest"] == kinds["extra-trees"] == kinds["tree"] == "forest"
+    assert kinds["logistic"] == kinds["linear-svc"] == "linear"
+    assert kinds["adaboost"] == kinds["bagging"] == kinds["svc-linear-ovo"] == "generic"
+
+
+def test_unsupported_scalers_are_not_folded(training_data):
+    X, _ = training_data
+    assert scaler_affine(RobustScaler().fit(X)) is None
+    assert scaler_affine(MinMaxScaler(clip=True).fit(X)) is None
+    kind, scale, mean = scaler_affine(StandardScaler(with_mean=False).fit(X))
+    assert kind == "standard" and not mean.any()
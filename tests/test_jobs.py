@@ -0,0 +1,90 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler
+
+from inference import random_samples
+from jobs import DONE, FAILED, RASTER, SWEEP, JobStore, JobWorker, raster_input
+from model_loader import ModelBundle, ModelLoader
+
+
+class ConstantEngine:
+    def __init__(self, label):
+        self.label = label
+
+    def predict(self, X):
+        return np.full(len(X), self.label)
+
+
+class SwappingLoader:
+    """Loader stand-in whose model is replaced after the first chunk of a job"""
+
+    def __init__(self):
+        self.bundle = ModelBundle(None, None, ConstantEngine(1), "aaaaaaaaaaaa")
+
+    def swap(self):
+        self.bundle = ModelBundle(None, None, ConstantEngine(2), "bbbbbbbbbbbb")
+
+
+def test_a_job_keeps_the_model_it_started_with(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"))
+    loader = SwappingLoader()
+    job_id = store.submit(SWEEP, {"base": [50, 50, 50, 25, 50, 7, 100], "pair": ["N", "rainfall"],
+                                  "points": 20, "chunk_size": 100})
+    progress = store.progress
+
+    def progress_then_reload(*args, **kwargs):
+        progress(*args, **kwargs)
+        loader.swap()
+
+    store.progress = progress_then_reload
+    assert JobWorker(store, loader).run_next()
+    job = store.get(job_id)
+    assert job["state"] == DONE and job["model_version"] == "aaaaaaaaaaaa"
+    assert set(pd.read_csv(job["result"]["path"])["label"]) == {1}
+
+
+def test_raster_inputs_must_stay_under_the_raster_directory(tmp_path):
+    root = tmp_path / "rasters"
+    root.mkdir()
+    (root / "district.npy").write_bytes(b"")
+    (tmp_path / "secret.npy").write_bytes(b"")
+    assert raster_input("district.npy", str(root)) == str((root / "district.npy").resolve())
+    for path in ("../secret.npy", str(tmp_path / "secret.npy"), "missing.npy"):
+        with pytest.raises(ValueError):
+            raster_input(path, str(root))
+
+
+def write_artifacts(tmp_path, training_data, seed):
+    X, y = training_data
+    model_path, scaler_path = str(tmp_path / "model.pkl"), str(tmp_path / "scaler.pkl")
+    scaler = MinMaxScaler().fit(X)
+    joblib.dump(RandomForestClassifier(n_estimators=5, max_depth=6, random_state=seed).fit(scaler.transform(X), y),
+                model_path)
+    joblib.dump(scaler, scaler_path)
+    return model_path, scaler_path
+
+
+def test_raster_workers_only_load_the_jobs_model(tmp_path, training_data):
+    paths = write_artifacts(tmp_path, training_data, seed=0)
+    loader = ModelLoader(*paths, mmap_mode=None)
+    assert loader.wait(30)
+    layers = str(tmp_path / "stack.npy")
+    np.save(layers, random_samples(40 * 30, seed=4).T.reshape(7, 40, 30))
+    store = JobStore(str(tmp_path / "jobs"))
+
+    done = store.submit(RASTER, {"input": layers, "workers": 1, "tile": 16})
+    assert JobWorker(store, loader).run_next()
+    job = store.get(done)
+    assert job["state"] == DONE and job["model_version"] == loader.version
+    expected = loader.engine.predict(np.load(layers).reshape(7, -1).T).reshape(40, 30)
+    assert (np.load(job["result"]["path"]) == expected).all()
+
+    # Retrained on disk, but not yet reloaded: the workers must not pick up the new files
+    write_artifacts(tmp_path, training_data, seed=1)
+    failed = store.submit(RASTER, {"input": layers, "workers": 1, "tile": 16})
+    assert JobWorker(store, loader).run_next()
+    job = store.get(failed)
+    assert job["state"] == FAILED and loader.version in job["error"]
@@ -0,0 +1,32 @@
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler
+
+from lookup_table import DecisionTable, build
+from model_loader import ModelLoader
+
+
+def write_artifacts(tmp_path, training_data, seed):
+    X, y = training_data
+    model_path, scaler_path = str(tmp_path / "model.pkl"), str(tmp_path / "scaler.pkl")
+    scaler = MinMaxScaler().fit(X)
+    joblib.dump(RandomForestClassifier(n_estimators=5, max_depth=6, random_state=seed).fit(scaler.transform(X), y),
+                model_path)
+    joblib.dump(scaler, scaler_path)
+    return model_path, scaler_path
+
+
+def test_table_is_only_used_with_the_model_it_was_built_for(tmp_path, training_data):
+    paths = write_artifacts(tmp_path, training_data, seed=0)
+    out_dir = str(tmp_path / "table")
+    build(out_dir, [3] * 7, *paths, workers=1, samples=100)
+    loader = ModelLoader(*paths, mmap_mode=None)
+    assert loader.wait(30)
+    table = DecisionTable.load(out_dir)
+    assert not table.is_stale(loader.version)
+
+    write_artifacts(tmp_path, training_data, seed=1)
+    retrained = ModelLoader(*paths, mmap_mode=None)
+    assert retrained.wait(30)
+    assert retrained.version != loader.version
+    assert table.is_stale(retrained.version)
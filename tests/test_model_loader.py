@@ -0,0 +1,54 @@
+import time
+
+import joblib
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler
+
+from model_loader import FAILED, ModelLoader
+
+
+@pytest.fixture
+def write_artifacts(tmp_path, training_data):
+    X, y = training_data
+    model_path, scaler_path = str(tmp_path / "model.pkl"), str(tmp_path / "scaler.pkl")
+
+    def write(seed):
+        scaler = MinMaxScaler().fit(X)
+        model = RandomForestClassifier(n_estimators=5, max_depth=6, random_state=seed).fit(scaler.transform(X), y)
+        joblib.dump(model, model_path)
+        joblib.dump(scaler, scaler_path)
+
+    write.paths = (model_path, scaler_path)
+    return write
+
+
+def wait_for_reload(loader):
+    assert loader.reload()
+    while loader._reloading:
+        time.sleep(0.01)
+
+
+def test_bundle_is_swapped_as_a_unit(write_artifacts):
+    write_artifacts(seed=0)
+    loader = ModelLoader(*write_artifacts.paths, mmap_mode=None)
+    assert loader.wait(30)
+    first = loader.bundle
+    assert (loader.model, loader.scaler, loader.engine, loader.version) == tuple(first)
+
+    write_artifacts(seed=1)
+    wait_for_reload(loader)
+    assert loader.bundle is not first and loader.version != first.version
+    # Whoever held the old bundle still sees a consistent model, engine and version
+    assert first.engine.model is first.model
+
+
+def test_listeners_run_after_a_reload_that_recovers_a_failed_load(write_artifacts):
+    loader = ModelLoader(*write_artifacts.paths, mmap_mode=None)
+    assert not loader.wait(30) and loader.state == FAILED
+    seen = []
+    loader.add_listener(lambda loader: seen.append(loader.version))
+
+    write_artifacts(seed=0)
+    wait_for_reload(loader)
+    assert loader.ready and seen == [loader.version]
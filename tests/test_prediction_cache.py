@@ -0,0 +1,103 @@
+import os
+import time
+
+import pytest
+
+import prediction_cache
+from prediction_cache import PredictionCache
+
+ROW = (90, 42, 43, 20.9, 82.0, 6.5, 202.9)
+
+
+@pytest.fixture
+def artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(prediction_cache, "ARTIFACT_CHECK_SECONDS", 0.0)
+    paths = [tmp_path / "model.pkl", tmp_path / "scaler.pkl"]
+    for path in paths:
+        path.write_bytes(b"v1")
+    return [str(path) for path in paths]
+
+
+def test_hit_within_a_slider_step_and_miss_outside(artifacts):
+    cache = PredictionCache(artifact_paths=artifacts)
+    cache.put(ROW, "rice")
+    assert cache.get((90, 42, 43, 20.901, 82.0, 6.5, 202.9)) == "rice"
+    assert cache.get((91, 42, 43, 20.9, 82.0, 6.5, 202.9)) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_changed_artifact_file_drops_every_entry(artifacts):
+    cache = PredictionCache(artifact_paths=artifacts)
+    cache.put(ROW, "rice")
+    with open(artifacts[0], "wb") as f:
+        f.write(b"retrained")
+    os.utime(artifacts[0], ns=(time.time_ns() + 10**9,) * 2)
+    assert cache.get(ROW) is None
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_new_model_version_drops_entries(artifacts):
+    cache = PredictionCache(artifact_paths=artifacts)
+    cache.set_version("a")
+    cache.put(ROW, "rice")
+    cache.set_version("a")
+    assert cache.get(ROW) == "rice"
+    cache.set_version("b")
+    assert cache.get(ROW) is None
+
+
+def test_results_of_a_swapped_out_model_are_not_stored(artifacts):
+    cache = PredictionCache(artifact_paths=artifacts)
+    assert cache.get(ROW, version="a") is None
+    assert cache.version == "a"
+    cache.set_version("b")
+    # A request that read the old bundle finishes after the reload
+    assert cache.put(ROW, "rice", version="a") is False
+    assert cache.get(ROW, version="b") is None
+    assert cache.put(ROW, "maize", version="b") is True
+    assert cache.get(ROW, version="a") is None
+    assert cache.get(ROW, version="b") == "maize"
+
+
+def test_entries_expire_after_ttl(artifacts):
+    cache = PredictionCache(ttl=0.05, artifact_paths=artifacts)
+    cache.put(ROW, "rice")
+    assert cache.get(ROW) == "rice"
+    time.sleep(0.1)
+    assert cache.get(ROW) is None and cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(artifacts):
+    cache = PredictionCache(max_entries=2, artifact_paths=artifacts)
+    rows = [(n, 42, 43, 20.9, 82.0, 6.5, 202.9) for n in range(3)]
+    cache.put(rows[0], 0)
+    cache.put(rows[1], 1)
+    cache.get(rows[0])
+    cache.put(rows[2], 2)
+    assert cache.get(rows[1]) is None
+    assert cache.get(rows[0]) == 0 and cache.get(rows[2]) == 2
+
+
+def test_byte_cap_bounds_memory(artifacts):
+    cache = PredictionCache(max_bytes=5000, artifact_paths=artifacts)
+    for n in range(100):
+        cache.put((n, 42, 43, 20.9, 82.0, 6.5, 202.9), "x" * 100)
+    stats = cache.stats()
+    assert stats["bytes"] <= 5000 and stats["evictions"] == 100 - stats["entries"]
+
+
+def test_get_or_compute_calls_compute_once(artifacts):
+    cache = PredictionCache(artifact_paths=artifacts)
+    calls = []
+    compute = lambda *values: calls.append(values) or "rice"  # noqa: E731
+    assert cache.get_or_compute(ROW, compute) == "rice"
+    assert cache.get_or_compute(ROW, compute) == "rice"
+    assert len(calls) == 1
+
+
+def test_on_grid_only_for_values_on_the_slider_steps():
+    assert prediction_cache.on_grid(ROW)
+    assert prediction_cache.on_grid((90.0, 42, 43, 20.87, 82.0, 6.5, 202.9))
+    assert not prediction_cache.on_grid((90, 42, 43, 20.874, 82.0, 6.5, 202.9))
+    assert not prediction_cache.on_grid((89.6, 42, 43, 20.9, 82.0, 6.5, 202.9))
+    assert not prediction_cache.on_grid((90, 42, 43, 20.9, 82.0, 6.54, 202.9))
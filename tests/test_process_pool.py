@@ -0,0 +1,49 @@
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler
+
+from inference import InferenceEngine, random_samples
+from process_pool import ProcessInferencePool
+
+
+@pytest.fixture(scope="module")
+def pool(tmp_path_factory, training_data):
+    X, y = training_data
+    root = tmp_path_factory.mktemp("pool")
+    scaler = MinMaxScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=5, max_depth=6, random_state=0).fit(scaler.transform(X), y)
+    model_path, scaler_path = str(root / "model.pkl"), str(root / "scaler.pkl")
+    joblib.dump(model, model_path)
+    joblib.dump(scaler, scaler_path)
+    pool = ProcessInferencePool(2, model_path, scaler_path).start()
+    pool.engine = InferenceEngine(model, scaler)
+    yield pool
+    pool.close()
+
+
+def test_matches_the_in_process_engine(pool):
+    X = random_samples(500, seed=9)
+    np.testing.assert_array_equal(pool.predict(X), pool.engine.predict(X))
+    labels, proba = pool.top_k(X, 3)
+    expected_labels, expected_proba = pool.engine.top_k(X, 3)
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_allclose(proba, expected_proba)
+
+
+def test_workers_that_failed_to_reload_refuse_calls_until_a_reload_succeeds(pool):
+    with open(pool.model_path, "rb") as f:
+        model = f.read()
+    with open(pool.model_path, "wb") as f:
+        f.write(b"not a model")
+    with pytest.raises(RuntimeError):
+        pool.reload()
+    with pytest.raises(RuntimeError, match="previous model"):
+        pool.top_k(random_samples(10, seed=10), 3)
+
+    with open(pool.model_path, "wb") as f:
+        f.write(model)
+    pool.reload()
+    X = random_samples(10, seed=10)
+    np.testing.assert_array_equal(pool.predict(X), pool.engine.predict(X))
@@ -0,0 +1,31 @@
+import numpy as np
+
+from crop_model import FEATURES
+from sensitivity import change_points, sweep
+
+
+class ThresholdEngine:
+    """Rice below 50 kg/ha of N, Maize from 50 up"""
+
+    def predict(self, X):
+        X = np.atleast_2d(X)
+        return np.where(X[:, FEATURES.index("N")] < 50, 1, 2)
+
+
+def test_change_points_compare_against_the_baseline_not_the_nearest_grid_point():
+    base = [49, 50, 50, 25, 70, 6.5, 150]
+    result = sweep(ThresholdEngine(), base, points=11, grid_points=3)
+    assert result["baseline_label"] == 1
+    # The grid point at or above 49 N is already Maize: that is the change above, not the crop at 49
+    below, above = change_points(result, "N", 49)
+    assert below is None
+    assert above is not None and above[1] == "Maize" and above[0] >= 50
+
+
+def test_change_points_on_a_grid_point():
+    base = [0, 50, 50, 25, 70, 6.5, 150]
+    result = sweep(ThresholdEngine(), base, points=11, grid_points=3)
+    below, above = change_points(result, "N", 0)
+    assert below is None
+    assert above[1] == "Maize"
+    assert change_points(result, "K", 50) == (None, None)
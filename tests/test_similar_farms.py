@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+from inference import random_samples
+from similar_farms import RECORD_DTYPE, SimilarFarmsIndex, index_scaling
+
+ROW = [90, 42, 43, 20.8, 82, 6.5, 203]
+
+
+@pytest.fixture
+def scaler(training_data):
+    return MinMaxScaler().fit(training_data[0])
+
+
+@pytest.fixture
+def root(tmp_path, scaler):
+    root = str(tmp_path / "similar")
+    SimilarFarmsIndex(root, scaler, n_lists=16)
+    return root
+
+
+@pytest.mark.parametrize("make", [MinMaxScaler, StandardScaler])
+def test_index_scaling_matches_the_scaler(training_data, make):
+    scaler = make().fit(training_data[0])
+    scale, offset = index_scaling(scaler)
+    X = random_samples(100, seed=4)
+    np.testing.assert_allclose(X * scale + offset, scaler.transform(X), rtol=1e-9, atol=1e-9)
+
+
+def test_labels_above_255_are_kept(root):
+    index = SimilarFarmsIndex(root)
+    index.add([ROW], 300)
+    assert index.nearest(ROW, 1)["label"].tolist() == [300]
+    index.flush()
+    assert SimilarFarmsIndex(root).nearest(ROW, 1)["label"].tolist() == [300]
+
+
+def test_instances_sharing_a_directory_see_each_others_rows(root):
+    first, second = SimilarFarmsIndex(root), SimilarFarmsIndex(root)
+    X = random_samples(500, seed=5)
+    first.add(X[:250], 1)
+    second.add(X[250:], 2)
+    assert first.flush() == 250 and second.flush() == 250
+    assert len(SimilarFarmsIndex(root)) == 500
+    # Opening the index repairs nothing that is whole
+    assert SimilarFarmsIndex(root).stats()["rows"] == 500
+
+
+def test_an_interrupted_append_is_cut_back_to_whole_records(root):
+    index = SimilarFarmsIndex(root)
+    index.add(random_samples(50, seed=6), 3)
+    index.flush()
+    cell = next(cell for cell in range(index.n_lists) if index._cell_rows(cell))
+    with open(index._path(cell), "ab") as f:
+        f.write(b"\0" * (RECORD_DTYPE.itemsize // 2))
+    assert len(SimilarFarmsIndex(root)) == 50
+    assert os.path.getsize(index._path(cell)) % RECORD_DTYPE.itemsize == 0
+
+
+def test_other_instances_switch_to_rebuilt_cells(root):
+    writer, other = SimilarFarmsIndex(root), SimilarFarmsIndex(root)
+    writer.add(random_samples(400, seed=7), 4)
+    writer.flush()
+    writer.rebuild(8)
+    other.add([ROW], 5)
+    other.flush()
+    assert other.n_lists == 8
+    assert SimilarFarmsIndex(root).stats()["rows"] == 401
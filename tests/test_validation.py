@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from inference import random_samples
+from validation import BLOCK_ROWS, CLAMP, FILL, HIGH, LOW, REJECT, row_issues, validate
+
+
+def reference(X, policy):
+    """Row-at-a-time reading of the rules validate() applies to whole blocks"""
+    X = np.array(X, dtype=np.float64)
+    bad = ~np.isfinite(X)
+    outside = (X < LOW) | (X > HIGH)
+    fixed = np.where(bad, FILL, np.clip(X, LOW, HIGH))
+    bad_rows, outside_rows = bad.any(axis=1), outside.any(axis=1)
+    if policy == REJECT:
+        return fixed, bad_rows | outside_rows, np.zeros(len(X), dtype=bool)
+    return fixed, bad_rows, outside_rows & ~bad_rows
+
+
+@pytest.mark.parametrize("policy", [CLAMP, REJECT])
+def test_matches_reference_across_blocks(policy):
+    rng = np.random.default_rng(0)
+    X = random_samples(2 * BLOCK_ROWS + 123, seed=6)
+    X[rng.random(X.shape) < 0.01] = np.nan
+    X[rng.random(X.shape) < 0.01] = np.inf
+    X[rng.random(X.shape) < 0.01] = -np.inf
+    X[rng.random(X.shape) < 0.02] *= 3
+    X[rng.random(X.shape) < 0.02] -= 500
+    checked = validate(X, policy)
+    fixed, invalid, clamped = reference(X, policy)
+    np.testing.assert_array_equal(checked.X, fixed)
+    np.testing.assert_array_equal(checked.invalid, invalid)
+    np.testing.assert_array_equal(checked.clamped, clamped)
+    assert np.isfinite(checked.X).all()
+
+
+def test_clean_rows_pass_untouched_and_input_is_copied():
+    X = random_samples(100, seed=7)
+    original = X.copy()
+    checked = validate(X)
+    assert not checked.invalid.any() and not checked.clamped.any()
+    np.testing.assert_array_equal(checked.X, original)
+    X[0, 0] = -1
+    assert validate(X).X is not X and X[0, 0] == -1
+    in_place = validate(X, copy=False)
+    assert in_place.X is X and X[0, 0] == LOW[0]
+
+
+def test_single_row_and_bad_shapes():
+    checked = validate([1000, 42, 43, 20.9, 82.0, 6.5, 202.9])
+    assert checked.X.shape == (1, 7) and checked.clamped[0] and checked.X[0, 0] == HIGH[0]
+    with pytest.raises(ValueError):
+        validate(np.zeros((3, 6)))
+    with pytest.raises(ValueError):
+        validate(np.zeros((1, 7)), policy="ignore")
+
+
+def test_row_issues_names_each_problem():
+    issues = row_issues([500, 42, float("nan"), 20.9, -5, 6.5, 202.9])
+    assert issues == ["N 500 is above 140", "K is missing or not a number", "humidity -5 is below 0"]
+    assert row_issues([90, 42, 43, 20.9, 82.0, 6.5, 202.9]) == []
@@ -0,0 +1,117 @@
+"""Vectorized validation and clamping of raw feature rows.
+
+The sliders keep interactive inputs inside FEATURE_BOUNDS, but rows from files
+and the API are not limited. ``validate`` checks a block against the same bounds
+in cache-sized chunks: rows with NaN or infinite values are flagged invalid and
+filled so the rest of the block can still be predicted in one call, and
+out-of-range values are clamped to the nearest bound and flagged (or, with
+policy="reject", the row is flagged invalid as well). Callers mask the results
+of invalid rows instead of failing the whole batch.
+"""
+import numpy as np
+
+from crop_model import FEATURE_BOUNDS, FEATURES
+
+CLAMP = "clamp"
+REJECT = "reject"
+POLICIES = (CLAMP, REJECT)
+# Rows checked per pass, small enough that a chunk and its masks stay in cache
+BLOCK_ROWS = 8192
+
+LOW = np.array([FEATURE_BOUNDS[name][0] for name in FEATURES], dtype=np.float64)
+HIGH = np.array([FEATURE_BOUNDS[name][1] for name in FEATURES], dtype=np.float64)
+# Stand-in for non-finite values, so invalid rows don't break the prediction call
+FILL = (LOW + HIGH) / 2
+
+# Bounds repeated for a whole block, so checks run over flat contiguous memory
+_LOW_FLAT = np.tile(LOW, BLOCK_ROWS)
+_HIGH_FLAT = np.tile(HIGH, BLOCK_ROWS)
+_FILL_FLAT = np.tile(FILL, BLOCK_ROWS)
+_ONES = np.ones(len(FEATURES), dtype=np.uint8)
+
+
+def _flagged_rows(mask):
+    """Rows of a (rows, 7) boolean mask with any flag set; a uint8 dot product beats any(axis=1) on 7 columns"""
+    return (mask.view(np.uint8) @ _ONES) != 0
+
+
+class ValidationResult:
+    """Checked feature block plus per-row flags
+
+    X is the block with out-of-range values clamped and non-finite values
+    filled; invalid rows must not be reported as predictions, clamped rows were
+    predicted from values moved onto the nearest bound.
+    """
+
+    def __init__(self, X, invalid, clamped):
+        self.X = X
+        self.invalid = invalid
+        self.clamped = clamped
+
+    @property
+    def valid(self):
+        return ~self.invalid
+
+    def summary(self):
+        return {"rows": len(self.X), "invalid": int(self.invalid.sum()), "clamped": int(self.clamped.sum())}
+
+
+def validate(X, policy=CLAMP, copy=True):
+    """Check a row or a 2D block of raw feature rows against the slider bounds
+
+    With copy=False a C-contiguous float64 input block is fixed up in place.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"policy must be one of {', '.join(POLICIES)}")
+    X = np.array(X, dtype=np.float64, copy=copy, order="C", ndmin=2)
+    if X.ndim != 2 or X.shape[1] != len(FEATURES):
+        raise ValueError(f"Expected rows of {len(FEATURES)} features ({', '.join(FEATURES)})")
+    n = X.shape[0]
+    invalid = np.zeros(n, dtype=bool)
+    clamped = np.zeros(n, dtype=bool)
+    nonfinite = np.empty(min(n, BLOCK_ROWS) * len(FEATURES), dtype=bool)
+    below = np.empty_like(nonfinite)
+    above = np.empty_like(nonfinite)
+    for start in range(0, n, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, n)
+        flat = X[start:stop].reshape(-1)
+        size = flat.size
+        bad, low, high = nonfinite[:size], below[:size], above[:size]
+        np.isfinite(flat, out=bad)
+        np.logical_not(bad, out=bad)
+        # NaN compares false both ways; infinities are caught by both checks
+        np.less(flat, _LOW_FLAT[:size], out=low)
+        np.greater(flat, _HIGH_FLAT[:size], out=high)
+        any_bad, any_low, any_high = bad.any(), low.any(), high.any()
+        if not (any_bad or any_low or any_high):
+            continue
+        rows = stop - start
+        bad_rows = _flagged_rows(bad.reshape(rows, -1)) if any_bad else np.zeros(rows, dtype=bool)
+        if any_low:
+            np.copyto(flat, _LOW_FLAT[:size], where=low)
+        if any_high:
+            np.copyto(flat, _HIGH_FLAT[:size], where=high)
+        # After clamping, so -inf ends up filled rather than clamped
+        if any_bad:
+            np.copyto(flat, _FILL_FLAT[:size], where=bad)
+        np.logical_or(low, high, out=low)
+        outside = _flagged_rows(low.reshape(rows, -1))
+        if policy == REJECT:
+            invalid[start:stop] = bad_rows | outside
+        else:
+            invalid[start:stop] = bad_rows
+            clamped[start:stop] = outside & ~bad_rows
+    return ValidationResult(X, invalid, clamped)
+
+
+def row_issues(values):
+    """Human-readable problems with one row of 7 raw feature values (empty if it is in range)"""
+    issues = []
+    for name, value, low, high in zip(FEATURES, np.asarray(values, dtype=np.float64), LOW, HIGH):
+        if not np.isfinite(value):
+            issues.append(f"{name} is missing or not a number")
+        elif value < low:
+            issues.append(f"{name} {value:g} is below {low:g}")
+        elif value > high:
+            issues.append(f"{name} {value:g} is above {high:g}")
+    return issues